@@ -0,0 +1,252 @@
+"""
+cases
+
+The benchmark cases. Each case takes a `StageRecorder`, a temporary working directory and its parameters,
+measures its stages with the recorder and returns a `dict` with additional information about the run.
+
+Created by: Martin Sicho
+On: 18.10.26, 18:05
+"""
+import json
+import socket
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+
+from synthetic import synthetic_fingerprints, synthetic_smiles
+
+MANIFOLDS = ("pca", "tsne", "umap")
+RENDER_MODES = ("svg", "webgl")
+IMPORTS = {
+    "cli": "import scaffviz.cli",
+    "manifold": "from scaffviz.clustering.manifold import PCA, TSNE, UMAP; UMAP()",
+    "manifold_table": "import scaffviz.data.manifold_table",
+    "plot": "import scaffviz.depiction.plot",
+    "batch": "import scaffviz.depiction.batch",
+}
+"""Statements measured by `bench_import`, each one is what a typical entry point into the package runs first."""
+IMPORT_BUDGETS = {
+    "cli": 1.0,
+    "manifold": 2.0,
+    "manifold_table": None,
+    "plot": 2.0,
+    "batch": 2.0,
+}
+"""Default maximum import times in seconds of the statements in `IMPORTS`, `None` for the ones that need the heavy modules anyway."""
+HEAVY_MODULES = ("umap", "numba", "sklearn", "dash", "plotly.express", "qsprpred.data", "qsprpred.models", "qsprpred.plotting", "molplotly")
+"""Modules that take long to import and should only be imported by the code that uses them."""
+
+
+def make_manifold(name, n_jobs=None, random_state=42):
+    """
+    Create a manifold with the settings used in the benchmarks.
+
+    Args:
+        name: one of `MANIFOLDS`
+        n_jobs: number of jobs of the manifold
+        random_state: random state of the manifold
+
+    Returns:
+        the `Manifold`
+    """
+
+    from scaffviz.clustering.manifold import PCA, TSNE, UMAP
+
+    if name == "pca":
+        return PCA(n_jobs=n_jobs)
+    elif name == "tsne":
+        return TSNE(n_jobs=n_jobs, random_state=random_state)
+    elif name == "umap":
+        return UMAP(n_jobs=n_jobs, random_state=random_state)
+    raise ValueError(f"Unknown manifold: {name}")
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _molecule_table(recorder, work_dir, size, n_bits, random_state, name="bench"):
+    from qsprpred.data import MoleculeTable
+    from qsprpred.data.chem.scaffolds import BemisMurcko
+    from qsprpred.data.descriptors.fingerprints import MorganFP
+
+    with recorder.stage("generate"):
+        rng = np.random.default_rng(random_state)
+        df = pd.DataFrame({
+            "SMILES": synthetic_smiles(size, random_state=random_state),
+            "Value": rng.normal(6, 1, size=size),
+        })
+    with recorder.stage("table"):
+        table = MoleculeTable(name, df, smiles_col="SMILES", store_dir=work_dir)
+    with recorder.stage("scaffolds"):
+        table.addScaffolds([BemisMurcko()])
+    with recorder.stage("descriptors"):
+        table.addDescriptors([MorganFP(radius=2, nBits=n_bits)])
+    return table
+
+
+def bench_manifold(recorder, work_dir, manifold, size, descriptor_format="sparse", n_bits=2048, n_jobs=None, random_state=42):
+    """
+    Fit a manifold on synthetic fingerprints.
+
+    Args:
+        recorder: the `StageRecorder`
+        work_dir: temporary working directory
+        manifold: name of the manifold
+        size: number of fingerprints
+        descriptor_format: `"dense"`, `"sparse"` or `"packed"`, format of the fingerprints passed to the manifold
+        n_bits: length of the fingerprints
+        n_jobs: number of jobs of the manifold
+        random_state: seed of the data and the manifold
+    """
+
+    with recorder.stage("generate"):
+        X, _ = synthetic_fingerprints(size, n_bits=n_bits, random_state=random_state)
+        if descriptor_format == "dense":
+            X = X.toDense()
+        elif descriptor_format == "sparse":
+            X = X.toSparse()
+    model = make_manifold(manifold, n_jobs=n_jobs, random_state=random_state)
+    model.addCallback(recorder.manifoldCallback())
+    with recorder.stage("fit_transform"):
+        coords = model.fit_transform(X)
+    return {"shape": list(coords.shape)}
+
+
+def bench_plot(recorder, work_dir, manifold, size, render_mode="svg", descriptor_format="sparse", max_points=None, n_bits=2048, n_jobs=None, random_state=42):
+    """
+    Build a table from synthetic SMILES, embed it and make the figure of `Plot.plot`.
+
+    Args:
+        recorder: the `StageRecorder`
+        work_dir: temporary working directory
+        manifold: name of the manifold
+        size: number of molecules
+        render_mode: `"svg"` or `"webgl"`
+        descriptor_format: format of the fingerprints passed to the manifold
+        max_points: maximum number of points drawn at once (see `Plot`)
+        n_bits: length of the Morgan fingerprints
+        n_jobs: number of jobs of the manifold
+        random_state: seed of the data and the manifold
+    """
+
+    from scaffviz.data.manifold_table import ManifoldTable
+    from scaffviz.depiction.plot import Plot
+
+    table = _molecule_table(recorder, work_dir, size, n_bits, random_state)
+    model = make_manifold(manifold, n_jobs=n_jobs, random_state=random_state)
+    model.addCallback(recorder.manifoldCallback())
+    table = ManifoldTable.fromMolTable(table, view=True)
+    with recorder.stage("add_manifold_data"):
+        table.addManifoldData(model, descriptor_format=descriptor_format)
+    plot = Plot(model, save_manifold=False, max_points=max_points, n_jobs=n_jobs or 1)
+    with recorder.stage("scaffold_index"):
+        plot.getScaffoldIndex(table).getGroups(mols_per_group=10)
+    with recorder.stage("figure"):
+        fig = plot.plot(table, recalculate=False, interactive=False, render_mode=render_mode)
+    with recorder.stage("serialize"):
+        payload = fig.to_json()
+    return {
+        "points_drawn": int(sum(len(trace.x) for trace in fig.data if trace.x is not None)),
+        "figure_mb": len(payload) / 2**20,
+    }
+
+
+def bench_performance_plot(recorder, work_dir, manifold, size, plot_type="errors", n_bits=2048, n_jobs=None, random_state=42):
+    """
+    Train a small regression model on synthetic data and start its `ModelPerformancePlot`.
+
+    Args:
+        recorder: the `StageRecorder`
+        work_dir: temporary working directory
+        manifold: name of the manifold
+        size: number of molecules
+        plot_type: type of the performance plot
+        n_bits: length of the Morgan fingerprints
+        n_jobs: number of jobs of the manifold
+        random_state: seed of the data and the manifold
+    """
+
+    from qsprpred import TargetTasks
+    from qsprpred.data import QSPRDataset, ScaffoldSplit
+    from qsprpred.data.chem.scaffolds import BemisMurcko
+    from qsprpred.data.descriptors.fingerprints import MorganFP
+    from qsprpred.models.assessment.methods import CrossValAssessor, TestSetAssessor
+    from qsprpred.models.scikit_learn import SklearnModel
+    from sklearn.ensemble import RandomForestRegressor
+
+    from scaffviz.depiction.plot import ModelPerformancePlot
+
+    table = _molecule_table(recorder, work_dir, size, n_bits, random_state)
+    with recorder.stage("train"):
+        dataset = QSPRDataset.fromMolTable(table, target_props=[{"name": "Value", "task": TargetTasks.REGRESSION}])
+        dataset.prepareDataset(
+            split=ScaffoldSplit(scaffold=BemisMurcko(), test_fraction=0.2),
+            feature_calculators=[MorganFP(radius=2, nBits=n_bits)],
+        )
+        model = SklearnModel(
+            base_dir=work_dir,
+            alg=RandomForestRegressor,
+            name="bench_model",
+            parameters={"n_estimators": 10, "random_state": random_state},
+        )
+        CrossValAssessor(scoring="r2")(model, dataset)
+        TestSetAssessor(scoring="r2")(model, dataset)
+        model.fitDataset(dataset)
+    model_manifold = make_manifold(manifold, n_jobs=n_jobs, random_state=random_state)
+    model_manifold.addCallback(recorder.manifoldCallback())
+    plot = ModelPerformancePlot(
+        model_manifold,
+        [model],
+        [dataset],
+        _free_port(),
+        plot_type=plot_type,
+        async_execution=True,
+    )
+    with recorder.stage("make"):
+        plot.make()
+    return dict()
+
+
+def bench_import(recorder, work_dir, target, budget=None):
+    """
+    Measure the cold start of an entry point into the package in a fresh interpreter.
+
+    Args:
+        recorder: the `StageRecorder`
+        work_dir: temporary working directory
+        target: name of the statement to run (a key of `IMPORTS`)
+        budget: maximum import time in seconds, the case fails if it takes longer, the budget of the target in `IMPORT_BUDGETS` by default
+    """
+
+    code = "\n".join([
+        "import json, sys, time",
+        "start = time.perf_counter()",
+        IMPORTS[target],
+        "seconds = time.perf_counter() - start",
+        f"print(json.dumps({{'seconds': seconds, 'heavy': [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))",
+    ])
+    with recorder.stage("interpreter"):
+        process = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=work_dir)
+    if process.returncode != 0:
+        if "ModuleNotFoundError" in process.stderr or "ImportError" in process.stderr:
+            raise ImportError(process.stderr.strip().splitlines()[-1])
+        raise RuntimeError(process.stderr)
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    recorder.add("import", result["seconds"])
+    budget = budget if budget is not None else IMPORT_BUDGETS.get(target)
+    if budget is not None and result["seconds"] > budget:
+        raise AssertionError(f"Importing {target} took {result['seconds']:.2f} s, more than the budget of {budget} s. Heavy modules imported: {result['heavy']}")
+    return {"import_time": result["seconds"], "heavy_modules": result["heavy"]}
+
+
+CASES = {
+    "manifold": bench_manifold,
+    "plot": bench_plot,
+    "performance_plot": bench_performance_plot,
+    "import": bench_import,
+}
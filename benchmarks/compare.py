@@ -0,0 +1,84 @@
+"""
+compare
+
+Compare two benchmark result files, i.e. from two versions of the package, and report the cases that got slower or use more memory.
+
+Example:
+
+    python benchmarks/compare.py baseline.json results.json --threshold 1.2
+
+Created by: Martin Sicho
+On: 18.10.26, 18:35
+"""
+import argparse
+import json
+import sys
+from collections import defaultdict
+from statistics import median
+
+
+def case_key(result):
+    params = tuple(sorted((key, value) for key, value in result["params"].items() if key not in ("n_jobs",)))
+    return (result["case"],) + params
+
+
+def load_results(path):
+    """
+    Load a result file and aggregate repeated runs of the same case by their median.
+
+    Args:
+        path: path to the JSON file written by `run.py`
+
+    Returns:
+        a `dict` mapping case keys to `(wall_time, peak_rss_mb)` tuples, only successful runs are included
+    """
+
+    with open(path) as inp:
+        data = json.load(inp)
+    runs = defaultdict(list)
+    for result in data["results"]:
+        if result["status"] == "ok":
+            runs[case_key(result)].append((result["wall_time"], result["peak_rss_mb"]))
+    return {key: (median(run[0] for run in values), median(run[1] for run in values)) for key, values in runs.items()}
+
+
+def compare(baseline, current, threshold=1.2):
+    """
+    Compare the aggregated results of two runs.
+
+    Args:
+        baseline: results of the reference run (see `load_results`)
+        current: results of the compared run
+        threshold: ratio of the current to the baseline time or memory above which a case counts as a regression
+
+    Returns:
+        `list` of `(key, time_ratio, memory_ratio, regressed)` tuples for the cases found in both runs
+    """
+
+    ret = []
+    for key in sorted(set(baseline) & set(current), key=str):
+        time_ratio = current[key][0] / baseline[key][0] if baseline[key][0] else float("inf")
+        memory_ratio = current[key][1] / baseline[key][1] if baseline[key][1] else float("inf")
+        ret.append((key, time_ratio, memory_ratio, time_ratio > threshold or memory_ratio > threshold))
+    return ret
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two scaffviz benchmark result files.")
+    parser.add_argument("baseline", help="results of the reference run")
+    parser.add_argument("current", help="results of the compared run")
+    parser.add_argument("--threshold", type=float, default=1.2, help="time or memory ratio above which a case counts as a regression")
+    args = parser.parse_args(argv)
+
+    rows = compare(load_results(args.baseline), load_results(args.current), args.threshold)
+    regressions = 0
+    for key, time_ratio, memory_ratio, regressed in rows:
+        label = " ".join(f"{name}={value}" for name, value in key[1:] if name in ("manifold", "size", "render_mode"))
+        print(f"{key[0]:<17} {label:<45} time x{time_ratio:6.2f} memory x{memory_ratio:6.2f}{'  REGRESSION' if regressed else ''}")
+        regressions += int(regressed)
+    print(f"{len(rows)} cases compared, {regressions} regressions")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,216 @@
+"""
+harness
+
+Measurement of wall time, peak resident memory and per-stage breakdowns of the benchmark cases.
+Every case runs in a fresh process so that the memory of one case does not leak into the next.
+
+Created by: Martin Sicho
+On: 18.10.26, 17:45
+"""
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+from contextlib import contextmanager
+
+
+def _read_status(field):
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith(field):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def _reset_peak():
+    # writing 5 to clear_refs resets the peak resident set size (Linux 4.0+)
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss():
+    """
+    Get the peak resident set size of the current process.
+
+    Returns:
+        the peak resident set size in bytes
+    """
+
+    peak = _read_status("VmHWM:")
+    if peak is not None:
+        return peak
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class StageRecorder:
+    """
+    Records the wall time and peak resident memory of the stages of one benchmark case.
+    On Linux the peak memory is reset at the start of each stage, elsewhere it is the peak since the process started.
+    """
+
+    def __init__(self):
+        self.stages = dict()
+        self.resettable = _reset_peak()
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Measure a stage.
+
+        Args:
+            name: name of the stage, repeated stages are summed up
+        """
+
+        if self.resettable:
+            _reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start, peak_rss())
+
+    def add(self, name, seconds, peak=None):
+        """
+        Add a measurement of a stage.
+
+        Args:
+            name: name of the stage
+            seconds: duration of the stage
+            peak: peak resident set size during the stage in bytes
+        """
+
+        record = self.stages.setdefault(name, {"time": 0.0, "peak_rss_mb": None})
+        record["time"] += seconds
+        if peak is not None:
+            record["peak_rss_mb"] = max(record["peak_rss_mb"] or 0.0, peak / 2**20)
+
+    def manifoldCallback(self, prefix="manifold"):
+        """
+        Get a callback for `Manifold.addCallback` that records the phases of a manifold as stages.
+
+        Args:
+            prefix: prefix of the stage names
+
+        Returns:
+            the callback
+        """
+
+        def callback(manifold, phase, seconds):
+            self.add(f"{prefix}.{phase}", seconds)
+
+        return callback
+
+
+def _child(case, params, conn):
+    from cases import CASES
+
+    recorder = StageRecorder()
+    start = time.perf_counter()
+    try:
+        with tempfile.TemporaryDirectory(prefix="scaffviz_bench_") as work_dir:
+            extra = CASES[case](recorder, work_dir, **params)
+        result = {"status": "ok", "extra": extra or {}}
+    except ImportError as exc:
+        result = {"status": "skipped", "error": str(exc)}
+    except Exception:
+        result = {"status": "failed", "error": traceback.format_exc()}
+    result["wall_time"] = time.perf_counter() - start
+    result["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2**20 if sys.platform == "darwin" else 2**10)
+    result["stages"] = recorder.stages
+    conn.send(result)
+    conn.close()
+    # servers started by a case keep running in non-daemon threads, do not wait for them
+    os._exit(0)
+
+
+def run_case(case, params, timeout=None):
+    """
+    Run one benchmark case in a new process.
+
+    Args:
+        case: name of the case (a key of `cases.CASES`)
+        params: keyword arguments of the case
+        timeout: maximum time in seconds to wait for the case to finish, `None` to wait indefinitely
+
+    Returns:
+        a `dict` with the results, its `status` is one of `"ok"`, `"skipped"`, `"failed"` and `"timeout"`
+    """
+
+    ctx = multiprocessing.get_context("spawn")
+    parent_conn, child_conn = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=_child, args=(case, params, child_conn))
+    process.start()
+    child_conn.close()
+    result = None
+    if parent_conn.poll(timeout):
+        try:
+            result = parent_conn.recv()
+        except EOFError:
+            result = None
+    if process.is_alive():
+        process.terminate()
+    process.join()
+    if result is None:
+        if process.exitcode is not None and process.exitcode != 0 and process.exitcode != -15:
+            result = {"status": "failed", "error": f"Process exited with code {process.exitcode}."}
+        else:
+            result = {"status": "timeout", "error": f"Case did not finish in {timeout} seconds."}
+    return {"case": case, "params": params, **result}
+
+
+def get_metadata():
+    """
+    Collect information about the machine and the package versions the benchmarks ran with.
+
+    Returns:
+        a `dict` with the metadata
+    """
+
+    from importlib import metadata
+
+    versions = dict()
+    for package in ("scaffviz", "qsprpred", "numpy", "pandas", "scikit-learn", "umap-learn", "plotly", "dash", "rdkit"):
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+    if versions["scaffviz"] is None:
+        try:
+            from scaffviz import VERSION
+            versions["scaffviz"] = VERSION
+        except ImportError:
+            pass
+    commit = None
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "commit": commit,
+        "versions": versions,
+    }
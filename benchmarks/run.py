@@ -0,0 +1,100 @@
+"""
+run
+
+Run the scaffviz benchmarks on synthetic data and write the results to a JSON file.
+
+Example:
+
+    python benchmarks/run.py --sizes 1000 10000 --manifolds pca tsne --output results.json
+
+Created by: Martin Sicho
+On: 18.10.26, 18:20
+"""
+import argparse
+import json
+import os
+import sys
+
+from cases import CASES, IMPORTS, MANIFOLDS, RENDER_MODES
+from harness import get_metadata, run_case
+
+DEFAULT_SIZES = (1000, 10000, 100000, 1000000)
+
+
+def parse_limits(limits):
+    ret = dict()
+    for limit in limits:
+        name, size = limit.split("=")
+        ret[name] = int(size)
+    return ret
+
+
+def make_plan(args):
+    """
+    Create the list of benchmark cases to run.
+
+    Args:
+        args: the parsed command line arguments
+
+    Returns:
+        `list` of `(case, params)` tuples
+    """
+
+    limits = parse_limits(args.limit)
+    plan = []
+    if "import" in args.cases:
+        for target in args.imports:
+            plan.append(("import", dict(target=target, budget=args.import_budget)))
+    for size in args.sizes:
+        for manifold in args.manifolds:
+            if size > limits.get(manifold, size):
+                continue
+            common = dict(manifold=manifold, size=size, n_jobs=args.n_jobs, random_state=args.seed)
+            if "manifold" in args.cases:
+                plan.append(("manifold", dict(common, descriptor_format=args.descriptor_format)))
+            if "plot" in args.cases and size <= limits.get("plot", size):
+                for render_mode in args.render_modes:
+                    plan.append(("plot", dict(common, render_mode=render_mode, descriptor_format=args.descriptor_format, max_points=args.max_points)))
+            if "performance_plot" in args.cases and size <= limits.get("performance_plot", size):
+                plan.append(("performance_plot", common))
+    return plan
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the scaffviz pipeline on synthetic data.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="numbers of molecules to benchmark with")
+    parser.add_argument("--manifolds", nargs="+", default=list(MANIFOLDS), choices=MANIFOLDS, help="manifolds to benchmark")
+    parser.add_argument("--cases", nargs="+", default=list(CASES), choices=list(CASES), help="benchmark cases to run")
+    parser.add_argument("--render-modes", nargs="+", default=list(RENDER_MODES), choices=RENDER_MODES, help="render modes of the figures")
+    parser.add_argument("--descriptor-format", default="sparse", choices=("dense", "sparse", "packed"), help="format of the fingerprints passed to the manifolds")
+    parser.add_argument("--max-points", type=int, default=None, help="maximum number of points drawn at once in the figures")
+    parser.add_argument("--imports", nargs="+", default=list(IMPORTS), choices=list(IMPORTS), help="entry points to measure the import time of")
+    parser.add_argument("--import-budget", type=float, default=None, help="maximum import time in seconds of all entry points, imports that take longer fail, the budgets in 'IMPORT_BUDGETS' of 'cases.py' are used by default")
+    parser.add_argument("--limit", nargs="*", default=["performance_plot=10000"], metavar="NAME=SIZE", help="largest size to run a manifold or case with, i.e. 'tsne=100000'")
+    parser.add_argument("--n-jobs", type=int, default=None, help="number of jobs of the manifolds")
+    parser.add_argument("--repeat", type=int, default=1, help="number of times to run each case")
+    parser.add_argument("--timeout", type=float, default=3600, help="maximum time in seconds for one case")
+    parser.add_argument("--seed", type=int, default=42, help="seed of the synthetic data and the manifolds")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file to write the results to")
+    args = parser.parse_args(argv)
+
+    plan = make_plan(args)
+    results = {"metadata": get_metadata(), "settings": vars(args), "results": []}
+    for case, params in plan:
+        for repeat in range(args.repeat):
+            result = run_case(case, params, timeout=args.timeout)
+            result["repeat"] = repeat
+            results["results"].append(result)
+            label = " ".join(f"{key}={value}" for key, value in params.items() if key in ("manifold", "size", "render_mode", "target"))
+            print(f"{case:<17} {label:<45} {result['status']:<8} {result.get('wall_time', float('nan')):10.2f} s {result.get('peak_rss_mb') or float('nan'):10.1f} MB", flush=True)
+            if result["status"] == "failed":
+                print(result["error"], file=sys.stderr)
+            # write after every case so that the results survive an interrupted run
+            with open(f"{args.output}.tmp", "w") as out:
+                json.dump(results, out, indent=2)
+            os.replace(f"{args.output}.tmp", args.output)
+    return results
+
+
+if __name__ == "__main__":
+    main()
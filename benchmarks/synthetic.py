@@ -0,0 +1,94 @@
+"""
+synthetic
+
+Synthetic data sets for the benchmarks: clustered binary fingerprints and SMILES of drug-like molecules with a controlled number of scaffolds.
+
+Created by: Martin Sicho
+On: 18.10.26, 17:30
+"""
+import numpy as np
+
+from scaffviz.clustering.fingerprints import PackedFingerprints
+
+# ring systems with two attachment points, each yields its own Bemis-Murcko scaffold together with the linkers below
+CORES = (
+    "c1cc({0})ccc1{1}",
+    "c1ccc2[nH]c({0})cc2c1{1}",
+    "C1CN({0})CCN1{1}",
+    "c1cnc({0})nc1{1}",
+    "C1CCC(CC1{0}){1}",
+    "c1cc2ccc({0})cc2cc1{1}",
+    "c1csc({0})c1{1}",
+    "O=C1NC({0})CC1{1}",
+    "c1cc(-c2ccccc2)cc({0})c1{1}",
+    "C1CC2(CCN1{0})CCC2{1}",
+)
+LINKERS = (
+    "c1ccc({})cc1",
+    "Cc1ccc({})cc1",
+    "C(=O)c1ccc({})cn1",
+    "Oc1ccc(F)cc1{}",
+    "CC1CCOCC1{}",
+    "NC(=O)c1ccc({})s1",
+)
+SUBSTITUENTS = (
+    "C", "CC", "O", "N", "F", "Cl", "OC", "C#N", "C(=O)O", "C(F)(F)F", "CCN(C)C", "S(=O)(=O)N", "C(C)C", "OCC",
+)
+
+
+def synthetic_smiles(n_samples, n_scaffolds=50, random_state=None):
+    """
+    Generate SMILES of synthetic molecules. Each molecule is a ring system with a linker ring on one side
+    and a small substituent on the linker and the ring system, so the number of distinct scaffolds is bounded.
+
+    Args:
+        n_samples: number of SMILES to generate
+        n_scaffolds: number of distinct scaffolds (combinations of a ring system and a linker) to draw from, at most `len(CORES) * len(LINKERS)`
+        random_state: seed of the generator
+
+    Returns:
+        `list` of SMILES
+    """
+
+    rng = np.random.default_rng(random_state)
+    scaffolds = [(core, linker) for core in CORES for linker in LINKERS]
+    scaffolds = [scaffolds[i] for i in rng.permutation(len(scaffolds))[:n_scaffolds]]
+    # a few large scaffold groups and a long tail of small ones, as in real data sets
+    weights = 1.0 / np.arange(1, len(scaffolds) + 1)
+    chosen = rng.choice(len(scaffolds), size=n_samples, p=weights / weights.sum())
+    subs = rng.integers(0, len(SUBSTITUENTS), size=(n_samples, 2))
+    ret = []
+    for scaffold_idx, (sub1, sub2) in zip(chosen, subs):
+        core, linker = scaffolds[scaffold_idx]
+        ret.append(core.format(SUBSTITUENTS[sub1], linker.format(SUBSTITUENTS[sub2])))
+    return ret
+
+
+def synthetic_fingerprints(n_samples, n_bits=2048, n_clusters=50, density=0.05, noise=0.01, random_state=None, chunk_size=10000):
+    """
+    Generate clustered binary fingerprints. Every cluster has a random prototype fingerprint
+    and its members differ from it by randomly flipped bits. The fingerprints are generated in chunks and stored bit-packed,
+    so even a million fingerprints only take a few hundred megabytes.
+
+    Args:
+        n_samples: number of fingerprints
+        n_bits: length of the fingerprints
+        n_clusters: number of clusters
+        density: fraction of set bits in the cluster prototypes
+        noise: probability of a bit being flipped with respect to the prototype
+        random_state: seed of the generator
+        chunk_size: number of fingerprints generated at once
+
+    Returns:
+        a tuple of `(fingerprints, labels)` with the `PackedFingerprints` and the cluster of each fingerprint
+    """
+
+    rng = np.random.default_rng(random_state)
+    prototypes = rng.random((n_clusters, n_bits)) < density
+    labels = rng.integers(0, n_clusters, size=n_samples)
+    bits = np.empty((n_samples, (n_bits + 7) // 8), dtype=np.uint8)
+    for start in range(0, n_samples, chunk_size):
+        chunk_labels = labels[start:start + chunk_size]
+        flips = rng.random((len(chunk_labels), n_bits)) < noise
+        bits[start:start + chunk_size] = np.packbits(prototypes[chunk_labels] ^ flips, axis=1)
+    return PackedFingerprints(bits, n_bits), labels
@@ -34,25 +34,18 @@ plot_types=(
     "predictions", # plot predicted values
     "labels", # plot original (true) labels
 )
-info = dict()
-ports = [9000, 9100] # starting ports for each model
-for plot_type in plot_types: # make a plot for each type (just an example, not recommended to do all at once)
-    plot = ModelPerformancePlot(
-        TSNE(), # use t-SNE for dimensionality reduction, does not recalculate if already done before on a data set
-        models, # list of models to show the plot for
-        datasets, # list of data sets used to fit the models
-        ports,  # ports on localhost to use for each model performance plot (one for each model, must be unique)
-        plot_type=plot_type, # type of the plot
-        async_execution=True, # run the plot in a separate thread, set to False if you encounter problems
-    )
-    info_ = plot.make()
-    info.update(info_)
-    ports = (ports[0] + 1, ports[1] + 1)
+# make one plot for each model with all plot types as switchable color layers,
+# the performance data of each model is only prepared once for all of them
+plot = ModelPerformancePlot(
+    TSNE(), # use t-SNE for dimensionality reduction, does not recalculate if already done before on a data set
+    models, # list of models to show the plot for
+    datasets, # list of data sets used to fit the models
+    9000,  # port on localhost to serve the plots on, all plots share one server and have their own URL
+    plot_type=list(plot_types), # types of the plot, pass a single type to only show that one
+    async_execution=True, # serve the plots in the background, set to False to block until the server is stopped
+)
+info = plot.make()
 
 # info about running plots
-for port in info:
-    print(f"The '{info[port]['plot_type']}' plot for model: '{info[port]['model'].name}' is running @ http://localhost:{port}")
-
-
-
-
+for route in info:
+    print(f"The {info[route]['plot_type']} plot for model: '{info[route]['model'].name}' is running @ {info[route]['url']}")
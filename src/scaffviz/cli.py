@@ -0,0 +1,339 @@
+"""
+cli
+
+The `scaffviz` command line interface for building, exporting and serving molecule maps without writing a script.
+Heavy modules are imported by the commands that need them, and every command keeps a record of its inputs,
+so that repeated runs with unchanged inputs finish without importing them at all.
+
+Created by: Martin Sicho
+On: 18.10.26, 23:40
+"""
+import argparse
+import ast
+import json
+import os
+import sys
+
+MANIFOLDS = ("pca", "tsne", "umap")
+"""Names of the manifolds that can be built with `scaffviz build`."""
+
+
+def parse_params(params : list[str] | None):
+    """
+    Parse `key=value` arguments of the command line. Values are parsed as Python literals if possible and kept as strings otherwise.
+
+    Args:
+        params: the arguments
+
+    Returns:
+        a `dict` of the parsed values
+    """
+
+    parsed = dict()
+    for param in params or []:
+        key, sep, value = param.partition("=")
+        if not sep:
+            raise argparse.ArgumentTypeError(f"Expected a parameter in the form key=value, got: {param}")
+        try:
+            parsed[key] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            parsed[key] = value
+    return parsed
+
+
+def make_manifold(name : str, params : dict):
+    """
+    Create a manifold by its name.
+
+    Args:
+        name: one of `MANIFOLDS`
+        params: keyword arguments of the manifold
+
+    Returns:
+        the `Manifold`
+    """
+
+    from scaffviz.clustering import manifold
+
+    classes = {"pca": manifold.PCA, "tsne": manifold.TSNE, "umap": manifold.UMAP}
+    if name not in classes:
+        raise ValueError(f"Unknown manifold: {name}. Available manifolds: {list(classes)}")
+    return classes[name](**params)
+
+
+def _file_key(path):
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_mtime_ns, stat.st_size]
+
+
+def _read_record(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as record_file:
+        return json.load(record_file)
+
+
+def _write_record(path, record):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as record_file:
+        json.dump(record, record_file)
+    os.replace(tmp_path, path)
+
+
+def get_record_path(store_dir : str, name : str):
+    """
+    Get the path to the record of the last build of a table by `scaffviz build`.
+
+    Args:
+        store_dir: the store directory of the table
+        name: the name of the table
+
+    Returns:
+        the path to the record
+    """
+
+    return os.path.join(store_dir, ".scaffviz", f"{name}.json")
+
+
+def find_table(table : str, store_dir : str = "."):
+    """
+    Find a table saved in the columnar layout (see `ManifoldTable.toColumnar`).
+
+    Args:
+        table: path to the metadata file of the table or the name of a table built with `scaffviz build`
+        store_dir: the store directory the table was built in
+
+    Returns:
+        the path to the metadata file of the table
+    """
+
+    if table.endswith(".json") and os.path.exists(table):
+        return table
+    record = _read_record(get_record_path(store_dir, table))
+    if record is not None and os.path.exists(record["table"]):
+        return record["table"]
+    raise FileNotFoundError(f"No table named {table} was built in {os.path.abspath(store_dir)}, run 'scaffviz build' first.")
+
+
+def _table_columns(path : str, manifold : str | None = None):
+    # coordinate columns of the table are listed in its metadata, so they can be chosen without opening the table
+    with open(path) as meta_file:
+        manifolds = json.load(meta_file)["manifolds"]
+    if not manifolds:
+        raise ValueError(f"The table in {path} has no manifold coordinates, run 'scaffviz build' with a manifold first.")
+    if manifold is None:
+        manifold = next(iter(manifolds))
+    if manifold not in manifolds:
+        raise ValueError(f"Unknown manifold: {manifold}. Available manifolds: {list(manifolds)}")
+    return manifolds[manifold][:2]
+
+
+def build(args):
+    """
+    Calculate the fingerprints and the embedding of a file of molecules and save them as a table in the columnar layout.
+    The table is only rebuilt if the input file or the settings changed since the last build, and embeddings of unchanged fingerprints are taken from the embedding cache.
+    """
+
+    record_path = get_record_path(args.store_dir, args.name)
+    record = {
+        "input": _file_key(args.input),
+        "smiles_col": args.smiles_col,
+        "sep": args.sep,
+        "manifold": args.manifold,
+        "params": args.params,
+        "radius": args.radius,
+        "n_bits": args.n_bits,
+        "fit_size": args.fit_size,
+        "random_state": args.random_state,
+    }
+    previous = _read_record(record_path)
+    if not args.force and previous is not None and os.path.exists(previous["table"]) and {key: previous.get(key) for key in record} == record:
+        print(f"{args.name} is up to date: {previous['table']}")
+        return 0
+
+    import pandas as pd
+
+    from scaffviz.clustering.fingerprints import MorganFingerprints
+    from scaffviz.data.cache import EmbeddingCache
+    from scaffviz.data.manifold_table import ManifoldTable
+
+    sep = args.sep if args.sep is not None else ("\t" if args.input.endswith((".tsv", ".tsv.gz")) else ",")
+    chunks = pd.read_csv(args.input, sep=sep, chunksize=args.chunk_size)
+    table = ManifoldTable.fromChunks(
+        args.name,
+        chunks,
+        smiles_col=args.smiles_col,
+        store_dir=args.store_dir,
+        fingerprints=MorganFingerprints(args.radius, args.n_bits),
+        chunk_size=args.chunk_size,
+    )
+    table.addManifoldData(
+        make_manifold(args.manifold, parse_params(args.params)),
+        cache=EmbeddingCache(args.cache_dir) if args.cache_dir else None,
+        descriptor_format="sparse",
+        fit_size=args.fit_size or None,
+        chunk_size=args.chunk_size,
+        random_state=args.random_state,
+    )
+    record["table"] = os.path.abspath(table.toColumnar())
+    _write_record(record_path, record)
+    print(f"Built {args.name} with {len(table.getDF())} molecules: {record['table']}")
+    return 0
+
+
+def export(args):
+    """
+    Export the map of a built table as a static bundle (see `scaffviz.depiction.export`).
+    The export is skipped if the bundle was made from the same table with the same settings before.
+    """
+
+    path = find_table(args.table, args.store_dir)
+    x, y = _table_columns(path, args.manifold)
+    record_path = os.path.join(args.output, ".scaffviz.json")
+    record = {
+        "table": _file_key(path),
+        "x": x,
+        "y": y,
+        "color_by": args.color_by,
+        "card_data": args.card_data,
+        "title_data": args.title_data,
+        "scaffolds": args.scaffolds,
+        "mols_per_scaffold_group": args.mols_per_scaffold_group,
+    }
+    if not args.force and _read_record(record_path) == record and os.path.exists(os.path.join(args.output, "index.html")):
+        print(f"{args.output} is up to date")
+        return 0
+
+    from scaffviz.data.manifold_table import ManifoldTable
+    from scaffviz.depiction.depictions import DepictionCache
+    from scaffviz.depiction.plot import Plot
+
+    table = ManifoldTable.fromColumnar(path)
+    depictions = DepictionCache(store_dir=args.depictions_dir) if args.depictions_dir else None
+    plot = Plot(scaffolds=args.scaffolds, n_jobs=args.n_jobs, depictions=depictions, prerender=args.n_jobs)
+    page = plot.plot(
+        table,
+        x=x,
+        y=y,
+        color_by=args.color_by,
+        card_data=args.card_data or [],
+        title_data=args.title_data,
+        mols_per_scaffold_group=args.mols_per_scaffold_group,
+        export=args.output,
+    )
+    _write_record(record_path, record)
+    print(f"Exported {table.name}: {page}")
+    return 0
+
+
+def serve(args):
+    """
+    Serve the interactive maps of built tables on one server until it is interrupted.
+    """
+
+    paths = [find_table(table, args.store_dir) for table in args.tables]
+
+    from scaffviz.data.manifold_table import ManifoldTable
+    from scaffviz.depiction.depictions import DepictionCache
+    from scaffviz.depiction.plot import Plot
+    from scaffviz.depiction.server import get_server
+
+    server = get_server(args.port, args.host)
+    depictions = DepictionCache(store_dir=args.depictions_dir) if args.depictions_dir else None
+    plot = Plot(scaffolds=args.scaffolds, max_points=args.max_points, depictions=depictions)
+    for path in paths:
+        x, y = _table_columns(path, args.manifold)
+        table = ManifoldTable.fromColumnar(path)
+        url = plot.plot(table, x=x, y=y, color_by=args.color_by, card_data=args.card_data or [], server=server)
+        print(f"Serving {table.name} at {url}")
+    server.wait()
+    return 0
+
+
+def get_parser():
+    """
+    Create the parser of the command line arguments.
+
+    Returns:
+        the `argparse.ArgumentParser`
+    """
+
+    parser = argparse.ArgumentParser(prog="scaffviz", description="Build, export and serve interactive maps of chemical space.")
+    parser.add_argument("--version", action="store_true", help="print the version and exit")
+    commands = parser.add_subparsers(dest="command")
+
+    build_parser = commands.add_parser("build", help="build or update the embedding of a file of molecules")
+    build_parser.add_argument("input", help="CSV or TSV file with the molecules")
+    build_parser.add_argument("--name", required=True, help="name of the table")
+    build_parser.add_argument("--store-dir", default=".", help="directory to store the table in")
+    build_parser.add_argument("--smiles-col", default="SMILES", help="column with the SMILES")
+    build_parser.add_argument("--sep", default=None, help="column separator of the input file, guessed from the file extension by default")
+    build_parser.add_argument("--manifold", choices=MANIFOLDS, default="tsne", help="manifold to embed the molecules with")
+    build_parser.add_argument("--param", dest="params", action="append", metavar="KEY=VALUE", help="parameter of the manifold, can be repeated")
+    build_parser.add_argument("--radius", type=int, default=2, help="radius of the Morgan fingerprints")
+    build_parser.add_argument("--n-bits", type=int, default=2048, help="length of the Morgan fingerprints")
+    build_parser.add_argument("--fit-size", type=int, default=100000, help="number of molecules the manifold is fitted on, the rest is projected on the embedding, 0 to fit on all molecules")
+    build_parser.add_argument("--chunk-size", type=int, default=100000, help="number of molecules processed at once")
+    build_parser.add_argument("--random-state", type=int, default=42, help="seed of the subsample the manifold is fitted on")
+    build_parser.add_argument("--cache-dir", default=None, help="directory of the embedding cache, embeddings of unchanged fingerprints are reused from it")
+    build_parser.add_argument("--force", action="store_true", help="rebuild even if the input and settings did not change")
+    build_parser.set_defaults(func=build)
+
+    def add_plot_args(command_parser):
+        command_parser.add_argument("--store-dir", default=".", help="directory the tables were built in")
+        command_parser.add_argument("--manifold", default=None, help="name of the manifold to plot, the first one of the table by default")
+        command_parser.add_argument("--color-by", default=None, help="column to color the points by, scaffold groups by default")
+        command_parser.add_argument("--card-data", nargs="*", default=None, help="columns to show on the molecule cards")
+        command_parser.add_argument("--scaffolds", nargs="*", default=["BemisMurcko"], help="scaffold types to group the molecules by")
+        command_parser.add_argument("--depictions-dir", default=None, help="directory of the depiction cache, depictions are reused from it")
+
+    export_parser = commands.add_parser("export", help="export the map of a table as a static website")
+    export_parser.add_argument("table", help="name of a built table or path to its metadata file")
+    export_parser.add_argument("output", help="directory to export the map to")
+    add_plot_args(export_parser)
+    export_parser.add_argument("--title-data", default=None, help="column to show as the title of the molecule cards")
+    export_parser.add_argument("--mols-per-scaffold-group", type=int, default=10, help="minimum number of molecules in a scaffold group")
+    export_parser.add_argument("--n-jobs", type=int, default=1, help="number of processes used to calculate scaffolds and depictions")
+    export_parser.add_argument("--force", action="store_true", help="export even if the table and settings did not change")
+    export_parser.set_defaults(func=export)
+
+    serve_parser = commands.add_parser("serve", help="serve the interactive maps of tables")
+    serve_parser.add_argument("tables", nargs="+", help="names of built tables or paths to their metadata files")
+    add_plot_args(serve_parser)
+    serve_parser.add_argument("--port", type=int, default=9292, help="port of the server")
+    serve_parser.add_argument("--host", default="127.0.0.1", help="host of the server")
+    serve_parser.add_argument("--max-points", type=int, default=20000, help="maximum number of points drawn at once")
+    serve_parser.set_defaults(func=serve)
+    return parser
+
+
+def main(argv : list[str] | None = None):
+    """
+    Run the command line interface.
+
+    Args:
+        argv: the command line arguments, `sys.argv` by default
+
+    Returns:
+        the exit code
+    """
+
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    if args.version:
+        from scaffviz import VERSION
+        print(VERSION)
+        return 0
+    if args.command is None:
+        parser.print_help()
+        return 1
+    try:
+        return args.func(args)
+    except (FileNotFoundError, ValueError) as exp:
+        print(f"scaffviz {args.command}: error: {exp}", file=sys.stderr)
+        return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
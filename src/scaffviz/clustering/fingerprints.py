@@ -0,0 +1,238 @@
+"""
+fingerprints
+
+Compact representations of binary fingerprint matrices used as input to manifolds.
+
+Created by: Martin Sicho
+On: 18.10.26, 11:05
+"""
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+class PackedFingerprints:
+    """
+    A matrix of binary fingerprints with eight bits packed into each byte (see `numpy.packbits`).
+    It takes 64 times less memory than the same fingerprints stored as `float64`.
+    """
+
+    def __init__(self, bits, n_bits, index=None):
+        """
+        Initialize the packed fingerprints.
+
+        Args:
+            bits: a `uint8` array of shape `(n_samples, ceil(n_bits / 8))` with the packed bits
+            n_bits: the number of bits of the fingerprint
+            index: optional index of the samples (i.e. the index of the original `DataFrame`)
+        """
+
+        self.bits = np.ascontiguousarray(bits, dtype=np.uint8)
+        self.nBits = n_bits
+        self.index = index
+        if self.bits.ndim != 2 or self.bits.shape[1] != (n_bits + 7) // 8:
+            raise ValueError(f"Packed bits of shape {self.bits.shape} do not match {n_bits} bits.")
+
+    @staticmethod
+    def fromDense(X, chunk_size=10000):
+        """
+        Pack a dense matrix of binary fingerprints.
+
+        Args:
+            X: a pandas `DataFrame` or a numpy `ndarray` with zeros and ones
+            chunk_size: number of rows to convert at once, limits the size of the temporary copies
+
+        Returns:
+            `PackedFingerprints`
+        """
+
+        index = None
+        if isinstance(X, pd.DataFrame):
+            index = X.index
+            X = X.values
+        bits = np.empty((X.shape[0], (X.shape[1] + 7) // 8), dtype=np.uint8)
+        for start in range(0, X.shape[0], chunk_size):
+            chunk = X[start:start + chunk_size]
+            bits[start:start + chunk_size] = np.packbits(chunk != 0, axis=1)
+        return PackedFingerprints(bits, X.shape[1], index=index)
+
+    @staticmethod
+    def fromSparse(X, chunk_size=10000):
+        """
+        Pack a sparse matrix of binary fingerprints.
+
+        Args:
+            X: a `scipy.sparse` matrix, all stored non-zero values are treated as set bits
+            chunk_size: number of rows to convert at once, limits the size of the temporary copies
+
+        Returns:
+            `PackedFingerprints`
+        """
+
+        X = sparse.csr_matrix(X)
+        bits = np.empty((X.shape[0], (X.shape[1] + 7) // 8), dtype=np.uint8)
+        for start in range(0, X.shape[0], chunk_size):
+            chunk = X[start:start + chunk_size].toarray()
+            bits[start:start + chunk_size] = np.packbits(chunk != 0, axis=1)
+        return PackedFingerprints(bits, X.shape[1])
+
+    @property
+    def shape(self):
+        return self.bits.shape[0], self.nBits
+
+    def __len__(self):
+        return self.bits.shape[0]
+
+    def __getitem__(self, item):
+        index = self.index[item] if self.index is not None else None
+        return PackedFingerprints(self.bits[item], self.nBits, index=index)
+
+    def toDense(self, dtype=np.uint8, chunk_size=10000):
+        """
+        Unpack the fingerprints to a dense matrix.
+
+        Args:
+            dtype: data type of the returned matrix
+            chunk_size: number of rows to convert at once
+
+        Returns:
+            a numpy `ndarray` of shape `(n_samples, n_bits)`
+        """
+
+        ret = np.empty(self.shape, dtype=dtype)
+        for start in range(0, len(self), chunk_size):
+            chunk = self.bits[start:start + chunk_size]
+            ret[start:start + chunk_size] = np.unpackbits(chunk, axis=1, count=self.nBits)
+        return ret
+
+    def toSparse(self, dtype=np.float32, chunk_size=10000):
+        """
+        Convert the fingerprints to a sparse matrix.
+
+        Args:
+            dtype: data type of the values in the returned matrix
+            chunk_size: number of rows to convert at once
+
+        Returns:
+            a `scipy.sparse.csr_matrix` of shape `(n_samples, n_bits)`
+        """
+
+        chunks = []
+        for start in range(0, len(self), chunk_size):
+            chunk = np.unpackbits(self.bits[start:start + chunk_size], axis=1, count=self.nBits)
+            chunks.append(sparse.csr_matrix(chunk, dtype=dtype))
+        if not chunks:
+            return sparse.csr_matrix(self.shape, dtype=dtype)
+        return sparse.vstack(chunks, format="csr")
+
+
+def is_binary(X, chunk_size=10000):
+    """
+    Check if a data matrix only contains zeros and ones.
+
+    Args:
+        X: a pandas `DataFrame`, a numpy `ndarray`, a `scipy.sparse` matrix or `PackedFingerprints`
+        chunk_size: number of rows to check at once
+
+    Returns:
+        `True` if the matrix is binary, `False` otherwise
+    """
+
+    if isinstance(X, PackedFingerprints):
+        return True
+    if sparse.issparse(X):
+        return bool(np.all(X.data == 1))
+    if isinstance(X, pd.DataFrame):
+        X = X.values
+    for start in range(0, X.shape[0], chunk_size):
+        chunk = X[start:start + chunk_size]
+        if not np.all((chunk == 0) | (chunk == 1)):
+            return False
+    return True
+
+
+def is_fingerprint_input(X):
+    """
+    Check if the data matrix is in one of the compact fingerprint formats (sparse or packed).
+
+    Args:
+        X: the data matrix
+
+    Returns:
+        `True` if `X` is a `scipy.sparse` matrix or `PackedFingerprints`
+    """
+
+    return isinstance(X, PackedFingerprints) or sparse.issparse(X)
+
+
+def to_fingerprints(X, fmt="sparse"):
+    """
+    Convert a binary data matrix to one of the compact fingerprint formats.
+
+    Args:
+        X: a binary data matrix
+        fmt: target format, either `"sparse"` (`scipy.sparse.csr_matrix`) or `"packed"` (`PackedFingerprints`)
+
+    Returns:
+        the converted matrix
+    """
+
+    if fmt == "packed":
+        if isinstance(X, PackedFingerprints):
+            return X
+        if sparse.issparse(X):
+            return PackedFingerprints.fromSparse(X)
+        return PackedFingerprints.fromDense(X)
+    elif fmt == "sparse":
+        if isinstance(X, PackedFingerprints):
+            return X.toSparse()
+        if sparse.issparse(X):
+            return sparse.csr_matrix(X)
+        return PackedFingerprints.fromDense(X).toSparse()
+    else:
+        raise ValueError(f"Unknown fingerprint format: {fmt}")
+
+
+class MorganFingerprints:
+    """
+    Calculates binary Morgan fingerprints from SMILES with RDKit.
+    Used to calculate fingerprints chunk by chunk without keeping the molecules (see `ManifoldTable.fromChunks`).
+    """
+
+    def __init__(self, radius=2, n_bits=2048):
+        """
+        Initialize the calculator.
+
+        Args:
+            radius: radius of the fingerprint
+            n_bits: length of the fingerprint
+        """
+
+        self.radius = radius
+        self.nBits = n_bits
+
+    def __call__(self, smiles):
+        """
+        Calculate the fingerprints of molecules. Molecules that cannot be parsed get a fingerprint without any bits set.
+
+        Args:
+            smiles: iterable of SMILES
+
+        Returns:
+            `PackedFingerprints` of the molecules
+        """
+
+        from rdkit import Chem
+        from rdkit.Chem import rdFingerprintGenerator
+
+        generator = rdFingerprintGenerator.GetMorganGenerator(radius=self.radius, fpSize=self.nBits)
+        smiles = list(smiles)
+        bits = np.zeros((len(smiles), (self.nBits + 7) // 8), dtype=np.uint8)
+        for i, smi in enumerate(smiles):
+            mol = Chem.MolFromSmiles(smi) if isinstance(smi, str) else None
+            if mol is not None:
+                bits[i] = np.packbits(generator.GetFingerprintAsNumPy(mol).astype(bool))
+        return PackedFingerprints(bits, self.nBits)
+
+    def __str__(self):
+        return f"MorganFP_{self.radius}_{self.nBits}"
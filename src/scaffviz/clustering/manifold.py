@@ -4,13 +4,132 @@ This module contains classes for performing manifold learning on molecular data.
 Created by: Martin Sicho
 On: 05.10.22, 9:59
 """
+import multiprocessing
+import os
+import time
 from abc import abstractmethod, ABC
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Literal
 
-from sklearn.preprocessing import StandardScaler
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from scaffviz.clustering.fingerprints import PackedFingerprints, is_binary, is_fingerprint_input
+from scaffviz.clustering.neighbors import NeighborSearch, EuclideanNeighbors, interpolate_embedding
+
+
+# transformation of the manifold sent to each worker of a process pool once, instead of with every chunk
+_WORKER_FUNC = None
+
+
+def _init_worker(func : Callable):
+    global _WORKER_FUNC
+    _WORKER_FUNC = func
+
+
+def _apply_worker(chunk):
+    return _WORKER_FUNC(chunk)
 
 
 class Manifold(ABC):
 
+    def __init__(self, n_jobs : int | None = None, chunk_size : int | None = None, executor : Literal["thread", "process"] = "thread", callbacks : tuple[Callable] = tuple()):
+        """
+        Initialize the execution settings shared by all manifolds.
+
+        Args:
+            n_jobs: number of parallel jobs, passed to the underlying estimator if it supports it and used to transform chunks in parallel, `-1` uses all available cores
+            chunk_size: maximum number of rows to transform at once, `None` transforms the whole matrix in one go
+            executor: use a `"thread"` or a `"process"` pool to transform the chunks in parallel
+            callbacks: functions called with the manifold, the name of the phase (`"scaling"`, `"knn"`, `"optimization"`, `"index"` or `"projection"`) and its duration in seconds whenever a phase finishes
+        """
+        self.nJobs = n_jobs
+        self.chunkSize = chunk_size
+        self.executor = executor
+        self.callbacks = list(callbacks)
+        self.timings = dict()
+
+    def addCallback(self, callback : Callable):
+        """
+        Add a timing callback (see `__init__`).
+
+        Args:
+            callback: a function with the signature `callback(manifold, phase, seconds)`
+        """
+        self.callbacks.append(callback)
+
+    @contextmanager
+    def timePhase(self, phase : str):
+        """
+        Context manager that measures the duration of a phase of the computation, stores it in `timings` and reports it to the callbacks.
+
+        Args:
+            phase: name of the phase
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.timings[phase] = self.timings.get(phase, 0.0) + elapsed
+            for callback in self.callbacks:
+                callback(self, phase, elapsed)
+
+    def getWorkers(self):
+        """
+        Get the number of workers to use for parallel execution.
+
+        Returns:
+            the number of workers
+        """
+        if self.nJobs is None:
+            return 1
+        if self.nJobs < 0:
+            return max(1, (os.cpu_count() or 1) + 1 + self.nJobs)
+        return max(1, self.nJobs)
+
+    def transformInChunks(self, func : Callable, X):
+        """
+        Apply a transformation to the data matrix in chunks of `chunk_size` rows, in parallel if `n_jobs` allows it.
+
+        Args:
+            func: function that transforms a chunk of rows to a `numpy` array
+            X: a pandas `DataFrame`, a numpy `ndarray`, a `scipy.sparse` matrix or `PackedFingerprints`
+
+        Returns:
+            the transformed chunks stacked in the original order
+        """
+        n_rows = X.shape[0]
+        if not self.chunkSize or n_rows <= self.chunkSize:
+            return func(X)
+        if isinstance(X, pd.DataFrame):
+            chunks = [X.iloc[i:i + self.chunkSize] for i in range(0, n_rows, self.chunkSize)]
+        else:
+            chunks = [X[i:i + self.chunkSize] for i in range(0, n_rows, self.chunkSize)]
+        workers = min(self.getWorkers(), len(chunks))
+        if workers == 1:
+            return np.vstack([func(chunk) for chunk in chunks])
+        if self.executor == "process":
+            # the fitted manifold can be large (i.e. the reference data of a t-SNE), so it is pickled once per worker,
+            # the workers are spawned because forking after numba or BLAS started their threads can deadlock
+            with ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(func,)
+            ) as executor:
+                return np.vstack(list(executor.map(_apply_worker, chunks)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return np.vstack(list(executor.map(func, chunks)))
+
+    def __getstate__(self):
+        # callbacks are often closures or lambdas that cannot be pickled (i.e. to send the manifold to a process pool)
+        state = self.__dict__.copy()
+        state["callbacks"] = []
+        return state
+
     @abstractmethod
     def fit(self, X):
         """
@@ -53,6 +172,67 @@ class Manifold(ABC):
         self.fit(X)
         return self.transform(X)
 
+    def toFile(self, filename : str):
+        """
+        Save the manifold with its fitted state (i.e. the fitted estimator, the reference embedding and the neighbor index) to a file.
+
+        Args:
+            filename: path of the file to save the manifold to
+
+        Returns:
+            the absolute path to the saved file
+        """
+
+        import joblib
+        filename = os.path.abspath(filename)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        joblib.dump(self, filename)
+        return filename
+
+    @staticmethod
+    def fromFile(filename : str):
+        """
+        Load a manifold saved with `toFile`.
+
+        Args:
+            filename: path of the saved manifold
+
+        Returns:
+            the loaded `Manifold`, ready to transform new data if it was fitted before saving
+        """
+
+        import joblib
+        return joblib.load(filename)
+
+    @staticmethod
+    def prepareInput(X):
+        """
+        Convert the data matrix to a format accepted by the underlying estimators.
+        `PackedFingerprints` are converted to a sparse matrix, other inputs are returned as is.
+
+        Args:
+            X: a pandas `DataFrame`, a numpy `ndarray`, a `scipy.sparse` matrix or `PackedFingerprints`
+
+        Returns:
+            the converted data matrix
+        """
+        if isinstance(X, PackedFingerprints):
+            return X.toSparse()
+        return X
+
+    @staticmethod
+    def _neighborParams(neighbors : NeighborSearch | None):
+        return (str(neighbors), neighbors.getParams()) if neighbors is not None else None
+
+    def getParams(self):
+        """
+        Get the hyperparameters of the manifold. Used to tell apart manifolds of the same type with different settings, for example when caching embeddings.
+
+        Returns:
+            a `dict` of hyperparameter names and values
+        """
+        return dict()
+
     @abstractmethod
     def __str__(self):
         """
@@ -65,67 +245,663 @@ class Manifold(ABC):
 
 class TSNE(Manifold):
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, transform_neighbors=10, scale="auto", neighbors : NeighborSearch | None = None, engine : Literal["auto", "sklearn", "opentsne"] = "sklearn", n_jobs=None, chunk_size=None, executor="thread", callbacks=tuple(), **kwargs):
+        """
+        Initialize the t-SNE manifold.
+
+        Args:
+            *args: positional arguments passed to `sklearn.manifold.TSNE`
+            transform_neighbors: number of nearest neighbors in the reference data used to place new points with `transform`
+            scale: whether to standardize the data before fitting, if `"auto"`, binary fingerprints (dense, sparse or packed) are not scaled
+            neighbors: optional `NeighborSearch` backend (i.e. `TanimotoNeighbors`), if given, its k-nearest neighbor graph is used to compute the affinities instead of the Euclidean neighbors found by scikit-learn
+            engine: implementation of the optimization, `"sklearn"` (default) uses the Barnes-Hut t-SNE of scikit-learn,
+                `"opentsne"` uses the multithreaded FFT-accelerated interpolation of `openTSNE` (FIt-SNE), which is much faster on large data sets, but places the points differently,
+                `"auto"` uses `openTSNE` if it is installed and the metric is Euclidean or a `neighbors` backend is given, and scikit-learn otherwise,
+                the settings of `sklearn.manifold.TSNE` are translated to their `openTSNE` equivalents
+            n_jobs: number of parallel jobs (see `Manifold`)
+            chunk_size: maximum number of rows to transform at once (see `Manifold`)
+            executor: type of the pool used to transform chunks (see `Manifold`)
+            callbacks: timing callbacks (see `Manifold`)
+            **kwargs: keyword arguments passed to `sklearn.manifold.TSNE`
+        """
+        super().__init__(n_jobs=n_jobs, chunk_size=chunk_size, executor=executor, callbacks=callbacks)
         from sklearn.manifold import TSNE as skTSNE
+        if n_jobs is not None:
+            kwargs["n_jobs"] = n_jobs
         self._skTSNE = skTSNE(
             *args, **kwargs
         )
+        self.transformNeighbors = transform_neighbors
+        self.scale = scale
+        self.neighbors = neighbors
+        self.engine = engine
+        self._scaler = None
+        self._index = None
+        self.embedding = None
+
+    def getEngine(self):
+        """
+        Get the engine used to fit the embedding (see `__init__`).
+
+        Returns:
+            `"sklearn"` or `"opentsne"`
+        """
+        if self.engine != "auto":
+            return self.engine
+        if self.neighbors is None and self._skTSNE.metric != "euclidean":
+            return "sklearn"
+        try:
+            import openTSNE
+        except ImportError:
+            return "sklearn"
+        return "opentsne"
 
     def fit(self, X):
-        self._skTSNE.fit(X)
+        """
+        Fit the t-SNE embedding and keep it as a frozen reference for `transform`.
+
+        Args:
+            X: a matrix of data to fit the manifold to
+
+        Returns:
+            `self`
+        """
+        self.timings = dict()
+        X = self.prepareInput(X)
+        self._scaler = None
+        if self.scale is True or (self.scale == "auto" and not is_binary(X)):
+            with self.timePhase("scaling"):
+                from sklearn.preprocessing import StandardScaler
+                self._scaler = StandardScaler(with_mean=not sparse.issparse(X))
+                X = self._scaler.fit_transform(X)
+        if self.getEngine() == "opentsne":
+            self.embedding = self._fitOpenTSNE(X)
+        elif self.neighbors is not None:
+            with self.timePhase("knn"):
+                n_neighbors = min(X.shape[0] - 1, int(3. * self._skTSNE.perplexity + 1))
+                graph = self.neighbors.getSparseGraph(X, n_neighbors)
+            with self.timePhase("optimization"):
+                params = self._skTSNE.get_params()
+                init = self._pcaInit(X) if isinstance(params["init"], str) and params["init"] == "pca" else params["init"]
+                self._skTSNE.set_params(metric="precomputed", init=init)
+                try:
+                    self.embedding = self._skTSNE.fit_transform(graph)
+                finally:
+                    self._skTSNE.set_params(metric=params["metric"], init=params["init"])
+            self._index = self.neighbors
+        else:
+            with self.timePhase("optimization"):
+                if sparse.issparse(X) and isinstance(self._skTSNE.init, str) and self._skTSNE.init == "pca":
+                    # PCA initialization is not supported for sparse data by scikit-learn
+                    self._skTSNE.set_params(init=self._pcaInit(X))
+                    try:
+                        self.embedding = self._skTSNE.fit_transform(X)
+                    finally:
+                        self._skTSNE.set_params(init="pca")
+                else:
+                    self.embedding = self._skTSNE.fit_transform(X)
+            # scikit-learn searches the neighbors as part of the optimization, this is the index used by transform
+            with self.timePhase("index"):
+                self._index = EuclideanNeighbors(n_jobs=self.nJobs).fit(X)
         return self
 
     def transform(self, X):
-        return self._skTSNE.fit_transform(X)
+        """
+        Place new points on the fitted embedding without refitting it.
+        Each point is positioned at the inverse distance weighted average of the embedding coordinates of its nearest neighbors in the reference data.
+
+        Args:
+            X: a matrix of data to project
+
+        Returns:
+            a `numpy` array of coordinates with one row per sample in `X`
+        """
+        if self.embedding is None:
+            raise ValueError("The manifold must be fitted before transforming new data.")
+        with self.timePhase("projection"):
+            return self.transformInChunks(self._transform, X)
+
+    def _transform(self, X):
+        X = self.prepareInput(X)
+        if self._scaler is not None:
+            X = self._scaler.transform(X)
+        distances, indices = self._index.query(X, self.transformNeighbors)
+        return interpolate_embedding(self.embedding, distances, indices)
+
+    def _fitOpenTSNE(self, X):
+        from openTSNE import TSNE as OpenTSNE
+        from openTSNE.affinity import PrecomputedAffinities, joint_probabilities_nn
+
+        params = self._skTSNE.get_params()
+        search = self.neighbors if self.neighbors is not None else EuclideanNeighbors(n_jobs=self.nJobs)
+        with self.timePhase("knn"):
+            n_neighbors = min(X.shape[0] - 1, int(3. * params["perplexity"] + 1))
+            distances, indices = search.getGraph(X, n_neighbors)
+            # the graph includes each sample as its own first neighbor
+            affinities = joint_probabilities_nn(
+                indices[:, 1:], distances[:, 1:], [params["perplexity"]],
+                symmetrize=True, n_jobs=self.getWorkers()
+            )
+        self._index = search
+        with self.timePhase("optimization"):
+            init = params["init"]
+            if isinstance(init, str) and init == "pca":
+                init = self._pcaInit(X)
+            # scikit-learn counts the early exaggeration phase of 250 iterations in the maximum number of iterations
+            max_iter = params.get("max_iter") or params.get("n_iter") or 1000
+            embedding = OpenTSNE(
+                n_components=params["n_components"],
+                learning_rate=params["learning_rate"],
+                early_exaggeration=params["early_exaggeration"],
+                early_exaggeration_iter=250,
+                n_iter=max(max_iter - 250, 0),
+                negative_gradient_method="fft",
+                n_jobs=self.getWorkers(),
+                random_state=params["random_state"],
+                verbose=bool(params["verbose"]),
+            ).fit(affinities=PrecomputedAffinities(affinities, normalize=False), initialization=init)
+        return np.asarray(embedding)
+
+    def _pcaInit(self, X):
+        from sklearn.decomposition import TruncatedSVD
+        init = TruncatedSVD(
+            n_components=self._skTSNE.n_components,
+            random_state=self._skTSNE.random_state
+        ).fit_transform(X)
+        # same scaling as the PCA initialization in scikit-learn
+        return init / np.std(init[:, 0]) * 1e-4
 
     def fit_transform(self, X):
-        X = StandardScaler().fit_transform(X)
-        return self._skTSNE.fit_transform(X)
+        self.fit(X)
+        return self.embedding.copy()
+
+    def getParams(self):
+        return dict(
+            self._skTSNE.get_params(),
+            transform_neighbors=self.transformNeighbors,
+            scale=self.scale,
+            neighbors=self._neighborParams(self.neighbors),
+            engine=self.getEngine()
+        )
 
     def __str__(self):
         return "TSNE"
 
 class PCA(Manifold):
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, solver : Literal["auto", "full", "randomized", "incremental", "truncated"] = "auto", batch_size : int = 10000, incremental_threshold : int = 2 * 10 ** 8, n_jobs=None, chunk_size=None, executor="thread", callbacks=tuple(), **kwargs):
+        """
+        Initialize the PCA manifold.
+
+        Args:
+            *args: positional arguments passed to `sklearn.decomposition.PCA`
+            solver: backend of the decomposition,
+                `"full"` uses `sklearn.decomposition.PCA` as configured,
+                `"randomized"` uses it with a randomized SVD,
+                `"incremental"` fits `sklearn.decomposition.IncrementalPCA` chunk by chunk, so the data are never densified as a whole (i.e. fingerprints in a memory-mapped store),
+                `"truncated"` uses `sklearn.decomposition.TruncatedSVD`, which works on sparse data without centering it,
+                `"auto"` uses `"truncated"` for sparse and packed fingerprints, `"incremental"` for memory maps and dense matrices with more than `incremental_threshold` values,
+                `"randomized"` for matrices with more than 500 rows and columns if only a few components are computed and `"full"` otherwise
+            batch_size: number of rows fitted and transformed at once by the `"incremental"` solver
+            incremental_threshold: number of values of a dense matrix above which the `"auto"` solver fits it incrementally
+            n_jobs: number of parallel jobs (see `Manifold`)
+            chunk_size: maximum number of rows to transform at once (see `Manifold`)
+            executor: type of the pool used to transform chunks (see `Manifold`)
+            callbacks: timing callbacks (see `Manifold`)
+            **kwargs: keyword arguments passed to `sklearn.decomposition.PCA`
+        """
+        super().__init__(n_jobs=n_jobs, chunk_size=chunk_size, executor=executor, callbacks=callbacks)
         from sklearn.decomposition import PCA
         self._skPCA = PCA(
             *args, **kwargs
         )
+        self.solver = solver
+        self.batchSize = batch_size
+        self.incrementalThreshold = incremental_threshold
+        self._model = self._skPCA
+        self._solver = None
+
+    def _getComponents(self):
+        n_components = self._skPCA.n_components or 2
+        if not isinstance(n_components, int):
+            raise ValueError(f"The '{self._solver}' solver can only project to a fixed number of components, got: {n_components}")
+        return n_components
+
+    def getSolver(self, X):
+        """
+        Get the solver used to fit the data matrix (see `__init__`).
+
+        Args:
+            X: the data matrix
+
+        Returns:
+            the name of the solver
+        """
+        if self.solver != "auto":
+            return self.solver
+        if is_fingerprint_input(X):
+            return "truncated"
+        if isinstance(X, np.memmap) or X.shape[0] * X.shape[1] > self.incrementalThreshold:
+            return "incremental"
+        n_components = self._skPCA.n_components
+        if self._skPCA.svd_solver != "auto":
+            # an explicitly configured scikit-learn solver is used as is
+            return "full"
+        if min(X.shape) > 500 and isinstance(n_components, int) and n_components < 0.8 * min(X.shape):
+            return "randomized"
+        return "full"
+
+    def _getModel(self, X):
+        self._solver = self.getSolver(X)
+        if self._solver == "full":
+            return self._skPCA
+        elif self._solver == "randomized":
+            from sklearn.base import clone
+            return clone(self._skPCA).set_params(svd_solver="randomized")
+        elif self._solver == "incremental":
+            from sklearn.decomposition import IncrementalPCA
+            return IncrementalPCA(n_components=self._getComponents(), whiten=self._skPCA.whiten, batch_size=self.batchSize)
+        elif self._solver == "truncated":
+            from sklearn.decomposition import TruncatedSVD
+            return TruncatedSVD(n_components=self._getComponents(), random_state=self._skPCA.random_state)
+        raise ValueError(f"Unknown PCA solver: {self._solver}")
+
+    def _iterChunks(self, X):
+        for start in range(0, X.shape[0], self.batchSize):
+            yield self._toDense(take_rows(X, slice(start, start + self.batchSize)))
+
+    @staticmethod
+    def _toDense(X):
+        X = Manifold.prepareInput(X)
+        if sparse.issparse(X):
+            return X.toarray()
+        return np.asarray(X)
 
     def fit(self, X):
-        self._skPCA.fit(X)
+        self.timings = dict()
+        with self.timePhase("optimization"):
+            self._model = self._getModel(X)
+            if self._solver == "incremental":
+                for chunk in self._iterChunks(X):
+                    self._model.partial_fit(chunk)
+            elif self._solver == "truncated":
+                self._model.fit(self.prepareInput(X))
+            else:
+                self._model.fit(self._toDense(X) if is_fingerprint_input(X) else X)
         return self
 
     def transform(self, X):
-        return self._skPCA.fit_transform(X)
+        with self.timePhase("projection"):
+            if self._solver == "incremental" and not self.chunkSize:
+                return np.vstack([self._model.transform(chunk) for chunk in self._iterChunks(X)])
+            return self.transformInChunks(self._transform, X)
+
+    def _transform(self, X):
+        if self._solver == "truncated":
+            return self._model.transform(self.prepareInput(X))
+        return self._model.transform(self._toDense(X) if is_fingerprint_input(X) else X)
+
+    def getParams(self):
+        return dict(
+            self._skPCA.get_params(),
+            solver=self.solver,
+            batch_size=self.batchSize,
+            incremental_threshold=self.incrementalThreshold
+        )
 
-    def fit_transform(self, X):
-        return self._skPCA.fit_transform(X)
-        
     def name(self, i):
-        return f"PC_{i} ({self._skPCA.explained_variance_ratio_[i]*100:.1f} %)"
+        return f"PC_{i} ({self._model.explained_variance_ratio_[i]*100:.1f} %)"
 
     def __str__(self):
         return "PCA"
 
+_UMAP_DEFAULTS = {
+    "n_neighbors": 15, "n_components": 2, "metric": "euclidean", "metric_kwds": None, "output_metric": "euclidean",
+    "output_metric_kwds": None, "n_epochs": None, "learning_rate": 1.0, "init": "spectral", "min_dist": 0.1, "spread": 1.0,
+    "low_memory": True, "n_jobs": -1, "set_op_mix_ratio": 1.0, "local_connectivity": 1.0, "repulsion_strength": 1.0,
+    "negative_sample_rate": 5, "transform_queue_size": 4.0, "a": None, "b": None, "random_state": None,
+    "angular_rp_forest": False, "target_n_neighbors": -1, "target_metric": "categorical", "target_metric_kwds": None,
+    "target_weight": 0.5, "transform_seed": 42, "transform_mode": "embedding", "force_approximation_algorithm": False,
+    "verbose": False, "tqdm_kwds": None, "unique": False, "densmap": False, "dens_lambda": 2.0, "dens_frac": 0.3,
+    "dens_var_shift": 0.1, "output_dens": False, "disconnection_distance": None, "precomputed_knn": (None, None, None),
+}
+"""Hyperparameters of `umap.UMAP` with their defaults in the order of its positional arguments, so that the settings of a `UMAP` are known without importing `umap`."""
+
 class UMAP(Manifold):
 
-    def __init__(self, *args, **kwargs):
-        import umap
-        self._umapUMAP = umap.UMAP(
-            *args, **kwargs
-        )
+    def __init__(self, *args, neighbors : NeighborSearch | None = None, transform_neighbors=10, n_jobs=None, chunk_size=None, executor="thread", callbacks=tuple(), **kwargs):
+        """
+        Initialize the UMAP manifold.
+
+        Args:
+            *args: positional arguments passed to `umap.UMAP`
+            neighbors: optional `NeighborSearch` backend (i.e. `TanimotoNeighbors`), if given, its k-nearest neighbor graph is passed to UMAP as `precomputed_knn`
+            transform_neighbors: number of nearest neighbors used to place new points with `transform` if a custom `neighbors` backend is used
+            n_jobs: number of parallel jobs (see `Manifold`)
+            chunk_size: maximum number of rows to transform at once (see `Manifold`)
+            executor: type of the pool used to transform chunks (see `Manifold`)
+            callbacks: timing callbacks (see `Manifold`)
+            **kwargs: keyword arguments passed to `umap.UMAP`
+        """
+        super().__init__(n_jobs=n_jobs, chunk_size=chunk_size, executor=executor, callbacks=callbacks)
+        if n_jobs is not None:
+            kwargs["n_jobs"] = n_jobs
+        # umap and numba take seconds to import, so the estimator is only created when it is needed
+        self._umapArgs = args
+        self._umapKwargs = kwargs
+        self._umapModel = None
+        self.neighbors = neighbors
+        self.transformNeighbors = transform_neighbors
+
+    def __setstate__(self, state):
+        # manifolds saved by previous versions hold the estimator directly
+        if "_umapUMAP" in state:
+            state["_umapModel"] = state.pop("_umapUMAP")
+            state.setdefault("_umapArgs", tuple())
+            state.setdefault("_umapKwargs", dict())
+        self.__dict__.update(state)
+
+    @property
+    def _umapUMAP(self):
+        if self._umapModel is None:
+            import umap
+            self._umapModel = umap.UMAP(*self._umapArgs, **self._umapKwargs)
+        return self._umapModel
 
     def fit(self, X):
-        self._umapUMAP.fit(X)
+        self.timings = dict()
+        X = self.prepareInput(X)
+        if self.neighbors is None:
+            with self.timePhase("optimization"):
+                self._umapUMAP.fit(X)
+            return self
+        with self.timePhase("knn"):
+            distances, indices = self.neighbors.getGraph(X, self._umapUMAP.n_neighbors - 1)
+        with self.timePhase("optimization"):
+            params = self._umapUMAP.get_params()
+            self._umapUMAP.set_params(precomputed_knn=(indices, distances.astype(np.float32), None))
+            try:
+                self._umapUMAP.fit(X)
+            finally:
+                self._umapUMAP.set_params(
+                    precomputed_knn=params["precomputed_knn"],
+                    force_approximation_algorithm=params["force_approximation_algorithm"]
+                )
         return self
 
     def transform(self, X):
-        return self._umapUMAP.fit_transform(X)
+        if self._umapModel is None or not hasattr(self._umapModel, "embedding_"):
+            raise ValueError("The manifold must be fitted before transforming new data.")
+        with self.timePhase("projection"):
+            return self.transformInChunks(self._transform, X)
+
+    def _transform(self, X):
+        X = self.prepareInput(X)
+        if self.neighbors is None:
+            return self._umapUMAP.transform(X)
+        # UMAP cannot transform without its own search index, interpolate on the fitted embedding instead
+        distances, indices = self.neighbors.query(X, self.transformNeighbors)
+        return interpolate_embedding(self._umapUMAP.embedding_, distances, indices)
 
     def fit_transform(self, X):
-        return self._umapUMAP.fit_transform(X)
+        self.fit(X)
+        return self._umapUMAP.embedding_.copy()
+
+    def getParams(self):
+        # the estimator is not created for this, i.e. to look up a cached embedding
+        params = dict(_UMAP_DEFAULTS)
+        params.update(zip(_UMAP_DEFAULTS, self._umapArgs))
+        params.update(self._umapKwargs)
+        return dict(
+            params,
+            neighbors=self._neighborParams(self.neighbors),
+            transform_neighbors=self.transformNeighbors
+        )
+
+    def __str__(self):
+        return "UMAP"
+
+def take_rows(X, rows):
+    """
+    Select rows of a data matrix in any of the formats accepted by the manifolds.
+
+    Args:
+        X: a pandas `DataFrame`, a numpy `ndarray`, a `scipy.sparse` matrix or `PackedFingerprints`
+        rows: positions of the rows
+
+    Returns:
+        the selected rows in the format of `X`
+    """
+    return X.iloc[rows] if isinstance(X, pd.DataFrame) else X[rows]
+
+
+class LandmarkManifold(Manifold):
+    """
+    Fits a manifold on a representative subset of the data (the landmarks) and projects all other samples on the fitted embedding in batches.
+    Makes methods with a superlinear cost, such as t-SNE, usable on data sets with millions of samples in bounded time.
+    The landmarks are selected at random, by MaxMin diversity picking or stratified by groups, such as scaffolds.
+    """
+
+    def __init__(self, manifold : Manifold, n_landmarks : int = 10000, selection : Literal["random", "maxmin", "stratified"] = "random", groups=None, batch_size : int = 100000, maxmin_pool : int = 10, maxmin_components : int = 50, random_state : int | None = None, callbacks : tuple[Callable] = tuple()):
+        """
+        Initialize the landmark manifold.
+
+        Args:
+            manifold: the `Manifold` fitted on the landmarks
+            n_landmarks: the landmark budget, data with at most this many samples is embedded by the wrapped manifold directly
+            selection: `"random"` selects the landmarks uniformly at random,
+                `"maxmin"` picks diverse landmarks with the MaxMin algorithm from a random pool of `maxmin_pool` times the budget in a space reduced to `maxmin_components` dimensions by a truncated SVD,
+                `"stratified"` samples each group of `groups` in proportion to its size, with at least one landmark per group while the budget allows
+            groups: labels of the samples used by the `"stratified"` selection (i.e. scaffolds), can also be passed to `fit`
+            batch_size: number of samples projected on the embedding at once
+            maxmin_pool: size of the pool of candidates for the `"maxmin"` selection relative to the budget
+            maxmin_components: number of dimensions the distances between candidates are measured in by the `"maxmin"` selection
+            random_state: seed of the selection
+            callbacks: timing callbacks (see `Manifold`), they are also added to the wrapped manifold
+        """
+        super().__init__(n_jobs=manifold.nJobs, chunk_size=batch_size, executor=manifold.executor, callbacks=callbacks)
+        if selection not in ("random", "maxmin", "stratified"):
+            raise ValueError(f"Unknown landmark selection: {selection}")
+        self.manifold = manifold
+        self.nLandmarks = n_landmarks
+        self.selection = selection
+        self.groups = groups
+        self.batchSize = batch_size
+        self.maxminPool = maxmin_pool
+        self.maxminComponents = maxmin_components
+        self.randomState = random_state
+        self.landmarks = None
+        self.embedding = None
+        for callback in callbacks:
+            self.manifold.addCallback(callback)
+
+    def addCallback(self, callback : Callable):
+        super().addCallback(callback)
+        self.manifold.addCallback(callback)
+
+    def selectLandmarks(self, X, groups=None):
+        """
+        Select the landmarks from the data.
+
+        Args:
+            X: the data matrix
+            groups: labels of the samples for the `"stratified"` selection, `groups` of the constructor by default
+
+        Returns:
+            sorted positions of the landmarks in `X`
+        """
+        n_rows = X.shape[0]
+        rng = np.random.default_rng(self.randomState)
+        if n_rows <= self.nLandmarks:
+            return np.arange(n_rows)
+        if self.selection == "random":
+            return np.sort(rng.choice(n_rows, self.nLandmarks, replace=False))
+        if self.selection == "stratified":
+            groups = groups if groups is not None else self.groups
+            if groups is None:
+                raise ValueError("The stratified landmark selection needs the groups of the samples.")
+            return self._selectStratified(np.asarray(groups), rng)
+        return self._selectMaxMin(X, rng)
+
+    def _selectStratified(self, groups, rng):
+        codes, _ = pd.factorize(groups, use_na_sentinel=False)
+        counts = np.bincount(codes)
+        quota = np.maximum(np.floor(counts * self.nLandmarks / len(codes)).astype(np.int64), 1)
+        # samples of each group in a random order, the first ones of each group are its landmarks
+        order = rng.permutation(len(codes))
+        order = order[np.argsort(codes[order], kind="stable")]
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        rank = np.arange(len(codes)) - np.repeat(starts, counts)
+        selected = order[rank < np.repeat(quota, counts)]
+        if len(selected) > self.nLandmarks:
+            # more groups than the budget allows, the groups that keep their landmark are chosen at random
+            selected = rng.choice(selected, self.nLandmarks, replace=False)
+        elif len(selected) < self.nLandmarks:
+            rest = np.setdiff1d(np.arange(len(codes)), selected)
+            selected = np.concatenate([selected, rng.choice(rest, self.nLandmarks - len(selected), replace=False)])
+        return np.sort(selected)
+
+    def _selectMaxMin(self, X, rng):
+        from sklearn.decomposition import TruncatedSVD
+
+        n_rows = X.shape[0]
+        pool = np.sort(rng.choice(n_rows, min(n_rows, self.maxminPool * self.nLandmarks), replace=False))
+        candidates = self.prepareInput(take_rows(X, pool))
+        if isinstance(candidates, pd.DataFrame):
+            candidates = candidates.values
+        n_components = min(self.maxminComponents, candidates.shape[1] - 1)
+        if n_components > 0:
+            candidates = TruncatedSVD(n_components=n_components, random_state=self.randomState).fit_transform(candidates)
+        candidates = np.asarray(candidates, dtype=np.float64)
+        picked = np.empty(self.nLandmarks, dtype=np.int64)
+        picked[0] = rng.integers(len(pool))
+        min_dist = np.sum((candidates - candidates[picked[0]]) ** 2, axis=1)
+        for i in range(1, self.nLandmarks):
+            picked[i] = np.argmax(min_dist)
+            np.minimum(min_dist, np.sum((candidates - candidates[picked[i]]) ** 2, axis=1), out=min_dist)
+        return np.sort(pool[picked])
+
+    def fit(self, X, groups=None):
+        """
+        Select the landmarks and fit the wrapped manifold on them.
+
+        Args:
+            X: the data matrix
+            groups: labels of the samples for the `"stratified"` selection
+
+        Returns:
+            `self`
+        """
+        self.timings = dict()
+        with self.timePhase("landmarks"):
+            self.landmarks = self.selectLandmarks(X, groups)
+        self.embedding = self.manifold.fit_transform(take_rows(X, self.landmarks))
+        self.timings.update({phase: seconds for phase, seconds in self.manifold.timings.items() if phase != "landmarks"})
+        return self
+
+    def transform(self, X):
+        """
+        Project data on the embedding of the landmarks in batches of `batch_size` samples.
+
+        Args:
+            X: the data matrix
+
+        Returns:
+            a `numpy` array of coordinates with one row per sample in `X`
+        """
+        if self.embedding is None:
+            raise ValueError("The manifold must be fitted before transforming new data.")
+        return self._project(X, np.arange(X.shape[0]))
+
+    def _project(self, X, rows):
+        coords = np.empty((X.shape[0], self.embedding.shape[1]), dtype=self.embedding.dtype)
+        # the projection is reported once for all batches instead of by the wrapped manifold for each of them
+        callbacks, self.manifold.callbacks = self.manifold.callbacks, []
+        try:
+            with self.timePhase("projection"):
+                for start in range(0, len(rows), self.batchSize):
+                    batch = rows[start:start + self.batchSize]
+                    coords[batch] = self.manifold.transform(take_rows(X, batch))
+        finally:
+            self.manifold.callbacks = callbacks
+        return coords
+
+    def fit_transform(self, X, groups=None):
+        """
+        Fit the wrapped manifold on the landmarks and project the other samples on it. The landmarks keep their fitted coordinates.
+
+        Args:
+            X: the data matrix
+            groups: labels of the samples for the `"stratified"` selection
+
+        Returns:
+            a `numpy` array of coordinates with one row per sample in `X`
+        """
+        self.fit(X, groups)
+        rest = np.setdiff1d(np.arange(X.shape[0]), self.landmarks)
+        coords = self._project(X, rest)
+        coords[self.landmarks] = self.embedding
+        return coords
+
+    def getQualityReport(self, X, groups=None, n_neighbors : int = 10, reference=None):
+        """
+        Compare the landmark embedding of a (small) data set with the embedding obtained by fitting the wrapped manifold on all samples.
+        Use it to choose the landmark budget and selection before embedding a large data set.
+
+        Args:
+            X: the data matrix
+            groups: labels of the samples for the `"stratified"` selection
+            n_neighbors: number of nearest neighbors compared between the embeddings
+            reference: coordinates of the full fit if they are already calculated, the wrapped manifold is fitted on a copy otherwise
+
+        Returns:
+            a `dict` with the `knn_preservation` (mean fraction of the nearest neighbors in the full fit that are also nearest neighbors in the landmark embedding),
+            the `procrustes_disparity` of the two layouts (0 for layouts identical up to rotation, scaling and translation), the number of landmarks and the fitting times of both embeddings
+        """
+        import copy
+        from scipy.spatial import procrustes
+
+        start = time.perf_counter()
+        if reference is None:
+            full = copy.deepcopy(self.manifold)
+            full.callbacks = []
+            reference = full.fit_transform(X)
+        full_time = time.perf_counter() - start
+        start = time.perf_counter()
+        coords = self.fit_transform(X, groups)
+        landmark_time = time.perf_counter() - start
+        reference = np.asarray(reference, dtype=np.float64)
+        coords = np.asarray(coords, dtype=np.float64)
+        n_neighbors = min(n_neighbors, len(coords) - 1)
+        _, ref_neighbors = EuclideanNeighbors().fit(reference).query(reference, n_neighbors + 1)
+        _, neighbors = EuclideanNeighbors().fit(coords).query(coords, n_neighbors + 1)
+        shared = [len(np.intersect1d(a[1:], b[1:], assume_unique=True)) for a, b in zip(ref_neighbors, neighbors)]
+        _, _, disparity = procrustes(reference, coords)
+        return {
+            "knn_preservation": float(np.mean(shared) / n_neighbors),
+            "procrustes_disparity": float(disparity),
+            "n_samples": int(X.shape[0]),
+            "n_landmarks": int(len(self.landmarks)),
+            "full_fit_seconds": full_time,
+            "landmark_fit_seconds": landmark_time,
+        }
+
+    def getParams(self):
+        from scaffviz.data.cache import hash_data
+
+        groups = None
+        if self.groups is not None:
+            # the labels can be any objects, so they are hashed by their values
+            groups = hash_data(pd.util.hash_pandas_object(pd.Series(np.asarray(self.groups)), index=False).values)
+        return dict(
+            self.manifold.getParams(),
+            n_landmarks=self.nLandmarks,
+            selection=self.selection,
+            groups=groups,
+            maxmin_pool=self.maxminPool,
+            maxmin_components=self.maxminComponents,
+            landmark_random_state=self.randomState
+        )
 
     def __str__(self):
-        return "UMAP"
\ No newline at end of file
+        return f"Landmark_{self.manifold}"
@@ -0,0 +1,340 @@
+"""
+neighbors
+
+Nearest neighbor search backends used to build the neighbor graphs of `TSNE` and `UMAP`.
+
+Created by: Martin Sicho
+On: 18.10.26, 13:40
+"""
+from abc import ABC, abstractmethod
+
+import numpy as np
+from scipy import sparse
+
+from scaffviz.clustering.fingerprints import to_fingerprints
+
+
+class NeighborSearch(ABC):
+    """
+    Base class of nearest neighbor search backends.
+    A backend is fitted on the reference data and can then be queried for the nearest reference samples of new data.
+    The k-nearest neighbor graph of the reference data itself is memoized and optionally stored in an `ArrayCache`
+    so that manifolds with different perplexities or numbers of neighbors can reuse one neighbor search.
+    """
+
+    def __init__(self, n_neighbors=None, cache=None):
+        """
+        Initialize the neighbor search.
+
+        Args:
+            n_neighbors: minimum number of neighbors to compute for the neighbor graph, computing more than a manifold needs allows to reuse the graph for larger perplexities or numbers of neighbors later
+            cache: optional `ArrayCache` to store the neighbor graphs in
+        """
+
+        self.nNeighbors = n_neighbors
+        self.cache = cache
+        self._dataHash = None
+        self._graph = None
+
+    def __getstate__(self):
+        # the memoized neighbor graph can be recalculated or loaded from the cache, no need to store it
+        state = self.__dict__.copy()
+        state["_dataHash"] = None
+        state["_graph"] = None
+        return state
+
+    @abstractmethod
+    def fit(self, X):
+        """
+        Build the search index over the reference data.
+
+        Args:
+            X: the reference data matrix
+
+        Returns:
+            `self`
+        """
+
+        pass
+
+    @abstractmethod
+    def query(self, X, n_neighbors):
+        """
+        Find the nearest reference samples of the samples in `X`.
+
+        Args:
+            X: a data matrix in the same format as the reference data
+            n_neighbors: number of neighbors to find
+
+        Returns:
+            a tuple of `(distances, indices)` arrays of shape `(n_samples, n_neighbors)` sorted by distance
+        """
+
+        pass
+
+    def prepareData(self, X):
+        """
+        Convert the data matrix to the format the backend works with. Used to make the neighbor graph cache independent of the input format.
+
+        Args:
+            X: a data matrix
+
+        Returns:
+            the converted data matrix
+        """
+
+        return X
+
+    def getParams(self):
+        """
+        Get the settings of the backend that influence the found neighbors.
+
+        Returns:
+            a `dict` of parameter names and values
+        """
+
+        return dict()
+
+    def getGraph(self, X, n_neighbors):
+        """
+        Fit the backend to `X` and get the k-nearest neighbor graph of `X`.
+        Each sample is included as its own first neighbor at distance zero.
+
+        Args:
+            X: the reference data matrix
+            n_neighbors: number of neighbors to return besides the sample itself
+
+        Returns:
+            a tuple of `(distances, indices)` arrays of shape `(n_samples, n_neighbors + 1)`
+        """
+
+        from scaffviz.data.cache import hash_data, hash_settings
+
+        X = self.prepareData(X)
+        data_hash = hash_data(X)
+        if data_hash != self._dataHash:
+            self.fit(X)
+            self._dataHash = data_hash
+            self._graph = None
+        if self._graph is not None and self._graph[0].shape[1] > n_neighbors:
+            return self._graph[0][:, :n_neighbors + 1], self._graph[1][:, :n_neighbors + 1]
+
+        n_samples = X.shape[0]
+        k = min(max(n_neighbors, self.nNeighbors or 0), n_samples - 1)
+        key = f"knn_{self}_{hash_settings(self)[:16]}_{data_hash}"
+        graph = None
+        if self.cache is not None:
+            distances = self.cache.get(f"{key}_distances")
+            indices = self.cache.get(f"{key}_indices")
+            if distances is not None and indices is not None and distances.shape[1] > k:
+                graph = (distances, indices)
+        if graph is None:
+            graph = self._selfGraph(X, k)
+            if self.cache is not None:
+                self.cache.put(f"{key}_distances", graph[0])
+                self.cache.put(f"{key}_indices", graph[1])
+        self._graph = graph
+        return graph[0][:, :n_neighbors + 1], graph[1][:, :n_neighbors + 1]
+
+    def _selfGraph(self, X, n_neighbors):
+        distances, indices = self.query(X, n_neighbors + 1)
+        # make sure every sample is its own first neighbor, even if there are duplicates
+        own = np.arange(indices.shape[0])
+        is_own = indices == own[:, None]
+        others = np.argsort(is_own, axis=1, kind="stable")[:, :n_neighbors]
+        rows = own[:, None]
+        indices = np.hstack([own[:, None], indices[rows, others]])
+        distances = np.hstack([np.zeros((len(own), 1), dtype=distances.dtype), distances[rows, others]])
+        return distances, indices
+
+    def getSparseGraph(self, X, n_neighbors):
+        """
+        Get the k-nearest neighbor graph of `X` as a sparse distance matrix, which can be passed to estimators with `metric="precomputed"`.
+
+        Args:
+            X: the reference data matrix
+            n_neighbors: number of neighbors to include besides the sample itself
+
+        Returns:
+            a `scipy.sparse.csr_matrix` of shape `(n_samples, n_samples)` with explicit zeros on the diagonal
+        """
+
+        distances, indices = self.getGraph(X, n_neighbors)
+        n_samples, k = indices.shape
+        indptr = np.arange(0, n_samples * k + 1, k)
+        return sparse.csr_matrix((distances.ravel(), indices.ravel(), indptr), shape=(n_samples, n_samples))
+
+    @abstractmethod
+    def __str__(self):
+        pass
+
+
+class EuclideanNeighbors(NeighborSearch):
+    """
+    Exact Euclidean nearest neighbors with `sklearn.neighbors.NearestNeighbors`.
+    """
+
+    def __init__(self, n_neighbors=None, cache=None, n_jobs=None):
+        super().__init__(n_neighbors, cache)
+        self.nJobs = n_jobs
+        self._index = None
+
+    def fit(self, X):
+        from sklearn.neighbors import NearestNeighbors
+        self._index = NearestNeighbors(n_jobs=self.nJobs).fit(X)
+        return self
+
+    def query(self, X, n_neighbors):
+        return self._index.kneighbors(X, n_neighbors=min(n_neighbors, self._index.n_samples_fit_))
+
+    def __str__(self):
+        return "Euclidean"
+
+
+def popcount(x):
+    """
+    Count the set bits along the last axis of an unsigned integer array.
+
+    Args:
+        x: a `uint8` or `uint64` array
+
+    Returns:
+        the number of set bits as an `int64` array with the last axis removed
+    """
+
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(x).sum(axis=-1, dtype=np.int64)
+    return _POPCOUNT_TABLE[x.view(np.uint8)].sum(axis=-1, dtype=np.int64)
+
+
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+class TanimotoNeighbors(NeighborSearch):
+    """
+    Tanimoto (Jaccard) nearest neighbors for binary fingerprints.
+    The exact search compares bit-packed fingerprints block by block with vectorized popcounts.
+    The approximate search uses the NN-descent algorithm from `pynndescent`.
+    """
+
+    def __init__(self, n_neighbors=None, cache=None, approximate=False, query_block=256, reference_block=2048, n_jobs=None, random_state=None):
+        """
+        Initialize the Tanimoto neighbor search.
+
+        Args:
+            n_neighbors: minimum number of neighbors to compute for the neighbor graph (see `NeighborSearch`)
+            cache: optional `ArrayCache` to store the neighbor graphs in
+            approximate: use the approximate NN-descent search from `pynndescent` instead of the exact search
+            query_block: number of query fingerprints compared at once in the exact search
+            reference_block: number of reference fingerprints compared at once in the exact search
+            n_jobs: number of jobs for the approximate search
+            random_state: random state of the approximate search
+        """
+
+        super().__init__(n_neighbors, cache)
+        self.approximate = approximate
+        self.queryBlock = query_block
+        self.referenceBlock = reference_block
+        self.nJobs = n_jobs
+        self.randomState = random_state
+        self._words = None
+        self._counts = None
+        self._index = None
+
+    def prepareData(self, X):
+        return to_fingerprints(X, "packed")
+
+    @staticmethod
+    def _toWords(X):
+        bits = X.bits
+        # pad to whole 64-bit words so that the popcounts can run on uint64
+        pad = (-bits.shape[1]) % 8
+        if pad:
+            bits = np.hstack([bits, np.zeros((bits.shape[0], pad), dtype=np.uint8)])
+        return np.ascontiguousarray(bits).view(np.uint64)
+
+    def fit(self, X):
+        if self.approximate:
+            try:
+                from pynndescent import NNDescent
+            except ImportError:
+                raise ImportError("The approximate Tanimoto search requires the 'pynndescent' package.")
+            X = self.prepareData(X).toDense(dtype=bool)
+            self._index = NNDescent(
+                X,
+                metric="jaccard",
+                n_neighbors=max(self.nNeighbors or 0, 30),
+                n_jobs=self.nJobs if self.nJobs is not None else -1,
+                random_state=self.randomState,
+            )
+        else:
+            self._words = self._toWords(self.prepareData(X))
+            self._counts = popcount(self._words)
+        return self
+
+    def query(self, X, n_neighbors):
+        if self.approximate:
+            X = self.prepareData(X).toDense(dtype=bool)
+            indices, distances = self._index.query(X, k=n_neighbors)
+            return distances, indices
+
+        words = self._toWords(self.prepareData(X))
+        counts = popcount(words)
+        n_ref = self._words.shape[0]
+        n_neighbors = min(n_neighbors, n_ref)
+        distances = np.empty((words.shape[0], n_neighbors), dtype=np.float32)
+        indices = np.empty((words.shape[0], n_neighbors), dtype=np.int64)
+        for q_start in range(0, words.shape[0], self.queryBlock):
+            q_words = words[q_start:q_start + self.queryBlock]
+            q_counts = counts[q_start:q_start + self.queryBlock]
+            best_dist = np.empty((len(q_words), 0), dtype=np.float32)
+            best_idx = np.empty((len(q_words), 0), dtype=np.int64)
+            for r_start in range(0, n_ref, self.referenceBlock):
+                r_words = self._words[r_start:r_start + self.referenceBlock]
+                r_counts = self._counts[r_start:r_start + self.referenceBlock]
+                common = popcount(q_words[:, None, :] & r_words[None, :, :])
+                union = q_counts[:, None] + r_counts[None, :] - common
+                # two empty fingerprints are considered identical
+                similarity = np.divide(common, union, out=np.ones(common.shape), where=union > 0)
+                block_dist = np.concatenate([best_dist, (1 - similarity).astype(np.float32)], axis=1)
+                block_idx = np.concatenate([
+                    best_idx,
+                    np.broadcast_to(np.arange(r_start, r_start + len(r_words)), common.shape)
+                ], axis=1)
+                if block_dist.shape[1] > n_neighbors:
+                    keep = np.argpartition(block_dist, n_neighbors - 1, axis=1)[:, :n_neighbors]
+                    block_dist = np.take_along_axis(block_dist, keep, axis=1)
+                    block_idx = np.take_along_axis(block_idx, keep, axis=1)
+                best_dist, best_idx = block_dist, block_idx
+            order = np.argsort(best_dist, axis=1, kind="stable")
+            distances[q_start:q_start + self.queryBlock] = np.take_along_axis(best_dist, order, axis=1)
+            indices[q_start:q_start + self.queryBlock] = np.take_along_axis(best_idx, order, axis=1)
+        return distances, indices
+
+    def getParams(self):
+        return dict(approximate=self.approximate, random_state=self.randomState)
+
+    def __str__(self):
+        return "Tanimoto"
+
+
+def interpolate_embedding(embedding, distances, indices):
+    """
+    Place new points on an existing embedding at the inverse distance weighted average of the coordinates of their nearest reference points.
+
+    Args:
+        embedding: coordinates of the reference points
+        distances: distances of the new points to their nearest reference points
+        indices: indices of the nearest reference points
+
+    Returns:
+        a `numpy` array of coordinates with one row per new point
+    """
+
+    weights = 1.0 / np.maximum(distances, 1e-12)
+    # exact matches get placed exactly on their reference point
+    exact = distances <= 1e-12
+    has_exact = exact.any(axis=1)
+    weights[has_exact] = exact[has_exact]
+    weights /= weights.sum(axis=1, keepdims=True)
+    return np.einsum("ij,ijk->ik", weights, embedding[indices])
@@ -0,0 +1,197 @@
+"""
+cache
+
+On-disk caches for expensive intermediate results, such as manifold embeddings.
+
+Created by: Martin Sicho
+On: 18.10.26, 10:12
+"""
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from scaffviz.clustering.fingerprints import PackedFingerprints
+
+
+def hash_data(X):
+    """
+    Compute a content hash of a data matrix.
+
+    Args:
+        X: a pandas `DataFrame`, a numpy `ndarray`, a `scipy.sparse` matrix or `PackedFingerprints`
+
+    Returns:
+        a hexadecimal digest that changes whenever the values, shape, data type or column names of `X` change
+    """
+
+    digest = hashlib.blake2b(digest_size=20)
+    if isinstance(X, PackedFingerprints):
+        digest.update(repr(("packed", X.nBits)).encode())
+        X = X.bits
+    elif sparse.issparse(X):
+        X = sparse.csr_matrix(X)
+        digest.update(repr(("sparse", X.shape, X.dtype.str)).encode())
+        for part in (X.indptr, X.indices, X.data):
+            digest.update(np.ascontiguousarray(part).data)
+        return digest.hexdigest()
+    elif isinstance(X, pd.DataFrame):
+        digest.update(repr(X.columns.tolist()).encode())
+        X = X.values
+    X = np.ascontiguousarray(X)
+    digest.update(repr((X.shape, X.dtype.str)).encode())
+    digest.update(X.data)
+    return digest.hexdigest()
+
+
+def hash_settings(obj):
+    """
+    Compute a hash of the type and all hyperparameters of a `Manifold` or a `NeighborSearch`.
+
+    Args:
+        obj: the object to hash, it has to implement `getParams`
+
+    Returns:
+        a hexadecimal digest of the settings
+    """
+
+    # settings that only affect how the result is computed, not the result itself
+    execution = ("n_jobs", "verbose")
+    params = sorted((key, repr(value)) for key, value in obj.getParams().items() if key not in execution)
+    identity = f"{obj.__class__.__module__}.{obj.__class__.__name__}:{obj}:{params}"
+    return hashlib.blake2b(identity.encode(), digest_size=20).hexdigest()
+
+
+class ArrayCache:
+    """
+    A size bounded on-disk cache of `numpy` arrays stored as `.npy` files.
+    When the total size of the cache exceeds `max_size`, the least recently used entries are removed first.
+    """
+
+    def __init__(self, cache_dir, max_size=2 * 1024 ** 3):
+        """
+        Initialize the cache.
+
+        Args:
+            cache_dir: directory to store the cached arrays in, it is created if it does not exist
+            max_size: maximum total size of the cached files in bytes, `None` for no limit
+        """
+
+        self.cacheDir = os.path.abspath(cache_dir)
+        self.maxSize = max_size
+        os.makedirs(self.cacheDir, exist_ok=True)
+
+    def getPath(self, key):
+        return os.path.join(self.cacheDir, f"{key}.npy")
+
+    def has(self, key):
+        return os.path.exists(self.getPath(key))
+
+    def get(self, key):
+        """
+        Get a cached array.
+
+        Args:
+            key: key of the entry
+
+        Returns:
+            the cached array or `None` if the key is not in the cache
+        """
+
+        path = self.getPath(key)
+        try:
+            ret = np.load(path, allow_pickle=False)
+        except FileNotFoundError:
+            return None
+        # mark the entry as recently used
+        os.utime(path)
+        return ret
+
+    def put(self, key, array):
+        """
+        Store an array in the cache and evict old entries if the cache grows too large.
+
+        Args:
+            key: key of the entry
+            array: the array to store
+        """
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.cacheDir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                np.save(tmp_file, np.asarray(array), allow_pickle=False)
+            os.replace(tmp_path, self.getPath(key))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.evict()
+
+    def remove(self, key):
+        path = self.getPath(key)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def getEntries(self):
+        """
+        Get the cached entries ordered from the least to the most recently used.
+
+        Returns:
+            a `list` of `(path, size, last_used)` tuples
+        """
+
+        entries = []
+        for entry in os.scandir(self.cacheDir):
+            if entry.is_file() and entry.name.endswith(".npy"):
+                stat = entry.stat()
+                entries.append((entry.path, stat.st_size, stat.st_mtime))
+        return sorted(entries, key=lambda x: x[2])
+
+    def getSize(self):
+        return sum(x[1] for x in self.getEntries())
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits into `max_size`.
+        """
+
+        if self.maxSize is None:
+            return
+        entries = self.getEntries()
+        total = sum(x[1] for x in entries)
+        for path, size, _ in entries:
+            if total <= self.maxSize:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        for path, _, _ in self.getEntries():
+            os.remove(path)
+
+
+class EmbeddingCache(ArrayCache):
+    """
+    Cache of manifold coordinates keyed by the content of the descriptor matrix and the full manifold hyperparameters.
+    Changing the descriptors or any setting of the manifold results in a cache miss.
+    """
+
+    def getKey(self, X, manifold):
+        """
+        Get the cache key of an embedding.
+
+        Args:
+            X: the descriptor matrix the embedding is calculated from
+            manifold: the `Manifold` used to calculate the embedding
+
+        Returns:
+            the key of the embedding in this cache
+        """
+
+        return f"{manifold}_{hash_settings(manifold)[:16]}_{hash_data(X)}"
@@ -4,37 +4,433 @@ manifold_table
 Created by: Martin Sicho
 On: 17.01.23, 17:20
 """
+import copy
+import json
+import os
+import tempfile
+from typing import ClassVar, Literal
+
 import numpy as np
+import pandas as pd
 from qsprpred.data import MoleculeTable
-from scaffviz.clustering.manifold import Manifold
+
+from scaffviz.clustering.fingerprints import MorganFingerprints, PackedFingerprints, is_binary, to_fingerprints
+from scaffviz.clustering.manifold import LandmarkManifold, Manifold
+from scaffviz.data.cache import EmbeddingCache
+from scaffviz.data.spatial import SpatialIndex
+from scaffviz.data.store import ArrayStore, FingerprintStore
 
 
 class ManifoldTable(MoleculeTable):
 
+    _notJSON: ClassVar = MoleculeTable._notJSON + ["manifolds", "spatialIndices"]
+    # types of the values of object columns that are saved by `toColumnar` (see `pandas.api.types.infer_dtype`)
+    _columnarTypes: ClassVar = ("string", "bytes", "integer", "floating", "mixed-integer-float", "decimal", "boolean", "datetime", "date", "empty")
+
+    def __init__(self, *args, **kwargs):
+        """
+        Initialize the table. All arguments are passed to `MoleculeTable`.
+        """
+        super().__init__(*args, **kwargs)
+        # fitted manifolds by their name, saved next to the table data
+        self.manifolds = dict()
+        # spatial indices of the 2D maps by their coordinate columns, built on first use
+        self.spatialIndices = dict()
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self.manifolds = dict()
+        self.spatialIndices = dict()
+
     @staticmethod
-    def fromMolTable(mol_table : MoleculeTable, name=None):
+    def fromMolTable(mol_table : MoleculeTable, name=None, view=False):
+        """
+        Create a `ManifoldTable` from a `MoleculeTable`.
+
+        Args:
+            mol_table: the source table
+            name: name of the new table, the name of the source table by default
+            view: if `True`, the new table wraps the data of the source table without copying it,
+                columns added to the view are not added to the source table, but changes of the values of existing columns are visible in both,
+                the view shares the store directory with the source table and is not meant to be saved
+
+        Returns:
+            the `ManifoldTable`
+        """
         name = name if name is not None else mol_table.name
+        if view:
+            mt = ManifoldTable.__new__(ManifoldTable)
+            mt.__dict__.update(mol_table.__dict__)
+            # new frame object over the same column data, so that added columns do not end up in the source
+            mt.df = mol_table.getDF().copy(deep=False)
+            mt.name = name
+            # manifolds fitted on the view do not replace the ones of the source
+            mt.manifolds = dict(mol_table.manifolds) if isinstance(mol_table, ManifoldTable) else dict()
+            # indices built for the view are not added to the source, the coordinates in the view can differ
+            mt.spatialIndices = dict(mol_table.spatialIndices) if isinstance(mol_table, ManifoldTable) else dict()
+            return mt
         mt = ManifoldTable(name, mol_table.getDF(), smiles_col=mol_table.smilesCol, store_dir=mol_table.storeDir, index_cols=mol_table.indexCols)
-        mt.descriptors = mol_table.descriptors
+        mt.descriptors = list(mol_table.descriptors)
+        if isinstance(mol_table, ManifoldTable):
+            mt.manifolds = dict(mol_table.manifolds)
+        return mt
+
+    @staticmethod
+    def fromChunks(name : str, chunks, manifold : Manifold | None = None, smiles_col : str = "SMILES", store_dir : str = ".", fingerprints=None, fit_size : int | None = 100000, descriptor_format : Literal["dense", "sparse", "packed"] = "sparse", chunk_size : int = 100000, random_state : int | None = None, **kwargs):
+        """
+        Create a table from a data set that is too large to calculate all descriptors in memory, i.e. a large Papyrus extract.
+        The molecules are read in chunks and the fingerprints of each chunk are appended to a memory-mapped `FingerprintStore` in the store directory of the table,
+        only the data of the molecules is kept in the table. If a manifold is given, it is fitted on a random subsample of the molecules and the rest is projected on the embedding chunk by chunk with a `LandmarkManifold`.
+
+        Args:
+            name: name of the table
+            chunks: iterable of data frames with the molecules, i.e. `pandas.read_csv(..., chunksize=100000)`
+            manifold: optional `Manifold` to embed the molecules with (see `addManifoldData`)
+            smiles_col: name of the column with the SMILES
+            store_dir: directory to store the table in
+            fingerprints: function that calculates `PackedFingerprints` from a `Series` of SMILES, `MorganFingerprints` by default
+            fit_size: number of molecules the manifold is fitted on, `None` to fit it on all molecules (see `addManifoldData`)
+            descriptor_format: format of the fingerprints passed to the manifold (see `getManifoldInput`)
+            chunk_size: number of molecules projected on the embedding at once
+            random_state: seed of the subsample the manifold is fitted on
+            **kwargs: other arguments passed to `ManifoldTable`, i.e. `index_cols`
+
+        Returns:
+            the `ManifoldTable`
+        """
+        fingerprints = fingerprints or MorganFingerprints()
+        tmp_path = os.path.join(store_dir, f".{name}_descriptors.tmp")
+        store = None
+        frames = []
+        try:
+            for chunk in chunks:
+                fps = fingerprints(chunk[smiles_col])
+                if store is None:
+                    store = FingerprintStore(tmp_path, fps.nBits, attrs={"fingerprints": str(fingerprints)})
+                store.appendFingerprints(fps)
+                frames.append(chunk)
+            if store is None:
+                raise ValueError("No molecules were read from the chunks.")
+            mt = ManifoldTable(name, pd.concat(frames, ignore_index=True), smiles_col=smiles_col, store_dir=store_dir, **kwargs)
+        except BaseException:
+            if store is not None:
+                store.remove()
+            raise
+        del frames
+        store.move(mt.getDescriptorStorePath())
+        if manifold is not None:
+            mt.addManifoldData(manifold, descriptor_format=descriptor_format, fit_size=fit_size, chunk_size=chunk_size, random_state=random_state)
+        return mt
+
+    def getDescriptorStorePath(self):
+        return f"{self.storePrefix}_descriptors"
+
+    def getDescriptorStore(self):
+        """
+        Get the store with the descriptors of a table created with `fromChunks` or opened with `fromColumnar`.
+
+        Returns:
+            the memory-mapped `FingerprintStore` for binary fingerprints, an `ArrayStore` for other descriptors or `None` if the table has no such store
+        """
+        path = self.getDescriptorStorePath()
+        store = ArrayStore.open(path)
+        if store is not None and "n_bits" in store.attrs:
+            return FingerprintStore.open(path)
+        return store
+
+    def _isPackedInput(self):
+        # fingerprints in the store stay packed in the memory map until they are converted chunk by chunk
+        return not self.hasDescriptors() and isinstance(self.getDescriptorStore(), FingerprintStore)
+
+    def getColumnarPath(self):
+        return f"{self.storePrefix}_columnar.json"
+
+    def getCoordsStorePath(self, name : str):
+        return f"{self.storePrefix}_coords_{name}"
+
+    def toColumnar(self):
+        """
+        Save the table in a columnar layout that can be opened with `fromColumnar` without unpickling the table.
+        The molecule data is saved in the Parquet format (or pickled if `pyarrow` is not installed),
+        the descriptors and the coordinates of each manifold attached to the table are saved to `ArrayStore` directories.
+        When the table is opened, the coordinates are read into its data frame and the descriptors stay in their store until they are used. Binary fingerprints are stored bit-packed. The fitted manifolds are saved as well (see `saveManifolds`).
+
+        Returns:
+            the path to the file with the metadata of the saved table
+        """
+        df = self.getDF()
+        manifolds = dict()
+        for name in self.manifolds:
+            cols = [f"{name}_{i + 1}" for i in range(len(df.columns)) if f"{name}_{i + 1}" in df.columns]
+            if cols:
+                store = ArrayStore(self.getCoordsStorePath(name), len(cols), dtype=df[cols].values.dtype, columns=cols)
+                store.append(df[cols].values)
+                manifolds[name] = cols
+        coord_cols = [col for cols in manifolds.values() for col in cols]
+        # columns of objects, such as RDKit molecules, cannot be stored in columns and are recreated by the table
+        skipped = [col for col in df.columns if df[col].dtype == object and pd.api.types.infer_dtype(df[col], skipna=True) not in self._columnarTypes]
+        data = df.drop(columns=coord_cols + skipped)
+        if data.index.name is not None and data.index.name not in data.columns:
+            data = data.reset_index()
+        else:
+            data = data.reset_index(drop=True)
+        try:
+            data_path = f"{self.storePrefix}_columnar.parquet"
+            data.to_parquet(data_path)
+        except ImportError:
+            data_path = f"{self.storePrefix}_columnar.pkl"
+            data.to_pickle(data_path)
+        if self.hasDescriptors():
+            X = self.getDescriptors().reindex(df.index)
+            if is_binary(X):
+                store = FingerprintStore(self.getDescriptorStorePath(), X.shape[1], attrs={"columns": X.columns.tolist()})
+                store.appendFingerprints(PackedFingerprints.fromDense(X))
+            else:
+                store = ArrayStore(self.getDescriptorStorePath(), X.shape[1], dtype=X.values.dtype, columns=X.columns.tolist())
+                store.append(X.values)
+        self.saveManifolds()
+        meta = {
+            "name": self.name,
+            "smiles_col": self.smilesCol,
+            "store_dir": os.path.abspath(self.baseDir),
+            "index_cols": list(self.indexCols) if self.indexCols else None,
+            "data": os.path.basename(data_path),
+            "manifolds": manifolds,
+        }
+        with open(self.getColumnarPath(), "w") as meta_file:
+            json.dump(meta, meta_file)
+        return self.getColumnarPath()
+
+    @staticmethod
+    def fromColumnar(path : str, store_dir : str | None = None):
+        """
+        Open a table saved with `toColumnar`. The coordinates of the manifolds are copied into the data frame of the table.
+        The descriptors are not read, they stay in the memory-mapped descriptor store, so a saved map of millions of molecules can be plotted without loading its descriptor matrix.
+
+        Args:
+            path: path to the metadata file returned by `toColumnar`
+            store_dir: store directory of the opened table (see `MoleculeTable`), the one of the saved table by default, the descriptors and fitted manifolds are looked up in the folder of the table in it
+
+        Returns:
+            the `ManifoldTable`
+        """
+        with open(path) as meta_file:
+            meta = json.load(meta_file)
+        data_path = os.path.join(os.path.dirname(path), meta["data"])
+        df = pd.read_parquet(data_path) if data_path.endswith(".parquet") else pd.read_pickle(data_path)
+        store_dir = store_dir if store_dir is not None else meta["store_dir"]
+        # the molecules were validated when the table was created,
+        # the table is created in an empty directory and moved to its store afterwards, since a new table clears its folder in the store
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            mt = ManifoldTable(meta["name"], df, smiles_col=meta["smiles_col"], store_dir=tmp_dir, index_cols=meta["index_cols"], drop_invalids=False)
+        mt._storeDir = store_dir.rstrip("/")
+        prefix = path[:-len("_columnar.json")]
+        for name, cols in meta["manifolds"].items():
+            coords = ArrayStore.open(f"{prefix}_coords_{name}").read()
+            for i, col in enumerate(cols):
+                mt.addProperty(col, coords[:, i])
         return mt
 
+    def hasManifoldInput(self):
+        """
+        Check if the table has descriptors to calculate the manifold coordinates from, either calculated by `qsprpred` or in the descriptor store.
+
+        Returns:
+            `True` if a manifold can be fitted on the table
+        """
+        return self.hasDescriptors() or self.getDescriptorStore() is not None
+
+    def getManifoldPath(self, name : str):
+        """
+        Get the path of the file with a saved fitted manifold.
+
+        Args:
+            name: name of the manifold (its string representation)
+
+        Returns:
+            the path to the file
+        """
+        return f"{self.storePrefix}_manifold_{name}.pkl"
+
+    def getManifold(self, name : str):
+        """
+        Get a fitted manifold of this table. If it is not loaded yet, it is loaded from the table's store directory.
+
+        Args:
+            name: name of the manifold (its string representation)
+
+        Returns:
+            the fitted `Manifold` or `None` if no such manifold was fitted or saved
+        """
+        if name not in self.manifolds:
+            path = self.getManifoldPath(name)
+            if not os.path.exists(path):
+                return None
+            self.manifolds[name] = Manifold.fromFile(path)
+        return self.manifolds[name]
+
+    def setManifold(self, manifold : Manifold):
+        """
+        Attach a fitted manifold to this table so that it is saved with it.
+
+        Args:
+            manifold: the fitted `Manifold`
+        """
+        self.manifolds[str(manifold)] = manifold
+
+    def saveManifolds(self):
+        """
+        Save the fitted manifolds to the store directory of this table.
+
+        Returns:
+            `list` of paths to the saved manifolds
+        """
+        return [manifold.toFile(self.getManifoldPath(name)) for name, manifold in self.manifolds.items()]
+
+    def toFile(self, filename : str):
+        # descriptor tables shared with another table, i.e. the source of `fromMolTable`, are reloaded from the store of this table,
+        # so they are saved to it as copies and the source keeps its own files
+        for i, desc in enumerate(self.descriptors):
+            if os.path.abspath(os.path.dirname(desc.storeDir)) != os.path.abspath(self.storeDir):
+                desc = copy.copy(desc)
+                desc._storeDir = self.storeDir
+                self.descriptors[i] = desc
+        ret = super().toFile(filename)
+        self.saveManifolds()
+        return ret
+
     def getManifoldData(self, manifold: Manifold):
         return self.getSubset(str(manifold))
 
-    def addManifoldData(self, manifold : Manifold, recalculate=True):
+    def getManifoldInput(self, descriptor_format : Literal["dense", "sparse", "packed", "auto"] = "dense"):
+        """
+        Get the descriptors in the format to pass to a `Manifold`. If the table has no descriptors, the fingerprints from the descriptor store are used (see `fromChunks`).
+
+        Args:
+            descriptor_format: `"dense"` for a `DataFrame`, `"sparse"` for a `scipy.sparse.csr_matrix` and `"packed"` for `PackedFingerprints`, the latter two are only possible for binary fingerprints, `"auto"` uses `"sparse"` if the descriptors are binary and `"dense"` otherwise
+
+        Returns:
+            the descriptor matrix
+        """
+        if not self.hasDescriptors():
+            store = self.getDescriptorStore()
+            if store is None:
+                raise ValueError("Descriptors must be calculated before adding manifold data.")
+            if isinstance(store, FingerprintStore):
+                return self._convertInput(store.getFingerprints(), descriptor_format)
+            X = store.read()
+        else:
+            X = self.getDescriptors()
+        if descriptor_format == "dense":
+            return X
+        binary = is_binary(X)
+        if descriptor_format == "auto":
+            return to_fingerprints(X, "sparse") if binary else X
+        if not binary:
+            raise ValueError(f"Only binary fingerprints can be converted to the '{descriptor_format}' format.")
+        return to_fingerprints(X, descriptor_format)
+
+    @staticmethod
+    def _convertInput(X, descriptor_format):
+        if not isinstance(X, PackedFingerprints) or descriptor_format == "packed":
+            return X
+        return X.toDense() if descriptor_format == "dense" else X.toSparse()
+
+    def _getEmbeddingInput(self, descriptor_format):
+        return self.getManifoldInput("packed" if self._isPackedInput() else descriptor_format)
+
+    def _embed(self, manifold : Manifold, X, descriptor_format):
+        # packed fingerprints from the store are converted to the requested format,
+        # a landmark manifold gets them packed, so that only the landmarks and the batches it projects are unpacked
+        if self._isPackedInput() and not isinstance(manifold, LandmarkManifold):
+            X = self._convertInput(X, descriptor_format)
+        return manifold.fit_transform(X)
+
+    def addManifoldData(self, manifold : Manifold, recalculate=True, cache : EmbeddingCache | None = None, descriptor_format : Literal["dense", "sparse", "packed", "auto"] = "dense", fit_size : int | None = None, chunk_size : int = 100000, random_state : int | None = None):
+        """
+        Calculate the manifold coordinates from the descriptors and add them to the table.
+
+        Args:
+            manifold: the `Manifold` to use
+            recalculate: if `True`, the embedding is always recalculated, otherwise existing coordinates are reused
+            cache: optional `EmbeddingCache`, if given, existing coordinates are only reused if they were calculated from the same descriptors with the same manifold settings
+            descriptor_format: format of the descriptor matrix passed to the manifold (see `getManifoldInput`)
+            fit_size: fit the manifold on a random subsample of this many molecules and project the rest on the embedding in chunks, `None` to fit on all molecules,
+                the manifold is wrapped in a `LandmarkManifold`, so its coordinates are named after it (i.e. `Landmark_TSNE_1`) and not mistaken for a fit on all molecules
+            chunk_size: number of molecules projected at once if the manifold is fitted on a subsample
+            random_state: seed of the subsample
+
+        Returns:
+            names of the columns with the manifold coordinates
+        """
+        if fit_size:
+            manifold = LandmarkManifold(manifold, n_landmarks=fit_size, batch_size=chunk_size, random_state=random_state)
         manifold_data = self.getManifoldData(manifold)
         manifold_cols = []
         if manifold_data is not None:
             manifold_cols = manifold_data.columns.tolist()
+        if cache is not None:
+            if not self.hasManifoldInput():
+                raise ValueError("Descriptors must be calculated before adding manifold data.")
+            X = self._getEmbeddingInput(descriptor_format)
+            key = cache.getKey(X, manifold)
+            coords = None if recalculate else cache.get(key)
+            if coords is None:
+                coords = self._embed(manifold, X, descriptor_format)
+                cache.put(key, coords)
+                self.setManifold(manifold)
+            return self._setManifoldCoords(manifold, coords)
         if recalculate or manifold_data is None:
-            if not self.hasDescriptors():
+            if not self.hasManifoldInput():
                 raise ValueError("Descriptors must be calculated before adding manifold data.")
-            X = manifold.fit_transform(self.getDescriptors())
-            manifold_cols = []
-            x = np.transpose(X)
-            for i, dim in enumerate(x):
-                col_name = f"{manifold}_{i + 1}"
-                manifold_cols.append(col_name)
-                self.addProperty(col_name, dim)
+            X = self._embed(manifold, self._getEmbeddingInput(descriptor_format), descriptor_format)
+            self.setManifold(manifold)
+            manifold_cols = self._setManifoldCoords(manifold, X)
 
         return manifold_cols
+
+    def _setManifoldCoords(self, manifold : Manifold, X):
+        manifold_cols = []
+        x = np.transpose(X)
+        for i, dim in enumerate(x):
+            col_name = f"{manifold}_{i + 1}"
+            manifold_cols.append(col_name)
+            self.addProperty(col_name, dim)
+        self.dropSpatialIndices(manifold_cols)
+        return manifold_cols
+
+    def getSpatialIndex(self, x : str | None = None, y : str | None = None, manifold : Manifold | str | None = None):
+        """
+        Get the spatial index of a 2D map of this table for fast queries of the points under the cursor, in a rectangle or lasso and of their nearest neighbors on the map (see `SpatialIndex`).
+        The index is built on first use and kept until the coordinates are recalculated with `addManifoldData`.
+        The queries return positions of the molecules in the data frame of this table.
+
+        Args:
+            x: column with the x coordinates
+            y: column with the y coordinates
+            manifold: manifold or its name to use the coordinate columns of instead of `x` and `y`
+
+        Returns:
+            the `SpatialIndex`
+        """
+
+        if manifold is not None:
+            x, y = f"{manifold}_1", f"{manifold}_2"
+        if x is None or y is None:
+            raise ValueError("Either the manifold or both coordinate columns must be specified.")
+        index = self.spatialIndices.get((x, y))
+        if index is None or len(index) != len(self.getDF()):
+            index = SpatialIndex(self.getProperty(x).values, self.getProperty(y).values)
+            self.spatialIndices[(x, y)] = index
+        return index
+
+    def dropSpatialIndices(self, cols : list[str] | None = None):
+        """
+        Drop the spatial indices of this table, i.e. after changing the coordinates of a map with `addProperty`.
+
+        Args:
+            cols: only drop the indices using any of these columns, all indices by default
+        """
+
+        cols = set(cols) if cols is not None else None
+        self.spatialIndices = {key: index for key, index in self.spatialIndices.items() if cols is not None and not cols.intersection(key)}
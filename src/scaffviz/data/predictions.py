@@ -0,0 +1,133 @@
+"""
+predictions
+
+Loading of the prediction files written by the model assessors of `qsprpred`.
+
+Created by: Martin Sicho
+On: 18.10.26, 19:50
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+_CACHE = OrderedDict()
+_CACHE_LOCK = threading.Lock()
+MAX_CACHED_FILES = 32
+"""Maximum number of parsed prediction files kept in memory by `load_predictions`."""
+
+
+def _file_key(path):
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_mtime_ns, stat.st_size
+
+
+def _read_table(path, columns=None):
+    if columns is None:
+        return pd.read_table(path, index_col=0)
+    index_col = pd.read_table(path, index_col=None, nrows=0).columns[0]
+    usecols = [index_col] + [col for col in columns if col != index_col]
+    return pd.read_table(path, index_col=0, usecols=usecols)
+
+
+def _read_columnar(path, key, columns, columnar_dir):
+    # the parsed file is stored in a columnar format next to the other converted files, keyed by the identity of the source file
+    name = hashlib.blake2b(repr(key).encode(), digest_size=16).hexdigest()
+    columnar_path = os.path.join(columnar_dir, f"{name}.parquet")
+    if os.path.exists(columnar_path):
+        return pd.read_parquet(columnar_path, columns=list(columns) if columns is not None else None)
+    df = _read_table(path)
+    os.makedirs(columnar_dir, exist_ok=True)
+    tmp_path = f"{columnar_path}.{os.getpid()}.tmp"
+    df.to_parquet(tmp_path)
+    os.replace(tmp_path, columnar_path)
+    return df[list(columns)] if columns is not None else df
+
+
+def load_predictions(path, columns=None, columnar_dir=None):
+    """
+    Load a file with predictions. Parsed files are kept in memory keyed by their path, modification time and size,
+    so repeated calls only read a file again if it has changed. Do not modify the returned `DataFrame` in place, it is shared between calls.
+
+    Args:
+        path: path to the tab-separated file with the predictions, the first column is the index
+        columns: names of the columns to read, all columns by default
+        columnar_dir: optional directory to store the parsed files in the Parquet format, later calls then read only the requested columns from there, requires `pyarrow`
+
+    Returns:
+        a `DataFrame` with the predictions
+    """
+
+    key = _file_key(path)
+    cache_key = key + (tuple(columns) if columns is not None else None,)
+    with _CACHE_LOCK:
+        if cache_key in _CACHE:
+            _CACHE.move_to_end(cache_key)
+            return _CACHE[cache_key]
+    df = None
+    if columnar_dir is not None:
+        try:
+            df = _read_columnar(path, key, columns, columnar_dir)
+        except ImportError:
+            df = None
+    if df is None:
+        df = _read_table(path, columns)
+    with _CACHE_LOCK:
+        _CACHE[cache_key] = df
+        while len(_CACHE) > MAX_CACHED_FILES:
+            _CACHE.popitem(last=False)
+    return df
+
+
+def clear_predictions_cache():
+    """
+    Remove all parsed prediction files from memory.
+    """
+
+    with _CACHE_LOCK:
+        _CACHE.clear()
+
+
+def to_labels(values, prefix, offset=0):
+    """
+    Convert integer class or fold numbers to categorical labels, i.e. `0` to `"Class_0"`.
+
+    Args:
+        values: a `Series` of numbers, floats are truncated to integers
+        prefix: prefix of the labels
+        offset: number added to the values before they are converted
+
+    Returns:
+        a categorical `Series` with the same index, the categories are sorted by their number
+    """
+
+    numbers = values.to_numpy().astype(np.int64) + offset
+    categories, codes = np.unique(numbers, return_inverse=True)
+    labels = pd.Categorical.from_codes(codes.ravel(), categories=[f"{prefix}{number}" for number in categories])
+    return pd.Series(labels, index=values.index, name=values.name)
+
+
+def concat_categorical(frames):
+    """
+    Concatenate data frames and keep the columns that are categorical in any of them categorical.
+    `pandas.concat` turns categorical columns with different categories into plain objects.
+
+    Args:
+        frames: the data frames to concatenate
+
+    Returns:
+        the concatenated `DataFrame`
+    """
+
+    categorical = dict()
+    for frame in frames:
+        for col in frame.columns:
+            if isinstance(frame[col].dtype, pd.CategoricalDtype):
+                categorical.setdefault(col, []).extend(frame[col].cat.categories)
+    df = pd.concat(frames)
+    for col, categories in categorical.items():
+        df[col] = pd.Categorical(df[col], categories=list(dict.fromkeys(categories)))
+    return df
@@ -0,0 +1,184 @@
+"""
+registry
+
+In-memory registry of the embeddings of data sets, shared by all plots made in one session.
+
+Created by: Martin Sicho
+On: 18.10.26, 20:15
+"""
+import copy
+import threading
+
+import pandas as pd
+
+from scaffviz.data.cache import EmbeddingCache, hash_settings
+
+
+class EmbeddingRegistry:
+    """
+    Computes the embedding of each data set and manifold at most once and hands it to every plot that needs it.
+    Embeddings are keyed by the identity of the data set (its store location and size), its feature set and the manifold settings.
+    Concurrent requests for the same embedding wait for the first one to finish instead of computing it again.
+    """
+
+    def __init__(self, cache : EmbeddingCache | None = None, use_existing : bool = False):
+        """
+        Initialize the registry.
+
+        Args:
+            cache: optional `EmbeddingCache` to persist the embeddings between sessions
+            use_existing: reuse coordinates already stored in a data set instead of computing them,
+                only if the data set is a `ManifoldTable` that stores the fitted manifold they come from with the same settings
+        """
+
+        self.cache = cache
+        self.useExisting = use_existing
+        self.embeddings = dict()
+        self.manifolds = dict()
+        self._locks = dict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def getFeatures(dataset):
+        """
+        Get the feature matrix of a data set the embedding is calculated from.
+
+        Args:
+            dataset: a `QSPRDataset` or a `MoleculeTable`
+
+        Returns:
+            the features as a `DataFrame` indexed like the data set
+        """
+
+        if hasattr(dataset, "getFeatures"):
+            return dataset.getFeatures(concat=True)
+        return dataset.getDescriptors()
+
+    def getKey(self, dataset, manifold, features : pd.DataFrame | None = None):
+        """
+        Get the key of the embedding of a data set.
+
+        Args:
+            dataset: a `QSPRDataset` or a `MoleculeTable`
+            manifold: the `Manifold`
+            features: the features of the data set, by default taken from `getFeatures`
+
+        Returns:
+            the key
+        """
+
+        features = features if features is not None else self.getFeatures(dataset)
+        identity = getattr(dataset, "storePrefix", None) or dataset.name
+        return (identity, len(features), tuple(features.columns), str(manifold), hash_settings(manifold))
+
+    def _getLock(self, key):
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    @staticmethod
+    def _getExisting(dataset, manifold):
+        # coordinates with the name of the manifold can come from different settings, only the stored manifold tells
+        if not hasattr(dataset, "getManifold"):
+            return None
+        stored = dataset.getManifold(str(manifold))
+        if stored is None or hash_settings(stored) != hash_settings(manifold):
+            return None
+        df = dataset.getDF()
+        columns = []
+        while f"{manifold}_{len(columns) + 1}" in df.columns:
+            columns.append(f"{manifold}_{len(columns) + 1}")
+        if not columns or df[columns].isna().any().any():
+            return None
+        return df[columns]
+
+    def getEmbedding(self, dataset, manifold, features : pd.DataFrame | None = None):
+        """
+        Get the embedding of a data set, compute it if it is not registered yet.
+
+        Args:
+            dataset: a `QSPRDataset` or a `MoleculeTable`
+            manifold: the `Manifold` to embed the data set with, it is not modified, a copy is fitted instead
+            features: the features to embed, by default taken from `getFeatures`
+
+        Returns:
+            a `DataFrame` indexed like the features with one column per dimension named as in `ManifoldTable`
+        """
+
+        features = features if features is not None else self.getFeatures(dataset)
+        key = self.getKey(dataset, manifold, features)
+        with self._getLock(key):
+            if key in self.embeddings:
+                return self.embeddings[key]
+            columns = None
+            coords = None
+            if self.useExisting:
+                existing = self._getExisting(dataset, manifold)
+                if existing is not None:
+                    columns = existing.columns.tolist()
+                    coords = existing.loc[features.index].values
+            if coords is None and self.cache is not None:
+                cache_key = self.cache.getKey(features, manifold)
+                coords = self.cache.get(cache_key)
+            if coords is None:
+                fitted = copy.deepcopy(manifold)
+                # callbacks are not copied with the manifold
+                fitted.callbacks = list(manifold.callbacks)
+                coords = fitted.fit_transform(features)
+                self.manifolds[key] = fitted
+                if self.cache is not None:
+                    self.cache.put(cache_key, coords)
+            columns = columns or [f"{manifold}_{i + 1}" for i in range(coords.shape[1])]
+            self.embeddings[key] = pd.DataFrame(coords, index=features.index, columns=columns)
+            return self.embeddings[key]
+
+    def getManifold(self, dataset, manifold, features : pd.DataFrame | None = None):
+        """
+        Get the manifold fitted on a data set by `getEmbedding`.
+
+        Args:
+            dataset: a `QSPRDataset` or a `MoleculeTable`
+            manifold: the `Manifold` the embedding was requested with
+            features: the features of the data set, by default taken from `getFeatures`
+
+        Returns:
+            the fitted `Manifold` or `None` if the embedding was not computed in this session
+        """
+
+        return self.manifolds.get(self.getKey(dataset, manifold, features))
+
+    def remove(self, dataset, manifold, features : pd.DataFrame | None = None):
+        """
+        Remove the embedding of a data set from the registry.
+
+        Args:
+            dataset: a `QSPRDataset` or a `MoleculeTable`
+            manifold: the `Manifold`
+            features: the features of the data set, by default taken from `getFeatures`
+        """
+
+        key = self.getKey(dataset, manifold, features)
+        with self._getLock(key):
+            self.embeddings.pop(key, None)
+            self.manifolds.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self.embeddings.clear()
+            self.manifolds.clear()
+
+    def __len__(self):
+        return len(self.embeddings)
+
+
+_REGISTRY = EmbeddingRegistry()
+
+
+def get_registry():
+    """
+    Get the registry shared by all plots in this session.
+
+    Returns:
+        the shared `EmbeddingRegistry`
+    """
+
+    return _REGISTRY
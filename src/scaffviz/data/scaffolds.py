@@ -0,0 +1,265 @@
+"""
+scaffolds
+
+Scaffold index of molecule tables: scaffolds calculated in parallel, cached per table and grouped incrementally.
+
+Created by: Martin Sicho
+On: 18.10.26, 20:40
+"""
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+OTHER_GROUP = "Other"
+"""Name of the group of molecules with scaffolds that have too few molecules to form their own group."""
+
+
+def murcko_scaffold(smiles : str):
+    """
+    Get the Bemis-Murcko scaffold of a molecule.
+
+    Args:
+        smiles: SMILES of the molecule
+
+    Returns:
+        SMILES of the scaffold or `None` if the molecule could not be parsed
+    """
+
+    from rdkit import Chem
+    from rdkit.Chem.Scaffolds import MurckoScaffold
+
+    mol = Chem.MolFromSmiles(smiles)
+    if mol is None:
+        return None
+    return Chem.MolToSmiles(MurckoScaffold.GetScaffoldForMol(mol))
+
+
+def generic_murcko_scaffold(smiles : str):
+    """
+    Get the generic Bemis-Murcko scaffold of a molecule, with all atoms replaced by carbons and all bonds by single bonds.
+
+    Args:
+        smiles: SMILES of the molecule
+
+    Returns:
+        SMILES of the scaffold or `None` if the molecule could not be parsed
+    """
+
+    from rdkit import Chem
+    from rdkit.Chem.Scaffolds import MurckoScaffold
+
+    mol = Chem.MolFromSmiles(smiles)
+    if mol is None:
+        return None
+    scaffold = MurckoScaffold.GetScaffoldForMol(mol)
+    return Chem.MolToSmiles(MurckoScaffold.MakeScaffoldGeneric(scaffold))
+
+
+SCAFFOLDS = {
+    "BemisMurcko": murcko_scaffold,
+    "GenericBemisMurcko": generic_murcko_scaffold,
+}
+"""Scaffold types that can be calculated by `compute_scaffolds`."""
+
+
+def _compute_chunk(smiles, kinds):
+    return {kind: [SCAFFOLDS[kind](smi) if isinstance(smi, str) else None for smi in smiles] for kind in kinds}
+
+
+def compute_scaffolds(smiles, kinds=("BemisMurcko",), n_jobs=1, chunk_size=10000):
+    """
+    Calculate the scaffolds of molecules in a process pool.
+
+    Args:
+        smiles: a `Series` with the SMILES of the molecules
+        kinds: names of the scaffold types to calculate (keys of `SCAFFOLDS`)
+        n_jobs: number of processes, `-1` uses all available cores
+        chunk_size: number of molecules processed by one task
+
+    Returns:
+        a `DataFrame` indexed like `smiles` with one column of scaffold SMILES per scaffold type
+    """
+
+    for kind in kinds:
+        if kind not in SCAFFOLDS:
+            raise ValueError(f"Unknown scaffold type: {kind}. Available types: {list(SCAFFOLDS)}")
+    values = smiles.tolist()
+    chunks = [values[i:i + chunk_size] for i in range(0, len(values), chunk_size)]
+    if n_jobs is None or n_jobs == 0:
+        n_jobs = 1
+    elif n_jobs < 0:
+        n_jobs = os.cpu_count() or 1
+    if n_jobs == 1 or len(chunks) <= 1:
+        results = [_compute_chunk(chunk, kinds) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=min(n_jobs, len(chunks))) as executor:
+            results = list(executor.map(_compute_chunk, chunks, [kinds] * len(chunks)))
+    columns = {kind: [scaffold for result in results for scaffold in result[kind]] for kind in kinds}
+    return pd.DataFrame(columns, index=smiles.index)
+
+
+class ScaffoldIndex:
+    """
+    Maps the molecules of a table to their scaffolds and scaffold groups.
+    Scaffolds are only calculated for molecules that were not indexed before, so appending molecules to a table only costs the new scaffolds.
+    Every scaffold is stored once with the molecules referring to it by a code,
+    which makes forming the groups for any number of molecules per group a single vectorized operation.
+    """
+
+    def __init__(self, kinds=("BemisMurcko",), n_jobs=1, chunk_size=10000):
+        """
+        Initialize an empty index.
+
+        Args:
+            kinds: names of the scaffold types to index, only used if the scaffolds are calculated by the index (see `compute_scaffolds`)
+            n_jobs: number of processes used to calculate the scaffolds
+            chunk_size: number of molecules processed by one task
+        """
+
+        self.nJobs = n_jobs
+        self.chunkSize = chunk_size
+        self._lock = threading.Lock()
+        self._reset(kinds)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.smiles)
+
+    def update(self, smiles : pd.Series, scaffolds : pd.DataFrame | None = None):
+        """
+        Index the molecules that are new or changed and drop the molecules that are no longer in the table.
+
+        Args:
+            smiles: a `Series` with the SMILES of all molecules in the table
+            scaffolds: optional `DataFrame` with precalculated scaffolds of the molecules (i.e. from `MoleculeTable.addScaffolds`), its columns are used as the scaffold types
+
+        Returns:
+            the number of newly indexed molecules
+        """
+
+        with self._lock:
+            if scaffolds is not None:
+                kinds = scaffolds.columns.tolist()
+                if kinds != self.kinds:
+                    self._reset(kinds)
+            known = self.smiles.reindex(smiles.index)
+            changed = known.isna() | (known != smiles)
+            if len(smiles) == len(self.smiles) and not changed.any():
+                return 0
+            new = smiles[changed]
+            if scaffolds is not None:
+                new_scaffolds = scaffolds.loc[new.index, self.kinds]
+            else:
+                new_scaffolds = compute_scaffolds(new, self.kinds, n_jobs=self.nJobs, chunk_size=self.chunkSize)
+            for kind in self.kinds:
+                values = self.scaffolds[kind].reindex(smiles.index)
+                values.loc[new.index] = new_scaffolds[kind].values
+                self.scaffolds[kind] = values
+                self.codes[kind] = pd.Series(pd.Categorical(values.values), index=values.index)
+            self.smiles = smiles.copy()
+            self._groups = dict()
+            return len(new)
+
+    def _reset(self, kinds):
+        self.kinds = list(kinds)
+        self.smiles = pd.Series(dtype=object)
+        self.scaffolds = {kind: pd.Series(dtype=object) for kind in self.kinds}
+        self.codes = dict()
+        self._groups = dict()
+
+    def getScaffolds(self, kind : str | None = None):
+        """
+        Get the scaffolds of the indexed molecules.
+
+        Args:
+            kind: the scaffold type, the first one by default
+
+        Returns:
+            a `Series` with the scaffold SMILES of each molecule
+        """
+
+        return self.scaffolds[kind or self.kinds[0]]
+
+    def getGroupName(self, kind : str | None, mols_per_group : int):
+        return f"ScaffoldGroup_{kind or self.kinds[0]}_{mols_per_group}"
+
+    def getGroups(self, kind : str | None = None, mols_per_group : int = 10):
+        """
+        Get the scaffold groups of the indexed molecules. Molecules with scaffolds shared by fewer than `mols_per_group` molecules are put in the `OTHER_GROUP`.
+        The groups are memoized for each number of molecules per group until the index changes.
+
+        Args:
+            kind: the scaffold type, the first one by default
+            mols_per_group: minimum number of molecules in a group
+
+        Returns:
+            a categorical `Series` with the group of each molecule, named by `getGroupName`
+        """
+
+        kind = kind or self.kinds[0]
+        key = (kind, mols_per_group)
+        with self._lock:
+            if key in self._groups:
+                return self._groups[key]
+            codes = self.codes[kind]
+            categories = codes.cat.categories
+            code_values = codes.cat.codes.values
+            counts = np.bincount(code_values[code_values >= 0], minlength=len(categories))
+            kept = counts >= mols_per_group
+            # map every scaffold to itself if its group is large enough and to the other group otherwise
+            group_categories = [OTHER_GROUP] + categories[kept].tolist()
+            mapping = np.zeros(len(categories), dtype=np.int64)
+            mapping[kept] = np.arange(1, kept.sum() + 1)
+            group_codes = np.where(code_values >= 0, mapping[np.maximum(code_values, 0)], 0)
+            groups = pd.Series(
+                pd.Categorical.from_codes(group_codes, categories=group_categories),
+                index=codes.index,
+                name=self.getGroupName(kind, mols_per_group)
+            )
+            self._groups[key] = groups
+            return groups
+
+
+MAX_INDICES = 16
+"""Maximum number of indices kept by `get_scaffold_index`, the least recently used ones are dropped first."""
+
+_INDICES = OrderedDict()
+_INDICES_LOCK = threading.Lock()
+
+
+def get_scaffold_index(table, kinds=("BemisMurcko",), n_jobs=1):
+    """
+    Get the scaffold index of a table, it is created on first use and shared by all later calls for the same table and scaffold types.
+    Tables are identified by their store location, so the index survives reloading a table in the same session.
+    Only the `MAX_INDICES` most recently used indices are kept, the index of a table dropped before is created again.
+    The index is not updated by this function, use `ScaffoldIndex.update` to index new molecules.
+
+    Args:
+        table: the `MoleculeTable`
+        kinds: scaffold types of the index
+        n_jobs: number of processes of a new index
+
+    Returns:
+        the `ScaffoldIndex`
+    """
+
+    key = (getattr(table, "storePrefix", None) or table.name, tuple(kinds))
+    with _INDICES_LOCK:
+        if key not in _INDICES:
+            _INDICES[key] = ScaffoldIndex(kinds, n_jobs=n_jobs)
+        _INDICES.move_to_end(key)
+        while len(_INDICES) > MAX_INDICES:
+            _INDICES.popitem(last=False)
+        return _INDICES[key]
@@ -0,0 +1,178 @@
+"""
+spatial
+
+Spatial index of the points of a 2D map for fast queries by position, such as the point under the cursor, the points in a rectangle or lasso and the nearest neighbors of a point.
+
+Created by: Martin Sicho
+On: 18.10.26, 22:45
+"""
+import numpy as np
+
+
+class SpatialIndex:
+    """
+    Index of the points of a 2D map. The points are sorted into a uniform grid of cells with a few points each,
+    so rectangle and lasso queries only look at the points in the cells they overlap. Nearest neighbor queries use a KD-tree built on first use.
+    All queries return positions of the points in the indexed arrays.
+    """
+
+    def __init__(self, x, y, points_per_cell : int = 16):
+        """
+        Build the index.
+
+        Args:
+            x: x coordinates of the points
+            y: y coordinates of the points
+            points_per_cell: average number of points per grid cell, determines the size of the grid
+        """
+
+        self.x = np.ascontiguousarray(x, dtype=np.float64)
+        self.y = np.ascontiguousarray(y, dtype=np.float64)
+        if self.x.shape != self.y.shape:
+            raise ValueError(f"The x and y coordinates have different shapes: {self.x.shape} and {self.y.shape}")
+        finite = np.isfinite(self.x) & np.isfinite(self.y)
+        self.xRange = (self.x[finite].min(), self.x[finite].max()) if finite.any() else (0.0, 1.0)
+        self.yRange = (self.y[finite].min(), self.y[finite].max()) if finite.any() else (0.0, 1.0)
+        self.gridSize = max(1, int(np.ceil(np.sqrt(finite.sum() / points_per_cell))))
+        cells = self._cells(self.x[finite], self.y[finite])
+        # positions of the points sorted by their cell, the points of cell i are order[starts[i]:starts[i + 1]]
+        order = np.argsort(cells, kind="stable")
+        self.positions = np.flatnonzero(finite)
+        self.order = self.positions[order]
+        counts = np.bincount(cells, minlength=self.gridSize * self.gridSize)
+        self.starts = np.concatenate([[0], np.cumsum(counts)])
+        self._tree = None
+
+    def __len__(self):
+        return len(self.x)
+
+    def _cellCoords(self, values, value_range):
+        span = (value_range[1] - value_range[0]) or 1.0
+        return np.clip(((values - value_range[0]) / span * self.gridSize).astype(np.int64), 0, self.gridSize - 1)
+
+    def _cells(self, x, y):
+        return self._cellCoords(y, self.yRange) * self.gridSize + self._cellCoords(x, self.xRange)
+
+    def getTree(self):
+        """
+        Get the KD-tree of the points, it is built on first use.
+
+        Returns:
+            the `scipy.spatial.cKDTree`, built on the points with finite coordinates in the order of `order`
+        """
+
+        if self._tree is None:
+            from scipy.spatial import cKDTree
+            self._tree = cKDTree(np.column_stack([self.x[self.order], self.y[self.order]]))
+        return self._tree
+
+    def rect(self, x_range=None, y_range=None):
+        """
+        Find the points inside a rectangle.
+
+        Args:
+            x_range: `(min, max)` of the rectangle on the x-axis, `None` for no limit
+            y_range: `(min, max)` of the rectangle on the y-axis, `None` for no limit
+
+        Returns:
+            sorted positions of the points in the rectangle
+        """
+
+        x0, x1 = sorted(x_range) if x_range is not None else self.xRange
+        y0, y1 = sorted(y_range) if y_range is not None else self.yRange
+        if x0 > self.xRange[1] or x1 < self.xRange[0] or y0 > self.yRange[1] or y1 < self.yRange[0]:
+            return np.empty(0, dtype=np.int64)
+        if x0 <= self.xRange[0] and x1 >= self.xRange[1] and y0 <= self.yRange[0] and y1 >= self.yRange[1]:
+            return self.positions.copy()
+        c0, c1 = self._cellCoords(np.array([x0, x1]), self.xRange)
+        r0, r1 = self._cellCoords(np.array([y0, y1]), self.yRange)
+        # the cells of one grid row are contiguous in the sorted order
+        if c0 == 0 and c1 == self.gridSize - 1:
+            candidates = self.order[self.starts[r0 * self.gridSize]:self.starts[(r1 + 1) * self.gridSize]]
+        else:
+            rows = np.arange(r0, r1 + 1) * self.gridSize
+            candidates = np.concatenate([self.order[self.starts[row + c0]:self.starts[row + c1 + 1]] for row in rows])
+        x, y = self.x[candidates], self.y[candidates]
+        inside = (x >= x0) & (x <= x1) & (y >= y0) & (y <= y1)
+        return np.sort(candidates[inside])
+
+    def lasso(self, xs, ys):
+        """
+        Find the points inside a polygon, i.e. a lasso selection.
+
+        Args:
+            xs: x coordinates of the vertices of the polygon
+            ys: y coordinates of the vertices of the polygon
+
+        Returns:
+            sorted positions of the points in the polygon
+        """
+
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        candidates = self.rect((xs.min(), xs.max()), (ys.min(), ys.max()))
+        x, y = self.x[candidates], self.y[candidates]
+        inside = np.zeros(len(candidates), dtype=bool)
+        # even-odd rule: count the crossings of a horizontal ray from each point with the edges of the polygon
+        for xa, ya, xb, yb in zip(xs, ys, np.roll(xs, -1), np.roll(ys, -1)):
+            if ya == yb:
+                continue
+            crosses = (ya > y) != (yb > y)
+            x_cross = xa + (y - ya) * (xb - xa) / (yb - ya)
+            inside ^= crosses & (x < x_cross)
+        return candidates[inside]
+
+    def nearest(self, x : float, y : float, max_distance : float | None = None):
+        """
+        Find the point closest to a position, i.e. the point under the cursor.
+
+        Args:
+            x: x coordinate of the position
+            y: y coordinate of the position
+            max_distance: only points closer than this are found
+
+        Returns:
+            a tuple of the position of the point and its distance, the position is `-1` if there is no point within `max_distance`
+        """
+
+        if len(self.order) == 0:
+            return -1, np.inf
+        distance, i = self.getTree().query([x, y], distance_upper_bound=max_distance if max_distance is not None else np.inf)
+        if not np.isfinite(distance):
+            return -1, np.inf
+        return int(self.order[i]), float(distance)
+
+    def kneighbors(self, points, k : int = 10):
+        """
+        Find the nearest neighbors of points of the map or of arbitrary positions.
+
+        Args:
+            points: positions of indexed points, their neighbors exclude the points themselves, or an array of shape `(n, 2)` with coordinates
+            k: number of neighbors
+
+        Returns:
+            a tuple of `(distances, indices)` arrays of shape `(n, k)`, the indices are positions of the points, missing neighbors have the index `-1`
+        """
+
+        points = np.asarray(points)
+        own = None
+        if points.ndim == 1:
+            own = points.astype(np.int64)
+            points = np.column_stack([self.x[own], self.y[own]])
+            k += 1
+        k_query = min(k, len(self.order))
+        distances, indices = self.getTree().query(points, k=k_query)
+        distances = np.asarray(distances).reshape(len(points), k_query)
+        indices = self.order[np.asarray(indices).reshape(len(points), k_query)]
+        if k_query < k:
+            distances = np.hstack([distances, np.full((len(points), k - k_query), np.inf)])
+            indices = np.hstack([indices, np.full((len(points), k - k_query), -1)])
+        if own is not None:
+            # drop the point itself, or the farthest neighbor if a duplicate of the point came first
+            is_own = indices == own[:, None]
+            is_own[~is_own.any(axis=1), -1] = True
+            keep = ~is_own
+            keep[is_own.sum(axis=1) > 1] = True
+            distances = distances[keep].reshape(len(points), k - 1)
+            indices = indices[keep].reshape(len(points), k - 1)
+        return distances, indices
@@ -0,0 +1,194 @@
+"""
+store
+
+On-disk storage of large matrices (i.e. fingerprints of millions of molecules) that are written in chunks and read back memory-mapped.
+
+Created by: Martin Sicho
+On: 18.10.26, 21:05
+"""
+import json
+import os
+import shutil
+
+import numpy as np
+
+from scaffviz.clustering.fingerprints import PackedFingerprints
+
+
+class ArrayStore:
+    """
+    An append-only two-dimensional array stored in a directory as raw binary data with a JSON file of metadata.
+    Rows are appended chunk by chunk, so the whole array never has to be in memory, and are read back as a `numpy.memmap`.
+    """
+
+    DATA_FILE = "data.bin"
+    META_FILE = "meta.json"
+
+    def __init__(self, path : str, n_cols : int, dtype="float32", columns : list | None = None, attrs : dict | None = None):
+        """
+        Create a new empty store, an existing store in the same directory is removed. Use `ArrayStore.open` to open an existing store.
+
+        Args:
+            path: directory of the store
+            n_cols: number of columns of the array
+            dtype: data type of the array
+            columns: optional names of the columns
+            attrs: optional `dict` of additional information saved with the store, must be serializable to JSON
+        """
+
+        self.path = os.path.abspath(path)
+        self.nCols = n_cols
+        self.dtype = np.dtype(dtype)
+        self.columns = list(columns) if columns is not None else None
+        self.attrs = dict(attrs) if attrs else dict()
+        self.nRows = 0
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        os.makedirs(self.path)
+        open(self.getDataPath(), "wb").close()
+        self.saveMeta()
+
+    @classmethod
+    def open(cls, path : str):
+        """
+        Open an existing store.
+
+        Args:
+            path: directory of the store
+
+        Returns:
+            the store or `None` if there is no store in `path`
+        """
+
+        path = os.path.abspath(path)
+        meta_path = os.path.join(path, cls.META_FILE)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path) as meta_file:
+            meta = json.load(meta_file)
+        store = cls.__new__(cls)
+        store.path = path
+        store.nCols = meta["n_cols"]
+        store.dtype = np.dtype(meta["dtype"])
+        store.columns = meta["columns"]
+        store.attrs = meta["attrs"]
+        store.nRows = meta["n_rows"]
+        return store
+
+    def getDataPath(self):
+        return os.path.join(self.path, self.DATA_FILE)
+
+    def saveMeta(self):
+        meta = {
+            "n_cols": self.nCols,
+            "n_rows": self.nRows,
+            "dtype": self.dtype.str,
+            "columns": self.columns,
+            "attrs": self.attrs,
+        }
+        tmp_path = os.path.join(self.path, f"{self.META_FILE}.tmp")
+        with open(tmp_path, "w") as meta_file:
+            json.dump(meta, meta_file)
+        os.replace(tmp_path, os.path.join(self.path, self.META_FILE))
+
+    @property
+    def shape(self):
+        return self.nRows, self.nCols
+
+    def __len__(self):
+        return self.nRows
+
+    def append(self, block):
+        """
+        Append rows to the end of the array.
+
+        Args:
+            block: array of shape `(n_rows, n_cols)`, it is converted to the data type of the store
+        """
+
+        block = np.ascontiguousarray(block, dtype=self.dtype)
+        if block.ndim != 2 or block.shape[1] != self.nCols:
+            raise ValueError(f"Cannot append a block of shape {block.shape} to a store with {self.nCols} columns.")
+        with open(self.getDataPath(), "ab") as data_file:
+            data_file.write(block.tobytes())
+        self.nRows += block.shape[0]
+        self.saveMeta()
+
+    def read(self, mode="r"):
+        """
+        Map the array to memory without reading it.
+
+        Args:
+            mode: mode of the `numpy.memmap`, `"r"` for read-only access, `"r+"` to modify the stored values in place
+
+        Returns:
+            a `numpy.memmap` of shape `(n_rows, n_cols)` or an empty array if the store has no rows
+        """
+
+        if self.nRows == 0:
+            return np.empty((0, self.nCols), dtype=self.dtype)
+        return np.memmap(self.getDataPath(), dtype=self.dtype, mode=mode, shape=self.shape)
+
+    def move(self, path : str):
+        """
+        Move the store to another directory, an existing store there is replaced.
+
+        Args:
+            path: the new directory of the store
+        """
+
+        path = os.path.abspath(path)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.move(self.path, path)
+        self.path = path
+
+    def remove(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+class FingerprintStore(ArrayStore):
+    """
+    An `ArrayStore` of binary fingerprints with eight bits packed into each byte (see `PackedFingerprints`).
+    """
+
+    def __init__(self, path : str, n_bits : int, attrs : dict | None = None):
+        """
+        Create a new empty store.
+
+        Args:
+            path: directory of the store
+            n_bits: length of the fingerprints
+            attrs: optional `dict` of additional information saved with the store
+        """
+
+        super().__init__(path, (n_bits + 7) // 8, dtype=np.uint8, attrs={**(attrs or dict()), "n_bits": n_bits})
+
+    @property
+    def nBits(self):
+        return self.attrs["n_bits"]
+
+    def appendFingerprints(self, X):
+        """
+        Pack binary fingerprints and append them to the store.
+
+        Args:
+            X: a binary matrix of shape `(n_rows, n_bits)` or `PackedFingerprints`
+        """
+
+        if not isinstance(X, PackedFingerprints):
+            X = PackedFingerprints.fromDense(np.asarray(X))
+        if X.nBits != self.nBits:
+            raise ValueError(f"Cannot append fingerprints with {X.nBits} bits to a store of {self.nBits} bits.")
+        self.append(X.bits)
+
+    def getFingerprints(self):
+        """
+        Get the stored fingerprints without reading them to memory.
+
+        Returns:
+            `PackedFingerprints` backed by the memory-mapped store
+        """
+
+        return PackedFingerprints(self.read(), self.nBits)
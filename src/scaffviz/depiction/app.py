@@ -0,0 +1,283 @@
+"""
+app
+
+Dash app for interactive molecule maps, based on `molplotly.add_molecules`. Unlike in `molplotly`, points are resolved from the `customdata` of the hovered point instead of the trace and point number,
+so the figure can be redrawn with a different subset of points whenever the user zooms (see `scaffviz.depiction.lod`),
+and the depictions on the cards come from a `DepictionCache` instead of being rendered on every hover.
+
+Created by: Martin Sicho
+On: 18.10.26, 15:55
+"""
+import textwrap
+from typing import TYPE_CHECKING, Callable
+
+import numpy as np
+import pandas as pd
+
+from scaffviz.data.spatial import SpatialIndex
+from scaffviz.depiction.depictions import DepictionCache
+from scaffviz.depiction.lod import LevelOfDetail
+
+if TYPE_CHECKING:
+    import plotly.graph_objects as go
+
+ROW_COL = "_scaffviz_row"
+"""Name of the column with the row position of each point, passed to the figure as `custom_data`."""
+
+
+def parse_viewport(relayout : dict):
+    """
+    Get the axis ranges from the `relayoutData` of a `dcc.Graph`.
+
+    Args:
+        relayout: the `relayoutData` dictionary
+
+    Returns:
+        a tuple `(x_range, y_range)`, a range is `None` if the axis shows its full extent,
+        or `None` if the relayout event did not change the viewport
+    """
+
+    if not relayout:
+        return None
+    ranges = []
+    changed = False
+    for axis in ("xaxis", "yaxis"):
+        if f"{axis}.range[0]" in relayout:
+            ranges.append((relayout[f"{axis}.range[0]"], relayout[f"{axis}.range[1]"]))
+            changed = True
+        elif f"{axis}.range" in relayout:
+            ranges.append(tuple(relayout[f"{axis}.range"]))
+            changed = True
+        else:
+            changed = changed or f"{axis}.autorange" in relayout or "autosize" in relayout
+            ranges.append(None)
+    return tuple(ranges) if changed else None
+
+
+def select_rows(index : SpatialIndex, selected : dict | None):
+    """
+    Find all points in a box or lasso selection of a `dcc.Graph`, including the points that are not drawn at the current level of detail.
+
+    Args:
+        index: `SpatialIndex` of all points
+        selected: the `selectedData` dictionary
+
+    Returns:
+        sorted positions of the selected points or `None` if nothing is selected
+    """
+
+    if not selected:
+        return None
+    if "lassoPoints" in selected:
+        return index.lasso(selected["lassoPoints"]["x"], selected["lassoPoints"]["y"])
+    if "range" in selected:
+        return index.rect(selected["range"]["x"], selected["range"]["y"])
+    return None
+
+
+def create_app(
+        df : pd.DataFrame,
+        make_figure : Callable[[pd.DataFrame], "go.Figure"],
+        smiles_cols : list[str],
+        title_col : str | None = None,
+        caption_cols : list[str] | None = None,
+        color_col : str | list[str] | None = None,
+        lod : LevelOfDetail | None = None,
+        show_density : bool = False,
+        depictions : DepictionCache | None = None,
+        svg_size : int = 200,
+        alpha : float = 0.75,
+        mol_alpha : float = 0.7,
+        width : int = 150,
+        wraplen : int = 20,
+        fontfamily : str = "Arial",
+        fontsize : int = 12,
+        url_prefix : str | None = None,
+):
+    """
+    Create a Dash app that shows molecule cards when hovering over the points of a scatter plot.
+
+    Args:
+        df: the data frame with the plotted data, the figures made by `make_figure` have to pass its `ROW_COL` column as the first `custom_data` field
+        make_figure: function that creates the scatter plot for a subset of rows of `df`
+        smiles_cols: columns with the SMILES to depict on the cards, if there are more a dropdown is shown to choose from them
+        title_col: column to show as the card title
+        caption_cols: columns to show on the cards
+        color_col: column the points are colored by, used to color the card titles, if a list of columns is given, the user can switch between them with a menu and `make_figure` gets the chosen column as its second argument
+        lod: optional `LevelOfDetail`, if given, the figure is redrawn with the points in the current viewport whenever the user zooms or pans,
+            and box or lasso selections count all points in the selected area, not just the drawn ones
+        show_density: draw a server-side aggregated density of all points in the viewport underneath the drawn points, only used with `lod`
+        depictions: `DepictionCache` to get the depictions from, a new in-memory cache is used if not given
+        svg_size: size of the depictions in pixels, only used if `depictions` is not given
+        alpha: opacity of the cards
+        mol_alpha: opacity of the background of the depictions
+        width: width of the cards in pixels
+        wraplen: the title is wrapped to lines of this length
+        fontfamily: font family of the cards
+        fontsize: font size of the cards
+        url_prefix: URL prefix the app is served under (see `AppServer.getPrefix`), if given, a plain `Dash` app is created to be mounted on an `AppServer`
+
+    Returns:
+        the `JupyterDash` app or the `Dash` app if `url_prefix` is given
+    """
+
+    # dash and plotly are only needed once an app is made, not by the modules that import this one
+    import plotly.graph_objects as go
+    from dash import Input, Output, State, callback_context, dcc, html, no_update
+
+    caption_cols = caption_cols or []
+    depictions = depictions if depictions is not None else DepictionCache(size=svg_size)
+    color_layers = list(color_col) if isinstance(color_col, (list, tuple)) else None
+    if ROW_COL not in df.columns:
+        df = df.assign(**{ROW_COL: np.arange(len(df))})
+
+    def draw(frame, color):
+        return make_figure(frame, color) if color_layers else make_figure(frame)
+
+    def build_figure(x_range=None, y_range=None, color=None):
+        if lod is None:
+            fig = draw(df, color)
+        else:
+            fig = draw(df.iloc[lod.getIndices(x_range, y_range)], color)
+        if lod is not None and show_density:
+            counts, x_centers, y_centers = lod.getDensity(x_range, y_range)
+            density = go.Heatmap(
+                z=np.where(counts > 0, np.log1p(counts), np.nan),
+                x=x_centers,
+                y=y_centers,
+                colorscale="Greys",
+                showscale=False,
+                opacity=0.3,
+                hoverinfo="skip",
+            )
+            fig = go.Figure(data=(density,) + fig.data, layout=fig.layout)
+        if x_range is not None:
+            fig.update_xaxes(range=x_range)
+        if y_range is not None:
+            fig.update_yaxes(range=y_range)
+        # keep the zoom and legend state of the user when the figure is replaced
+        fig.update_layout(uirevision="lod")
+        fig.update_traces(hoverinfo="none", hovertemplate=None)
+        return fig
+
+    def trace_colors(fig):
+        colors = dict()
+        for trace in fig.data:
+            if trace.name is not None and isinstance(getattr(trace.marker, "color", None), str):
+                colors[trace.name] = trace.marker.color
+        return colors
+
+    fig = build_figure(color=color_layers[0] if color_layers else None)
+    # colors of the card titles for each color column, filled in when a layer is first shown
+    layer_colors = {color_layers[0] if color_layers else color_col: trace_colors(fig)}
+
+    if url_prefix is not None:
+        from dash import Dash
+        app = Dash(__name__, requests_pathname_prefix=url_prefix)
+    else:
+        from jupyter_dash import JupyterDash
+        app = JupyterDash(__name__)
+    controls = [
+        dcc.Dropdown(
+            options=[{"label": x, "value": x} for x in smiles_cols],
+            value=smiles_cols[0] if len(smiles_cols) == 1 else smiles_cols[:1],
+            multi=len(smiles_cols) > 1,
+            id="smiles-menu",
+            disabled=len(smiles_cols) == 1,
+        ),
+    ]
+    if color_layers:
+        controls.append(dcc.RadioItems(
+            options=[{"label": x, "value": x} for x in color_layers],
+            value=color_layers[0],
+            id="color-menu",
+            inline=True,
+        ))
+    app.layout = html.Div(controls + [
+        dcc.Graph(id="graph", figure=fig, clear_on_unhover=True),
+        dcc.Tooltip(id="graph-tooltip", background_color=f"rgba(255,255,255,{alpha})"),
+        dcc.Store(id="viewport"),
+        html.Div(id="selection-info", style={"font-family": fontfamily, "fontSize": fontsize}),
+    ])
+
+    def text(content, tag=html.P, color="black", size=fontsize):
+        return tag(content, style={"color": color, "font-family": fontfamily, "fontSize": size})
+
+    @app.callback(
+        output=[
+            Output("graph-tooltip", "show"),
+            Output("graph-tooltip", "bbox"),
+            Output("graph-tooltip", "children"),
+        ],
+        inputs=[
+            Input("graph", "hoverData"),
+            Input("smiles-menu", "value"),
+        ],
+        state=[State("color-menu", "value")] if color_layers else [],
+    )
+    def display_hover(hover_data, chosen, current_color=None):
+        if hover_data is None:
+            return False, no_update, no_update
+        pt = hover_data["points"][0]
+        if "customdata" not in pt:
+            # the density layer or another trace without data rows
+            return False, no_update, no_update
+        row = df.iloc[int(pt["customdata"][0])]
+        chosen = [chosen] if isinstance(chosen, str) else (chosen or smiles_cols[:1])
+        current_color = current_color if color_layers else color_col
+        colors = layer_colors.get(current_color, dict())
+        title_color = colors.get(str(row[current_color]), "black") if current_color else "black"
+
+        elements = []
+        for col in chosen:
+            img = depictions.get(row[col]) if isinstance(row[col], str) else None
+            if len(smiles_cols) > 1:
+                elements.append(text(col, html.H2, title_color, fontsize + 2))
+            if img is not None:
+                elements.append(html.Img(src=img, style={"width": "100%", "background-color": f"rgba(255,255,255,{mol_alpha})"}))
+        if title_col is not None:
+            title = str(row[title_col])
+            if len(title) > wraplen:
+                title = textwrap.fill(title, width=wraplen)
+            elements.append(text(title, html.H4, title_color))
+        elements.append(text(f"{fig.layout.xaxis.title.text} : {pt['x']}"))
+        elements.append(text(f"{fig.layout.yaxis.title.text} : {pt['y']}"))
+        for caption in caption_cols:
+            elements.append(text(f"{caption} : {row[caption]}"))
+        children = [html.Div(elements, style={"width": f"{width}px", "white-space": "normal"})]
+        return True, pt["bbox"], children
+
+    if lod is not None:
+        @app.callback(
+            output=Output("selection-info", "children"),
+            inputs=[Input("graph", "selectedData")],
+            prevent_initial_call=True,
+        )
+        def display_selection(selected):
+            rows = select_rows(lod.index, selected)
+            return f"{len(rows)} molecules selected" if rows is not None else ""
+
+    inputs = ([Input("graph", "relayoutData")] if lod is not None else []) + ([Input("color-menu", "value")] if color_layers else [])
+    if inputs:
+        @app.callback(
+            output=[Output("graph", "figure"), Output("viewport", "data")],
+            inputs=inputs,
+            state=[State("viewport", "data")] + ([State("color-menu", "value")] if color_layers else []),
+            prevent_initial_call=True,
+        )
+        def update_figure(*args):
+            viewport = args[-2] if color_layers else args[-1]
+            color = args[-1] if color_layers else None
+            triggered = [trigger["prop_id"] for trigger in callback_context.triggered]
+            if lod is not None and "graph.relayoutData" in triggered:
+                new_viewport = parse_viewport(args[0])
+                if new_viewport is None:
+                    return no_update, no_update
+                viewport = new_viewport
+            x_range, y_range = viewport if viewport else (None, None)
+            new_fig = build_figure(x_range, y_range, color)
+            if color not in layer_colors:
+                layer_colors[color] = trace_colors(new_fig)
+            return new_fig, viewport
+
+    return app
@@ -0,0 +1,240 @@
+"""
+batch
+
+Batch generation of molecule maps for many data sets, i.e. one map per Papyrus target, in a shared process pool.
+
+Created by: Martin Sicho
+On: 18.10.26, 23:05
+"""
+import copy
+import os
+import re
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from typing import Callable
+
+import pandas as pd
+
+STAGES = ("load", "descriptors", "embedding", "scaffolds", "export")
+"""Stages of making one map, each of them is timed separately in the report of `BatchPlot.make`."""
+
+# keeps the thread limits of a worker in effect for its lifetime
+_THREAD_LIMITS = None
+
+
+def _init_worker(max_memory : int | None, threads_per_worker : int | None):
+    global _THREAD_LIMITS
+
+    if max_memory:
+        try:
+            import resource
+            _, hard = resource.getrlimit(resource.RLIMIT_AS)
+            resource.setrlimit(resource.RLIMIT_AS, (max_memory, hard))
+        except (ImportError, ValueError, OSError):
+            pass
+    if threads_per_worker:
+        for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "NUMBA_NUM_THREADS"):
+            os.environ[var] = str(threads_per_worker)
+        try:
+            from threadpoolctl import threadpool_limits
+            _THREAD_LIMITS = threadpool_limits(threads_per_worker)
+        except ImportError:
+            pass
+
+
+def _peak_memory():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def target_name(target):
+    """
+    Get the name of a target of `BatchPlot.make`.
+
+    Args:
+        target: a `MoleculeTable` or a target ID
+
+    Returns:
+        the name of the table or the ID as a string
+    """
+
+    return target.name if hasattr(target, "getDF") else str(target)
+
+
+def _make_map(target, plot, out_dir, loader, descriptors, recalculate, save_tables, plot_kwargs):
+    from scaffviz.data.manifold_table import ManifoldTable
+
+    timings = dict()
+
+    @contextmanager
+    def stage(name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            timings[f"time_{name}"] = time.perf_counter() - start
+
+    name = target_name(target)
+    result = {"target": name, "status": "done", "path": None, "table": None, "error": None, "traceback": None}
+    start = time.perf_counter()
+    try:
+        with stage("load"):
+            table = loader(target) if loader is not None else target
+            table = table if isinstance(table, ManifoldTable) else ManifoldTable.fromMolTable(table)
+        with stage("descriptors"):
+            if descriptors:
+                table.addDescriptors(descriptors, recalculate=False)
+        with stage("embedding"):
+            if plot.manifold is not None:
+                table.addManifoldData(plot.manifold, recalculate=recalculate, cache=plot.cache, descriptor_format=plot.descriptorFormat)
+        with stage("scaffolds"):
+            if table.hasScaffolds or plot.scaffolds:
+                plot.getScaffoldIndex(table)
+        with stage("export"):
+            path = os.path.join(out_dir, re.sub(r"[^\w.-]+", "_", name))
+            result["path"] = plot.plot(table, export=path, recalculate=False, **plot_kwargs)
+            if save_tables:
+                result["table"] = table.save()
+    except Exception as exp:
+        result.update(status="failed", error=f"{type(exp).__name__}: {exp}", traceback=traceback.format_exc())
+    result.update(timings)
+    result["time_total"] = time.perf_counter() - start
+    result["peak_memory"] = _peak_memory()
+    result["worker"] = os.getpid()
+    return result
+
+
+class BatchPlot:
+    """
+    Makes the maps of many data sets in a process pool and exports them as static bundles (see `scaffviz.depiction.export`).
+    Every data set is processed by one worker from loading it to exporting its map: descriptors, embedding, scaffold grouping and the figure,
+    so the workers never exchange large data and a full panel of targets scales with the number of cores.
+    Each worker can be limited in memory and threads, and a data set that fails or crashes its worker is reported instead of stopping the batch.
+    """
+
+    def __init__(self, plot, loader : Callable | None = None, descriptors : list | None = None, n_jobs : int = -1, max_memory : int | None = None, threads_per_worker : int | None = 1, max_tasks_per_child : int | None = 1, retries : int = 1, recalculate : bool = False, save_tables : bool = False):
+        """
+        Initialize the batch.
+
+        Args:
+            plot: the `Plot` with the manifold, caches and scaffold settings used for all maps, its nested process pools are disabled in the workers
+            loader: function that loads the `MoleculeTable` of a target ID, i.e. from Papyrus, it has to be importable by the workers (a module-level function), targets are used as tables if not given
+            descriptors: descriptor sets to add to the tables that do not have them yet (see `MoleculeTable.addDescriptors`)
+            n_jobs: number of worker processes, `-1` uses all available cores
+            max_memory: limit of the address space of each worker in bytes, a data set that exceeds it fails with a `MemoryError` (only on POSIX systems)
+            threads_per_worker: number of threads each worker may use for numerical libraries, keeps the workers from oversubscribing the cores, `None` for no limit
+            max_tasks_per_child: number of data sets a worker processes before it is replaced by a fresh one, which returns the memory of large data sets to the system (Python 3.11+), `None` to keep the workers
+            retries: how many times the data sets that were being processed when a worker crashed are tried again
+            recalculate: recalculate embeddings the tables already have
+            save_tables: save the tables with their descriptors, coordinates and fitted manifolds to their store directories, the path of each saved table is in the report and it can be loaded with `ManifoldTable.fromFile`,
+                i.e. by the loader of the next batch, so that only the changed work is done
+        """
+
+        self.plot = plot
+        self.loader = loader
+        self.descriptors = descriptors
+        self.nJobs = n_jobs if n_jobs and n_jobs > 0 else os.cpu_count() or 1
+        self.maxMemory = max_memory
+        self.threadsPerWorker = threads_per_worker
+        self.maxTasksPerChild = max_tasks_per_child
+        self.retries = retries
+        self.recalculate = recalculate
+        self.saveTables = save_tables
+
+    def getWorkerPlot(self):
+        """
+        Get the copy of the plot sent to the workers, with the nested process pools disabled.
+
+        Returns:
+            the `Plot`
+        """
+
+        plot = copy.copy(self.plot)
+        plot.open_apps = dict()
+        plot.nJobs = 1
+        plot.prerender = 1
+        return plot
+
+    def _getExecutor(self, n_tasks):
+        kwargs = dict()
+        if self.maxTasksPerChild and sys.version_info >= (3, 11):
+            kwargs["max_tasks_per_child"] = self.maxTasksPerChild
+        return ProcessPoolExecutor(
+            max_workers=max(1, min(self.nJobs, n_tasks)),
+            initializer=_init_worker,
+            initargs=(self.maxMemory, self.threadsPerWorker),
+            **kwargs
+        )
+
+    def make(self, targets, out_dir : str, callback : Callable[[dict], None] | None = None, **kwargs):
+        """
+        Make and export the maps of the targets.
+
+        Args:
+            targets: `MoleculeTable`s or target IDs to pass to the loader, the largest tables are started first
+            out_dir: directory to export the maps to, each map is exported to a subdirectory named after its target
+            callback: optional function called with the report of each target as soon as it is finished
+            **kwargs: arguments passed to `Plot.plot`, i.e. `mols_per_scaffold_group` or `card_data`
+
+        Returns:
+            a `DataFrame` with one row per target in the order of `targets`, with its status, the path to its page, the path to its saved table, the error and traceback of failed targets,
+            the time of each of the `STAGES` and in total, the peak memory of its worker and the ID of its worker
+        """
+
+        targets = list(targets)
+        os.makedirs(out_dir, exist_ok=True)
+        order = list(range(len(targets)))
+        if all(hasattr(target, "getDF") for target in targets):
+            # longest first keeps the last workers from waiting on one large table
+            order.sort(key=lambda i: len(targets[i].getDF()), reverse=True)
+        plot = self.getWorkerPlot()
+        results = dict()
+        attempts = {i: 0 for i in order}
+
+        def submit(executor, i):
+            return executor.submit(_make_map, targets[i], plot, out_dir, self.loader, self.descriptors, self.recalculate, self.saveTables, kwargs)
+
+        def collect(futures, crashed):
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    results[i] = future.result()
+                except BrokenProcessPool:
+                    attempts[i] += 1
+                    if attempts[i] <= self.retries:
+                        crashed.append(i)
+                        continue
+                    results[i] = {
+                        "target": target_name(targets[i]),
+                        "status": "failed",
+                        "error": "The worker process terminated abruptly, i.e. it was killed for using too much memory.",
+                    }
+                except Exception as exp:
+                    results[i] = {"target": target_name(targets[i]), "status": "failed", "error": f"{type(exp).__name__}: {exp}"}
+                if callback is not None:
+                    callback(results[i])
+
+        crashed = []
+        with self._getExecutor(len(order)) as executor:
+            collect({submit(executor, i): i for i in order}, crashed)
+        while crashed:
+            # a crash breaks the whole pool, so the targets are retried with a pool of their own to find the one that crashed
+            pending, crashed = crashed, []
+            for start in range(0, len(pending), self.nJobs):
+                executors = {i: self._getExecutor(1) for i in pending[start:start + self.nJobs]}
+                try:
+                    collect({submit(executor, i): i for i, executor in executors.items()}, crashed)
+                finally:
+                    for executor in executors.values():
+                        executor.shutdown()
+        columns = ["target", "status", "path", "table", "error", "traceback", *(f"time_{name}" for name in STAGES), "time_total", "peak_memory", "worker"]
+        return pd.DataFrame([results[i] for i in range(len(targets))], columns=columns)
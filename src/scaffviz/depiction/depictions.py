@@ -0,0 +1,234 @@
+"""
+depictions
+
+Cache of molecule depictions shown on the hover cards of the interactive plots.
+
+Created by: Martin Sicho
+On: 18.10.26, 16:45
+"""
+import base64
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Literal
+
+
+def canonicalize(smiles : str):
+    """
+    Get the canonical SMILES of a molecule.
+
+    Args:
+        smiles: SMILES of the molecule
+
+    Returns:
+        the canonical SMILES or `None` if the SMILES could not be parsed
+    """
+
+    from rdkit import Chem
+
+    mol = Chem.MolFromSmiles(smiles)
+    return Chem.MolToSmiles(mol) if mol is not None else None
+
+
+def render_depiction(smiles : str, size : int = 200, fmt : Literal["svg", "png"] = "svg"):
+    """
+    Draw a molecule.
+
+    Args:
+        smiles: SMILES of the molecule
+        size: width and height of the image in pixels
+        fmt: image format, `"svg"` or `"png"`
+
+    Returns:
+        the image as a data URI or `None` if the SMILES could not be parsed
+    """
+
+    from rdkit import Chem
+    from rdkit.Chem.Draw import rdMolDraw2D
+
+    mol = Chem.MolFromSmiles(smiles)
+    if mol is None:
+        return None
+    if fmt == "svg":
+        d2d = rdMolDraw2D.MolDraw2DSVG(size, size)
+    elif fmt == "png":
+        d2d = rdMolDraw2D.MolDraw2DCairo(size, size)
+    else:
+        raise ValueError(f"Unsupported depiction format: {fmt}")
+    d2d.drawOptions().clearBackground = False
+    d2d.DrawMolecule(mol)
+    d2d.FinishDrawing()
+    data = d2d.GetDrawingText()
+    if fmt == "svg":
+        data = data.encode()
+        mime = "image/svg+xml"
+    else:
+        mime = "image/png"
+    return f"data:{mime};base64,{base64.b64encode(data).decode()}"
+
+
+def depiction_key(canonical_smiles : str, size : int, fmt : str):
+    """
+    Get the key of a depiction.
+
+    Args:
+        canonical_smiles: canonical SMILES of the molecule (see `canonicalize`)
+        size: width and height of the depiction in pixels
+        fmt: image format of the depiction
+
+    Returns:
+        the key as a hexadecimal digest of the SMILES and the rendering options
+    """
+
+    return hashlib.sha1(f"{canonical_smiles}|{fmt}|{size}".encode()).hexdigest()
+
+
+def _render_many(smiles : list[str], size : int, fmt : str, store_dir : str | None):
+    ret = []
+    for smi in smiles:
+        canonical = canonicalize(smi)
+        if canonical is None:
+            ret.append((smi, None, False))
+            continue
+        depiction = _load(store_dir, depiction_key(canonical, size, fmt), fmt)
+        rendered = depiction is None
+        if rendered:
+            depiction = render_depiction(canonical, size, fmt)
+            _store(store_dir, depiction_key(canonical, size, fmt), fmt, depiction)
+        ret.append((smi, depiction, rendered))
+    return ret
+
+
+def _load(store_dir : str | None, key : str, fmt : str):
+    if not store_dir:
+        return None
+    try:
+        with open(os.path.join(store_dir, f"{key}.{fmt}.uri")) as stored:
+            return stored.read()
+    except FileNotFoundError:
+        return None
+
+
+def _store(store_dir : str | None, key : str, fmt : str, depiction : str | None):
+    if not store_dir or depiction is None:
+        return
+    path = os.path.join(store_dir, f"{key}.{fmt}.uri")
+    if os.path.exists(path):
+        return
+    fd, tmp_path = tempfile.mkstemp(dir=store_dir, suffix=".tmp")
+    with os.fdopen(fd, "w") as tmp_file:
+        tmp_file.write(depiction)
+    os.replace(tmp_path, path)
+
+
+class DepictionCache:
+    """
+    Least recently used cache of molecule depictions.
+    Depictions are kept in memory by the SMILES they were requested with,
+    and can optionally be persisted in a directory on disk keyed by the canonical SMILES and the rendering options,
+    so that they survive restarts and can be shared between processes.
+    Use `prerender` to render the depictions of a whole table ahead of time with a process pool,
+    after which showing a hover card only costs a cache lookup.
+    """
+
+    def __init__(self, max_items : int | None = 10000, store_dir : str | None = None, size : int = 200, fmt : Literal["svg", "png"] = "svg"):
+        """
+        Initialize the cache.
+
+        Args:
+            max_items: maximum number of depictions kept in memory, `None` for no limit
+            store_dir: optional directory to store the rendered depictions in
+            size: width and height of the depictions in pixels
+            fmt: image format of the depictions, `"svg"` or `"png"`
+        """
+
+        self.maxItems = max_items
+        self.storeDir = os.path.abspath(store_dir) if store_dir else None
+        self.size = size
+        self.fmt = fmt
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if self.storeDir:
+            os.makedirs(self.storeDir, exist_ok=True)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._memory)
+
+    def __contains__(self, smiles : str):
+        return smiles in self._memory
+
+    def _remember(self, smiles : str, depiction : str | None):
+        with self._lock:
+            self._memory[smiles] = depiction
+            self._memory.move_to_end(smiles)
+            while self.maxItems is not None and len(self._memory) > self.maxItems:
+                self._memory.popitem(last=False)
+
+    def get(self, smiles : str):
+        """
+        Get the depiction of a molecule, render it if it is not cached yet.
+
+        Args:
+            smiles: SMILES of the molecule
+
+        Returns:
+            the depiction as a data URI or `None` if the SMILES could not be parsed
+        """
+
+        with self._lock:
+            if smiles in self._memory:
+                self._memory.move_to_end(smiles)
+                self.hits += 1
+                return self._memory[smiles]
+            self.misses += 1
+        _, depiction, _ = _render_many([smiles], self.size, self.fmt, self.storeDir)[0]
+        self._remember(smiles, depiction)
+        return depiction
+
+    def prerender(self, smiles : Iterable[str], n_jobs : int = 1, chunk_size : int = 1000):
+        """
+        Render the depictions of many molecules ahead of time.
+        Depictions already on disk are loaded instead of rendered again.
+
+        Args:
+            smiles: SMILES of the molecules, duplicates and missing values are skipped
+            n_jobs: number of processes to render with, `-1` uses all available cores
+            chunk_size: number of molecules rendered by one task
+
+        Returns:
+            the number of newly rendered depictions
+        """
+
+        todo = [smi for smi in dict.fromkeys(smiles) if isinstance(smi, str) and smi not in self._memory]
+        chunks = [todo[i:i + chunk_size] for i in range(0, len(todo), chunk_size)]
+        if n_jobs is None or n_jobs == 0:
+            n_jobs = 1
+        elif n_jobs < 0:
+            n_jobs = os.cpu_count() or 1
+        if n_jobs == 1 or len(chunks) <= 1:
+            return self._collect(_render_many(chunk, self.size, self.fmt, self.storeDir) for chunk in chunks)
+        with ProcessPoolExecutor(max_workers=min(n_jobs, len(chunks))) as executor:
+            n_chunks = len(chunks)
+            return self._collect(executor.map(_render_many, chunks, [self.size] * n_chunks, [self.fmt] * n_chunks, [self.storeDir] * n_chunks))
+
+    def _collect(self, results):
+        rendered = 0
+        for chunk in results:
+            for smi, depiction, is_new in chunk:
+                rendered += int(is_new)
+                self._remember(smi, depiction)
+        return rendered
@@ -0,0 +1,311 @@
+"""
+export
+
+Export of molecule maps as static bundles that can be served by any static file server, without a running Dash app.
+
+Created by: Martin Sicho
+On: 18.10.26, 22:10
+"""
+import html
+import json
+import os
+import shutil
+
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+
+from scaffviz.depiction.app import ROW_COL
+from scaffviz.depiction.depictions import DepictionCache
+
+if TYPE_CHECKING:
+    import plotly.graph_objects as go
+
+TILE_COL = "_scaffviz_tile"
+"""Name of the column with the tile of each point, passed to the exported figure as the second `custom_data` field."""
+
+_PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<script src="plotly.min.js"></script>
+<style>
+body {{ margin: 0; font-family: {fontfamily}; }}
+#card {{ position: absolute; display: none; pointer-events: none; z-index: 10; width: {width}px; padding: 6px; white-space: normal;
+    font-size: {fontsize}px; background: rgba(255, 255, 255, {alpha}); border: 1px solid #ccc; border-radius: 4px; }}
+#card img {{ width: 100%; background: rgba(255, 255, 255, {mol_alpha}); }}
+#card h2 {{ margin: 4px 0; font-size: {title_size}px; }}
+#card h4 {{ margin: 4px 0; white-space: pre-wrap; }}
+#card p {{ margin: 2px 0; }}
+</style>
+</head>
+<body>
+<div id="controls"></div>
+<div id="graph"></div>
+<div id="card"></div>
+<script>
+(async function () {{
+    const meta = await (await fetch("meta.json")).json();
+    const figure = await (await fetch("figure.json")).json();
+    const graph = document.getElementById("graph");
+    const card = document.getElementById("card");
+    await Plotly.newPlot(graph, figure.data, figure.layout, {{responsive: true}});
+
+    // depictions and card data are stored in tiles of the map and only fetched when needed
+    const tiles = new Map();
+    function loadTile(id) {{
+        if (!tiles.has(id)) {{
+            tiles.set(id, fetch(`tiles/${{id}}.json`).then((r) => r.json()).then((tile) => {{
+                tile.positions = new Map(tile.rows.map((row, i) => [row, i]));
+                return tile;
+            }}));
+        }}
+        return tiles.get(id);
+    }}
+
+    let chosen = meta.smiles_cols.slice(0, 1);
+    if (meta.smiles_cols.length > 1) {{
+        const menu = document.createElement("select");
+        menu.multiple = true;
+        for (const col of meta.smiles_cols) {{
+            const option = document.createElement("option");
+            option.value = col;
+            option.text = col;
+            option.selected = chosen.includes(col);
+            menu.appendChild(option);
+        }}
+        menu.onchange = () => {{ chosen = Array.from(menu.selectedOptions, (o) => o.value); }};
+        document.getElementById("controls").appendChild(menu);
+    }}
+
+    function element(tag, content, color) {{
+        const el = document.createElement(tag);
+        el.textContent = content;
+        if (color) el.style.color = color;
+        return el;
+    }}
+
+    function wrap(text, width) {{
+        const lines = [];
+        for (let i = 0; i < text.length; i += width) lines.push(text.slice(i, i + width));
+        return lines.join("\\n");
+    }}
+
+    let hovered = null;
+    graph.on("plotly_hover", async (event) => {{
+        const pt = event.points[0];
+        if (!pt.customdata) return;
+        const [row, tileId] = pt.customdata;
+        hovered = row;
+        const tile = await loadTile(tileId);
+        if (hovered !== row) return;
+        const pos = tile.positions.get(row);
+        const color = typeof pt.data.marker.color === "string" ? pt.data.marker.color : "black";
+        card.replaceChildren();
+        for (const col of chosen) {{
+            if (meta.smiles_cols.length > 1) card.appendChild(element("h2", col, color));
+            const image = tile.images[tile.smiles[col][pos]];
+            if (image) {{
+                const img = document.createElement("img");
+                img.src = image;
+                card.appendChild(img);
+            }}
+        }}
+        if (meta.title_col !== null) {{
+            card.appendChild(element("h4", wrap(String(tile.columns[meta.title_col][pos]), meta.wraplen), color));
+        }}
+        card.appendChild(element("p", `${{meta.x_title}} : ${{pt.x}}`));
+        card.appendChild(element("p", `${{meta.y_title}} : ${{pt.y}}`));
+        for (const col of meta.caption_cols) {{
+            card.appendChild(element("p", `${{col}} : ${{tile.columns[col][pos]}}`));
+        }}
+        card.style.left = `${{event.event.pageX + 15}}px`;
+        card.style.top = `${{event.event.pageY + 15}}px`;
+        card.style.display = "block";
+    }});
+    graph.on("plotly_unhover", () => {{
+        hovered = null;
+        card.style.display = "none";
+    }});
+
+    // fetch the tiles in the viewport ahead of hovering once the user zooms in far enough
+    graph.on("plotly_relayout", () => {{
+        const [x0, x1] = graph.layout.xaxis.range;
+        const [y0, y1] = graph.layout.yaxis.range;
+        const visible = meta.tiles.filter((t) => t.x1 >= Math.min(x0, x1) && t.x0 <= Math.max(x0, x1) && t.y1 >= Math.min(y0, y1) && t.y0 <= Math.max(y0, y1));
+        if (visible.length <= meta.prefetch) visible.forEach((t) => loadTile(t.id));
+    }});
+}})();
+</script>
+</body>
+</html>
+"""
+
+
+def assign_tiles(x, y, max_tile_points : int = 2000):
+    """
+    Split the points of a map into tiles by recursively halving the bounding box of the points along its longer side,
+    until every tile has at most `max_tile_points` points. Dense regions get smaller tiles than sparse ones.
+
+    Args:
+        x: x coordinates of the points
+        y: y coordinates of the points
+        max_tile_points: maximum number of points in a tile
+
+    Returns:
+        a tuple of the tile number of each point and a `list` of tiles with their number and bounding box
+    """
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    labels = np.zeros(len(x), dtype=np.int64)
+    tiles = []
+    stack = [np.arange(len(x))]
+    while stack:
+        rows = stack.pop()
+        if len(rows) == 0:
+            continue
+        xs, ys = x[rows], y[rows]
+        if len(rows) <= max_tile_points or (xs.min() == xs.max() and ys.min() == ys.max()):
+            labels[rows] = len(tiles)
+            tiles.append({"id": len(tiles), "x0": float(xs.min()), "x1": float(xs.max()), "y0": float(ys.min()), "y1": float(ys.max())})
+            continue
+        values = xs if xs.max() - xs.min() >= ys.max() - ys.min() else ys
+        order = np.argsort(values, kind="stable")
+        half = len(rows) // 2
+        stack.append(rows[order[half:]])
+        stack.append(rows[order[:half]])
+    return labels, tiles
+
+
+def _to_json_values(values : pd.Series):
+    # NaN is not valid JSON and numpy scalars are not serializable
+    return [None if pd.isna(value) else (value.item() if isinstance(value, np.generic) else value) for value in values.astype(object)]
+
+
+def export_bundle(
+        path : str,
+        fig : "go.Figure",
+        df : pd.DataFrame,
+        x : str,
+        y : str,
+        smiles_cols : list[str],
+        title_col : str | None = None,
+        caption_cols : list[str] | None = None,
+        depictions : DepictionCache | None = None,
+        max_tile_points : int = 2000,
+        prefetch : int = 8,
+        n_jobs : int = 1,
+        title : str = "scaffviz",
+        alpha : float = 0.75,
+        mol_alpha : float = 0.7,
+        width : int = 150,
+        wraplen : int = 20,
+        fontfamily : str = "Arial",
+        fontsize : int = 12,
+):
+    """
+    Write a molecule map as a static bundle: an HTML page with the plot, the figure with the coordinates as binary arrays,
+    and the card data and pre-rendered depictions split into tiles of the map that the page only fetches when the user hovers over them or zooms in on them.
+    The bundle does not need Python to be viewed, it can be served by any static file server (the browser does not load it from the local file system).
+    If `pyarrow` is installed, the plotted data is also saved as `points.parquet` for further analysis.
+
+    Args:
+        path: directory to write the bundle to, it is created if it does not exist and the files of a previous bundle are replaced
+        fig: the scatter plot, its traces have to pass the `ROW_COL` and `TILE_COL` columns of `df` as `custom_data`
+        df: the plotted data, with the `TILE_COL` column from `assign_tiles`
+        x: column with the x coordinates
+        y: column with the y coordinates
+        smiles_cols: columns with the SMILES to depict on the cards
+        title_col: column to show as the card title
+        caption_cols: columns to show on the cards
+        depictions: `DepictionCache` to get the depictions from, if it holds fewer depictions than the bundle needs, they are rendered into an unbounded cache that shares its store directory
+        max_tile_points: maximum number of points per tile, only used if `df` has no tiles yet
+        prefetch: tiles in the viewport are fetched ahead of hovering when the viewport has at most this many tiles
+        n_jobs: number of processes used to render the depictions
+        title: title of the page
+        alpha: opacity of the cards
+        mol_alpha: opacity of the background of the depictions
+        width: width of the cards in pixels
+        wraplen: the card title is wrapped to lines of this length
+        fontfamily: font family of the cards
+        fontsize: font size of the cards
+
+    Returns:
+        the path to the HTML page of the bundle
+    """
+
+    import plotly.graph_objects as go
+    from plotly.offline import get_plotlyjs
+
+    caption_cols = [col for col in (caption_cols or []) if col != title_col]
+    if ROW_COL not in df.columns:
+        df = df.assign(**{ROW_COL: np.arange(len(df))})
+    if TILE_COL not in df.columns:
+        labels, _ = assign_tiles(df[x], df[y], max_tile_points)
+        df = df.assign(**{TILE_COL: labels})
+    tile_ids = df[TILE_COL].values
+
+    os.makedirs(path, exist_ok=True)
+    tiles_dir = os.path.join(path, "tiles")
+    if os.path.exists(tiles_dir):
+        shutil.rmtree(tiles_dir)
+    os.makedirs(tiles_dir)
+
+    fig = go.Figure(fig)
+    fig.update_traces(hoverinfo="none", hovertemplate=None)
+    with open(os.path.join(path, "figure.json"), "w") as fig_file:
+        fig_file.write(fig.to_json())
+    with open(os.path.join(path, "plotly.min.js"), "w") as js_file:
+        js_file.write(get_plotlyjs())
+
+    smiles = pd.unique(np.concatenate([df[col].dropna().values for col in smiles_cols]))
+    if depictions is None:
+        depictions = DepictionCache(max_items=None)
+    elif depictions.maxItems is not None and depictions.maxItems < len(smiles):
+        # the tiles need all depictions at once, a bounded cache would evict them before they are written
+        depictions = DepictionCache(max_items=None, store_dir=depictions.storeDir, size=depictions.size, fmt=depictions.fmt)
+    depictions.prerender(smiles, n_jobs=n_jobs)
+    tiles = []
+    data_cols = [col for col in dict.fromkeys(([title_col] if title_col else []) + caption_cols)]
+    for tile_id in np.unique(tile_ids):
+        frame = df[tile_ids == tile_id]
+        tile_smiles = {col: _to_json_values(frame[col]) for col in smiles_cols}
+        images = {smi: depictions.get(smi) for values in tile_smiles.values() for smi in values if smi is not None}
+        tile = {
+            "rows": frame[ROW_COL].astype(int).tolist(),
+            "smiles": tile_smiles,
+            "images": images,
+            "columns": {col: _to_json_values(frame[col]) for col in data_cols},
+        }
+        with open(os.path.join(tiles_dir, f"{tile_id}.json"), "w") as tile_file:
+            json.dump(tile, tile_file, default=str)
+        xs, ys = frame[x], frame[y]
+        tiles.append({"id": int(tile_id), "x0": float(xs.min()), "x1": float(xs.max()), "y0": float(ys.min()), "y1": float(ys.max())})
+
+    meta = {
+        "smiles_cols": list(smiles_cols),
+        "title_col": title_col,
+        "caption_cols": caption_cols,
+        "x_title": fig.layout.xaxis.title.text,
+        "y_title": fig.layout.yaxis.title.text,
+        "wraplen": wraplen,
+        "prefetch": prefetch,
+        "tiles": tiles,
+    }
+    with open(os.path.join(path, "meta.json"), "w") as meta_file:
+        json.dump(meta, meta_file)
+    try:
+        df.drop(columns=[TILE_COL]).to_parquet(os.path.join(path, "points.parquet"))
+    except ImportError:
+        pass
+
+    page = os.path.join(path, "index.html")
+    with open(page, "w") as page_file:
+        page_file.write(_PAGE.format(
+            title=html.escape(title), fontfamily=fontfamily, fontsize=fontsize, title_size=fontsize + 2,
+            width=width, alpha=alpha, mol_alpha=mol_alpha
+        ))
+    return page
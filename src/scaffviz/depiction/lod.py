@@ -0,0 +1,146 @@
+"""
+lod
+
+Level of detail for large scatter plots: density-aware subsampling of the points in the current viewport and server-side aggregation of the rest.
+
+Created by: Martin Sicho
+On: 18.10.26, 15:20
+"""
+import numpy as np
+
+from scaffviz.data.spatial import SpatialIndex
+
+
+def density_subsample(x, y, max_points, grid_size=128, random_state=None):
+    """
+    Select a subsample of points that preserves the sparse regions of the plot.
+    The plot area is divided into a grid and every cell contributes at most the same number of points,
+    which is chosen as large as possible to keep at most `max_points` points in total.
+    Cells with few points therefore keep all of them and only the dense cells are thinned out.
+
+    Args:
+        x: x coordinates of the points
+        y: y coordinates of the points
+        max_points: maximum number of points to select
+        grid_size: number of grid cells along each axis
+        random_state: seed or `numpy.random.Generator` used to pick the points within the cells
+
+    Returns:
+        sorted positional indices of the selected points
+    """
+
+    x = np.asarray(x)
+    y = np.asarray(y)
+    n_points = len(x)
+    if n_points <= max_points:
+        return np.arange(n_points)
+    cells = _grid_cells(x, y, grid_size)
+    counts = np.bincount(cells, minlength=grid_size * grid_size)
+    # largest per-cell cap that still fits into the budget
+    low, high = 0, int(counts.max())
+    while low < high:
+        cap = (low + high + 1) // 2
+        if np.minimum(counts, cap).sum() <= max_points:
+            low = cap
+        else:
+            high = cap - 1
+    cap = max(low, 1)
+    # random rank of each point within its cell, points with a rank below the cap are kept
+    rng = np.random.default_rng(random_state)
+    order = np.lexsort((rng.random(n_points), cells))
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    ranks = np.empty(n_points, dtype=np.int64)
+    ranks[order] = np.arange(n_points) - starts[cells[order]]
+    return np.flatnonzero(ranks < cap)
+
+
+def _grid_cells(x, y, grid_size, x_range=None, y_range=None):
+    x_range = x_range if x_range is not None else (np.nanmin(x), np.nanmax(x))
+    y_range = y_range if y_range is not None else (np.nanmin(y), np.nanmax(y))
+    x_span = (x_range[1] - x_range[0]) or 1.0
+    y_span = (y_range[1] - y_range[0]) or 1.0
+    col = np.clip(((x - x_range[0]) / x_span * grid_size).astype(np.int64), 0, grid_size - 1)
+    row = np.clip(((y - y_range[0]) / y_span * grid_size).astype(np.int64), 0, grid_size - 1)
+    return row * grid_size + col
+
+
+class LevelOfDetail:
+    """
+    Selects the points to draw for a given viewport of a large scatter plot.
+    When zoomed out, a density-aware subsample of all points is shown.
+    The more the user zooms in, the fewer points fall into the viewport, until all of them are drawn at full resolution.
+    """
+
+    def __init__(self, x, y, max_points=20000, grid_size=128, random_state=42, index : SpatialIndex | None = None):
+        """
+        Initialize the level of detail.
+
+        Args:
+            x: x coordinates of all points
+            y: y coordinates of all points
+            max_points: maximum number of points drawn at once
+            grid_size: number of grid cells along each axis used to subsample and aggregate the points
+            random_state: seed of the subsampling, fixed by default so that the same viewport always shows the same points
+            index: `SpatialIndex` of the points used to find the points in a viewport, it is built from `x` and `y` if not given
+        """
+
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.maxPoints = max_points
+        self.gridSize = grid_size
+        self.randomState = random_state
+        self.index = index if index is not None else SpatialIndex(self.x, self.y)
+
+    def __len__(self):
+        return len(self.x)
+
+    def getIndices(self, x_range=None, y_range=None):
+        """
+        Get the points to draw in a viewport.
+
+        Args:
+            x_range: `(min, max)` of the viewport on the x-axis, `None` for the full extent
+            y_range: `(min, max)` of the viewport on the y-axis, `None` for the full extent
+
+        Returns:
+            positional indices of the points to draw
+        """
+
+        indices = self.index.rect(x_range, y_range)
+        if len(indices) <= self.maxPoints:
+            return indices
+        selected = density_subsample(
+            self.x[indices],
+            self.y[indices],
+            self.maxPoints,
+            grid_size=self.gridSize,
+            random_state=self.randomState
+        )
+        return indices[selected]
+
+    def getDensity(self, x_range=None, y_range=None, bins=None):
+        """
+        Aggregate all points in a viewport into a 2D histogram.
+        It can be drawn underneath the subsampled points to show where the points that are not drawn are.
+
+        Args:
+            x_range: `(min, max)` of the viewport on the x-axis, `None` for the full extent
+            y_range: `(min, max)` of the viewport on the y-axis, `None` for the full extent
+            bins: number of bins along each axis, the grid size by default
+
+        Returns:
+            a tuple of `(counts, x_centers, y_centers)`, `counts` has the y bins in rows and the x bins in columns
+        """
+
+        indices = self.index.rect(x_range, y_range)
+        bins = bins or self.gridSize
+        x = self.x[indices]
+        y = self.y[indices]
+        ranges = [
+            x_range if x_range is not None else (x.min() if len(x) else 0, x.max() if len(x) else 1),
+            y_range if y_range is not None else (y.min() if len(y) else 0, y.max() if len(y) else 1),
+        ]
+        counts, x_edges, y_edges = np.histogram2d(x, y, bins=bins, range=[sorted(ranges[0]), sorted(ranges[1])])
+        x_centers = (x_edges[:-1] + x_edges[1:]) / 2
+        y_centers = (y_edges[:-1] + y_edges[1:]) / 2
+        return counts.T, x_centers, y_centers
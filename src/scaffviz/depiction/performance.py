@@ -0,0 +1,309 @@
+"""
+performance
+
+Interactive plots of the performance of QSPR models on the chemical space of their data sets.
+
+Created by: Martin Sicho
+On: 18.10.26, 23:55
+"""
+from typing import List, Literal
+
+import numpy as np
+import pandas as pd
+from qsprpred import ModelTasks
+from qsprpred.data import MoleculeTable, QSPRDataset
+from qsprpred.models import QSPRModel
+from qsprpred.plotting.base_plot import ModelPlot
+
+from scaffviz.clustering.manifold import Manifold
+from scaffviz.data.predictions import concat_categorical, load_predictions, to_labels
+from scaffviz.data.registry import EmbeddingRegistry, get_registry
+from scaffviz.depiction.plot import Plot
+from scaffviz.depiction.server import AppServer, get_server
+
+
+class ModelPerformancePlot(ModelPlot):
+
+    def __init__(self, manifold : Manifold, models: List[QSPRModel], datasets : List[QSPRDataset], ports: int | List[int] = 9292, card_props = None, plot_type : Literal["errors", "splits", "predictions", "labels"] | List[str] = "errors", async_execution=True, server : AppServer | None = None, predictions_cache : str | None = None, registry : EmbeddingRegistry | None = None):
+        """
+        Initialize the performance plot of the given models.
+
+        Args:
+            manifold: the `Manifold` to embed the data sets with
+            models: the models to plot
+            datasets: the data sets the models were fitted on, one for each model
+            ports: port of the server the plots are served on, plots on the same port share one server,
+                or a list with one port for each model to serve the plot of each model on its own server as in the previous versions
+            card_props: additional properties of the data sets to show on the molecule cards
+            plot_type: type of the plot, one of `"errors"`, `"splits"`, `"predictions"` and `"labels"`, or a list of them to show them as switchable color layers in one plot per model
+            async_execution: if `True`, `make` returns once the plots are served, otherwise it blocks until the server is shut down
+            server: the `AppServer` to mount the plots on instead of the shared servers on the ports from `ports` (see `get_server`)
+            registry: the `EmbeddingRegistry` to get the embeddings of the data sets from, by default the registry shared by all plots (see `get_registry`)
+            predictions_cache: optional directory to store the prediction files of the models in a columnar format, so that only the needed columns are read from them next time (see `load_predictions`)
+        """
+        super().__init__(models)
+        # some checks
+        if len(datasets) != len(models):
+            raise ValueError("Number of models and datasets does not match.")
+        if not isinstance(ports, int):
+            if len(ports) != len(set(ports)):
+                raise ValueError("Ports must be unique.")
+            if len(ports) != len(models):
+                raise ValueError("Number of models and ports does not match.")
+            if server is not None:
+                raise ValueError("The plots of all models are mounted on the given server, use a single port or no server.")
+        # assign attributes
+        self.manifold = manifold
+        self.plotType = plot_type
+        self.plotTypes = [plot_type] if isinstance(plot_type, str) else list(plot_type)
+        self.port = server.port if server is not None else ports if isinstance(ports, int) else None
+        # ports of the servers of the models if each model has its own
+        self.ports = dict(zip(models, ports)) if not isinstance(ports, int) else None
+        self.server = server
+        self.runningApps = dict()
+        self.perfTables = dict()
+        self.predictionsCache = predictions_cache
+        self.registry = registry if registry is not None else get_registry()
+        self.asyncExecution = async_execution
+        self.cardProps = card_props if card_props else []
+        # initialize the mapping of models to their respective data sets
+        self.datasets = dict()
+        for model, dataset in zip(models, datasets):
+            self.datasets[model] = dataset
+
+    def getSupportedTasks(self):
+        """Return a list of tasks supported by this plotter."""
+        return [
+            ModelTasks.SINGLECLASS, 
+            ModelTasks.MULTICLASS, 
+            ModelTasks.REGRESSION,
+        ]
+
+    def getPerfCols(self, model, target_prop):
+        """
+        Get the relevant performance columns for a given model and target property.
+
+        Args:
+            model: `QSPRModel`
+            target_prop: `TargetProperty`
+
+        Returns:
+            col_label: column name for the original label/target
+            col_pred: column name for the prediction
+            cols_probas: column names for the class probabilities if the target property is a classification task, empty list otherwise
+        """
+
+        col_label = f"{target_prop.name}_Label"
+        if model.task.isClassification():
+            col_pred = f"{target_prop.name}_Prediction"
+            cols_probas = []
+            for i in range(target_prop.nClasses):
+                cols_probas.append(f"{target_prop.name}_ProbabilityClass_{i}")
+        elif model.task.isRegression():
+            col_pred = f"{target_prop.name}_Prediction"
+            cols_probas = []
+        else:
+            raise NotImplementedError(f"Unsupported task: {model.task}")
+
+        return col_label, col_pred, cols_probas
+
+
+    def getPerfData(self, path, model, target_prop, extra_cols=tuple()):
+        """
+        Load the predictions of a model for a target property. Only the needed columns are read
+        and the parsed files are reused until they change (see `load_predictions`).
+
+        Args:
+            path: path to the file with the predictions
+            model: `QSPRModel`
+            target_prop: `TargetProperty`
+            extra_cols: names of other columns to read from the file
+
+        Returns:
+            the data frame with the predictions and the names of the label, prediction, error and class probability columns
+        """
+
+        col_label, col_pred, cols_probas = self.getPerfCols(model, target_prop)
+        col_err = f"{target_prop}_Error"
+        df = load_predictions(path, columns=[col_label, col_pred, *cols_probas, *extra_cols], columnar_dir=self.predictionsCache)
+        # the loaded frame is shared by all calls, new columns are only added to a shallow copy
+        df = df.copy(deep=False)
+        df[col_err] = df[col_label] - df[col_pred]
+        if model.task.isClassification():
+            # convert True/False to string labels
+            df[col_label] = to_labels(df[col_label], "Class_")
+            df[col_pred] = to_labels(df[col_pred], "Class_")
+        return df, col_label, col_pred, col_err, cols_probas
+
+    def getCVData(self, model, target_prop):
+        cv_path = self.cvPaths[model]
+        df, col_label, col_pred, col_err, cols_probas = self.getPerfData(cv_path, model, target_prop, extra_cols=("Fold",))
+        df["TestSet"] = to_labels(df["Fold"], "Fold_", offset=1)
+        del df["Fold"]
+        return df, col_label, col_pred, col_err, cols_probas
+
+    def getIndData(self, model, target_prop):
+        ind_path = self.indPaths[model]
+        df, col_label, col_pred, col_err, cols_probas = self.getPerfData(ind_path, model, target_prop)
+        df["TestSet"] = pd.Categorical.from_codes(np.zeros(len(df), dtype=np.int64), categories=["Independent"])
+        return df, col_label, col_pred, col_err, cols_probas
+
+    def getServer(self, model=None):
+        """
+        Get the running server the plots are served on, start it if needed.
+
+        Args:
+            model: the `QSPRModel` to get the server of if each model is served on its own port
+
+        Returns:
+            the `AppServer`
+        """
+
+        if self.ports is not None:
+            if model is None:
+                raise ValueError("Each model is served on its own port, the model has to be specified.")
+            return get_server(self.ports[model])
+        if self.server is None:
+            self.server = get_server(self.port)
+        elif not self.server.isRunning():
+            self.server.start()
+        return self.server
+
+    def getKey(self, model):
+        """
+        Get the key of the plot of a model in the information returned by `make`.
+
+        Args:
+            model: the `QSPRModel`
+
+        Returns:
+            the port of the model if each model has its own port, the route of its plot otherwise
+        """
+
+        return self.ports[model] if self.ports is not None else self.getRoute(model)
+
+    def getRoute(self, model):
+        """
+        Get the URL route of the plot of a model.
+
+        Args:
+            model: the `QSPRModel`
+
+        Returns:
+            the route
+        """
+
+        return AppServer.normalizeRoute(f"{model.name}/{'-'.join(self.plotTypes)}")
+
+    def getPerfTable(self, model):
+        """
+        Get the table with the data set and the cross-validation and independent test set predictions of a model.
+        It is prepared once and shared by all plot types made for the model.
+
+        Args:
+            model: the `QSPRModel`
+
+        Returns:
+            a tuple of the `MoleculeTable` and a `dict` with the names of its columns for each plot type and the class probabilities (`"probabilities"`)
+        """
+
+        if model in self.perfTables:
+            return self.perfTables[model]
+        ds = self.datasets[model]
+        df_cv, col_label, col_pred, col_err, cols_probas = self.getCVData(model, model.targetProperties[0])
+        df_ind, col_label, col_pred, col_err, cols_probas = self.getIndData(model, model.targetProperties[0])
+        df_all = concat_categorical([df_cv, df_ind])
+
+        # create a molecule table with the required data and the embedding of the data set shared with other plots
+        coords = self.registry.getEmbedding(ds, self.manifold)
+        ds_subset = ds.getDF()[[ds.smilesCol] + self.cardProps + ds.indexCols].join(coords)
+        df_all = ds_subset.merge(df_all, left_index=True, right_index=True)
+        mt = MoleculeTable(f"{model.name}_perfplot", df=df_all, smiles_col=ds.smilesCol, index_cols=ds.indexCols)
+        cols = {
+            "errors" : col_err,
+            "splits" : "TestSet",
+            "predictions" : col_pred,
+            "labels" : col_label,
+            "probabilities" : cols_probas,
+        }
+        self.perfTables[model] = (mt, cols)
+        return self.perfTables[model]
+
+    def make(self, show=True, save=False, rebuild=False):
+        """
+        Make the plots and serve them on one server, each under its own URL route, or each on the server on its own port if a list of ports was given.
+        Plots that are already served are reused unless `rebuild` is `True`.
+
+        Args:
+            show: display the plots inline if running in a notebook
+            save: not used
+            rebuild: rebuild the plots that are already served
+
+        Returns:
+            `dict` with information about the served plots by their route, or by their port if each model has its own port (see `getKey`)
+        """
+
+        for model in self.datasets.keys():
+            server = self.getServer(model)
+            route = self.getRoute(model)
+            key = self.getKey(model)
+            if not rebuild and key in self.runningApps and server.getApp(route) is self.runningApps[key]["app"]:
+                continue
+            mt, cols = self.getPerfTable(model)
+            plot = Plot(manifold=self.manifold)
+            url = plot.plot(
+                mt,
+                title_data=mt.indexCols[0],
+                card_data=mt.indexCols + ["TestSet", cols["labels"], cols["predictions"], cols["errors"]] + cols["probabilities"] + self.cardProps,
+                color_by=[cols[plot_type] for plot_type in self.plotTypes] if len(self.plotTypes) > 1 else cols[self.plotTypes[0]],
+                interactive=True,
+                recalculate=False,
+                server=server,
+                route=route,
+            )
+            self.runningApps[key] = {
+                "model": model,
+                "plot_type": self.plotType,
+                "table": mt,
+                "plot": plot,
+                "app": plot.getOpenApps()[route],
+                "url": url,
+                "route": route,
+                "port": server.port,
+                "server": server,
+            }
+
+        if show:
+            self.show()
+        if not self.asyncExecution:
+            for server in {id(info["server"]): info["server"] for info in self.runningApps.values()}.values():
+                server.wait()
+        return self.runningApps
+
+    def show(self, height=800):
+        """
+        Display the served plots inline if running in a notebook.
+
+        Args:
+            height: height of the displayed plots in pixels
+        """
+
+        try:
+            from IPython import get_ipython
+            from IPython.display import IFrame, display
+        except ImportError:
+            return
+        if get_ipython() is None:
+            return
+        for info in self.runningApps.values():
+            display(IFrame(info["url"], width="100%", height=height))
+
+    def close(self):
+        """
+        Remove the plots from their servers. The servers keep running for other plots, use `AppServer.shutdown` to stop them.
+        """
+
+        for info in self.runningApps.values():
+            if info["server"].getApp(info["route"]) is info["app"]:
+                info["server"].removeApp(info["route"])
+        self.runningApps = dict()
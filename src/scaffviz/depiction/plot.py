@@ -4,44 +4,129 @@ plot
 Created by: Martin Sicho
 On: 05.10.22, 16:37
 """
-import threading
-import time
-
-import molplotly
+import numpy as np
 import pandas as pd
-import plotly.express as px
-from qsprpred import ModelTasks
-from qsprpred.data import MoleculeTable, QSPRDataset
-from qsprpred.data.descriptors.sets import DataFrameDescriptorSet
-from qsprpred.models import QSPRModel
-from qsprpred.plotting.base_plot import ModelPlot
 
 from scaffviz.clustering.manifold import Manifold
-from typing import List, Literal
+from typing import TYPE_CHECKING, List, Literal
+
+from scaffviz.data.cache import EmbeddingCache
+from scaffviz.data.scaffolds import OTHER_GROUP, ScaffoldIndex, get_scaffold_index
+from scaffviz.depiction.app import ROW_COL, create_app
+from scaffviz.depiction.depictions import DepictionCache
+from scaffviz.depiction.export import TILE_COL, assign_tiles, export_bundle
+from scaffviz.depiction.lod import LevelOfDetail
+from scaffviz.depiction.server import AppServer
 
-from scaffviz.data.manifold_table import ManifoldTable
+if TYPE_CHECKING:
+    # qsprpred.data imports sklearn, umap and numba, so the tables are only imported when a plot is made
+    from qsprpred.data import MoleculeTable
+    from scaffviz.data.manifold_table import ManifoldTable
 
 
 class Plot:
 
-    def __init__(self, manifold: Manifold | None = None, save_manifold: bool = True):
+    def __init__(self, manifold: Manifold | None = None, save_manifold: bool = False, cache: EmbeddingCache | None = None, descriptor_format: Literal["dense", "sparse", "packed", "auto"] = "dense", webgl_threshold: int = 20000, max_points: int | None = None, show_density: bool = True, depictions: DepictionCache | None = None, prerender: bool | int = False, scaffolds: List[str] | None = None, n_jobs: int = 1):
         """
         Initialize a plotting object for the given `Manifold`.
 
         Args:
             manifold: the `Manifold` class to use to project molecules to 2D
-            save_manifold: if `True` the calculated 2D coordinates are saved to the `MoleculeTable` object
+            save_manifold: if `True` the calculated 2D coordinates are added to the plotted `MoleculeTable`, if it is a `ManifoldTable`, the fitted manifold is attached to it as well and saved with the table, the plotted table is not modified by default
+            cache: optional `EmbeddingCache` to reuse embeddings calculated with the same descriptors and manifold settings
+            descriptor_format: format of the descriptors passed to the manifold, use `"sparse"`, `"packed"` or `"auto"` to save memory with binary fingerprints (see `ManifoldTable.getManifoldInput`)
+            webgl_threshold: plots with more points than this are rendered with WebGL instead of SVG, unless `render_mode` is passed to `plot`
+            max_points: maximum number of points drawn at once, larger tables are drawn with a density-aware subsample that is refined to full resolution as the user zooms in (see `scaffviz.depiction.lod`), `None` to always draw all points
+            show_density: if only a subsample of points is drawn, show the density of all points underneath it
+            depictions: `DepictionCache` with the molecule depictions shown on the hover cards, share one between plots to reuse the depictions
+            prerender: render the depictions of all molecules before the interactive plot is started, `True` renders with all available cores, an integer sets the number of processes
+            scaffolds: scaffold types to calculate for tables without scaffolds (see `scaffviz.data.scaffolds.SCAFFOLDS`), tables without scaffolds are not colored by scaffold groups if `None`
+            n_jobs: number of processes used to calculate the scaffolds
         """
 
         self.symbols = ['circle', 'square', 'diamond', 'cross', 'x',  'pentagon', 'hexagram', 'star', 'diamond', 'hourglass', 'bowtie']
         self.open_apps = dict()
         self.save_manifold = save_manifold
         self.manifold = manifold
+        self.cache = cache
+        self.descriptorFormat = descriptor_format
+        self.webglThreshold = webgl_threshold
+        self.maxPoints = max_points
+        self.showDensity = show_density
+        self.depictions = depictions if depictions is not None else DepictionCache()
+        self.prerender = prerender
+        self.scaffolds = list(scaffolds) if scaffolds else None
+        self.nJobs = n_jobs
 
     def getOpenApps(self):
         return self.open_apps
 
-    def plot(self, table : MoleculeTable, x : str = None, y : str = None, color_by : str = None, card_data = tuple(), title_data : str | None = None, port=9292, recalculate=False, mols_per_scaffold_group : int = 10, interactive = True, viewport_height = "100%",  **kwargs):
+    def saveManifold(self, source : "MoleculeTable", table : "ManifoldTable", manifold_cols):
+        """
+        Copy the manifold coordinates calculated in `table` to the `source` table. If `source` is a `ManifoldTable`, the fitted manifold is attached to it as well.
+
+        Args:
+            source: the table passed to `plot`
+            table: the `ManifoldTable` with the calculated coordinates
+            manifold_cols: names of the columns with the coordinates
+        """
+
+        from scaffviz.data.manifold_table import ManifoldTable
+
+        for col in manifold_cols:
+            source.addProperty(col, table.getProperty(col).values)
+        if isinstance(source, ManifoldTable):
+            source.dropSpatialIndices(manifold_cols)
+        if isinstance(source, ManifoldTable) and str(self.manifold) in table.manifolds:
+            source.setManifold(table.manifolds[str(self.manifold)])
+
+    def getScaffoldIndex(self, table : "MoleculeTable") -> ScaffoldIndex:
+        """
+        Get the scaffold index of a table and index the molecules added since the last call.
+        Scaffolds already stored in the table are used as they are, otherwise the scaffold types of this plot are calculated.
+
+        Args:
+            table: the plotted table
+
+        Returns:
+            the up-to-date `ScaffoldIndex` shared by all plots of the table
+        """
+
+        df = table.getDF()
+        if table.hasScaffolds:
+            names = table.getScaffoldNames()
+            index = get_scaffold_index(table, names)
+            index.update(df[table.smilesCol], df[names])
+        else:
+            index = get_scaffold_index(table, self.scaffolds, n_jobs=self.nJobs)
+            index.update(df[table.smilesCol])
+        return index
+
+    @staticmethod
+    def getPlotFrame(table : "MoleculeTable", columns, plot_kwargs : dict):
+        """
+        Project the columns needed to draw the figure from the table.
+        Only these columns are passed on to the figure and the app instead of the whole table with its molecules and descriptors.
+
+        Args:
+            table: the plotted table
+            columns: names of the columns to include, `None` values and duplicates are skipped
+            plot_kwargs: arguments passed to `plotly.express.scatter`, column names found among their values are included as well
+
+        Returns:
+            a `DataFrame` with the selected columns
+        """
+
+        df = table.getDF()
+        for value in plot_kwargs.values():
+            if isinstance(value, str):
+                columns = [*columns, value]
+            elif isinstance(value, (list, tuple)):
+                columns = [*columns, *(item for item in value if isinstance(item, str))]
+        columns = [col for col in dict.fromkeys(columns) if col is not None and col in df.columns]
+        return df[columns]
+
+    def plot(self, table : "MoleculeTable", x : str = None, y : str = None, color_by : str = None, card_data = tuple(), title_data : str | None = None, port=9292, recalculate=False, mols_per_scaffold_group : int = 10, scaffold : str | None = None, interactive = True, viewport_height = "100%", server : AppServer | None = None, route : str | None = None, export : str | None = None, **kwargs):
         """
         Plot the dataset using the manifold or custom `DataSet` fields. The plot is interactive and runs as a web app on the specified port.
 
@@ -49,71 +134,143 @@ class Plot:
             table: the `MoleculeTable` object to plot molecules and data from
             x: the name of the variable in the data set to use for the x-axis, if not specified the first dimension of the manifold is used
             y: the name of the variable in the data set to use for the y-axis, if not specified the second dimension of the manifold is used
-            color_by: the data to color the points by, by default the first scaffold found in the `DataSet` will be used
+            color_by: the data to color the points by, by default the first scaffold found in the `DataSet` will be used, if a list of names is given, the interactive plot has a menu to switch between them and the first one is used otherwise
             card_data: `list` of data names from the `DataSet` to show on the cards displayed when hovering over a molecule in the interactive plot, ignored if `interactive` is `False`
             title_data: the data to get from the `DataSet` as the card title, ignored if `interactive` is `False`
             port: port to run the interactive web app on, ignored if `interactive` is `False`
             recalculate: whether to recalculate the manifold or use the existing data in the dataset
             mols_per_scaffold_group: how many molecules to include in one scaffold group, only applicable if `color_by` is not specified, the scaffolds with the number of molecules lower than this value will be shown in grey in the plot
+            scaffold: name of the scaffold to group the molecules by if `color_by` is not specified, the first scaffold of the table by default
             interactive: whether to run the plot as an interactive web app or just return the figure object
             viewport_height: height of the viewport in the browser (use this ie. to make the iframe containing the plot bigger), applies only to interactive plots
+            server: optional `AppServer` to mount the interactive plot on instead of starting a new server on `port`
+            route: URL route of the plot on `server`, the name of the table by default
+            export: directory to export the plot to as a static bundle that can be served without Python (see `scaffviz.depiction.export`) instead of running the interactive app, all points are drawn with WebGL
             **kwargs: various arguments to pass to the plotting function (see `plotly.express.scatter`)
 
         Returns:
-            `None`
+            the figure if `interactive` is `False`, the path to the page of the bundle if `export` is given, the URL of the plot if it was mounted on `server`, `None` otherwise
         """
+        from scaffviz.data.manifold_table import ManifoldTable
+
         title_data = title_data or table.smilesCol
-        table = ManifoldTable.fromMolTable(table, name=f"{table.name}_manifold")
-        manifold_cols = table.addManifoldData(self.manifold, recalculate=recalculate) if self.manifold else (x, y)
+        source = table
+        table = ManifoldTable.fromMolTable(table, view=True)
+        manifold_cols = table.addManifoldData(self.manifold, recalculate=recalculate, cache=self.cache, descriptor_format=self.descriptorFormat) if self.manifold else (x, y)
         if not manifold_cols[0] and not manifold_cols[1]:
             raise ValueError("Neither manifold nor x and y were specified.")
+        if self.manifold and self.save_manifold:
+            self.saveManifold(source, table, manifold_cols)
 
         kwargs['height'] = 800 if 'height' not in kwargs else kwargs['height']
         kwargs['width'] = 2*kwargs['height'] if 'width' not in kwargs else kwargs['width']
-        kwargs['render_mode'] = 'svg' if 'render_mode' not in kwargs else kwargs['render_mode']
         x = manifold_cols[0] if not x else x
         y = manifold_cols[1] if not y else y
-        if not color_by and table.hasScaffolds:
-            scaffold = table.getScaffoldNames()[0] # FIXME: we should expose this and give a choice of what scaffold to use
-            table.createScaffoldGroups(mols_per_group=mols_per_scaffold_group)
-            color_by = table.getScaffoldGroups(f"{scaffold}", mols_per_scaffold_group).name
-            color_discrete_map = {'Other': 'lightgrey'}
-            df = table.getDF()
-            fig = px.scatter(df, x=x, y=y,
-                color = color_by, symbol=color_by,
-                symbol_sequence = self.symbols,
-                color_discrete_map = color_discrete_map,
-                **kwargs
-            )
-        elif color_by:
-            df = table.getDF()
-            fig = px.scatter(df, x=x, y=y,
-                color=color_by,
-                **kwargs
-            )
-        else:
-            df = table.getDF()
-            fig = px.scatter(df, x=x, y=y,
-                **kwargs
-            )
-        fig.update_layout(plot_bgcolor='White')
+        scaffold_groups = False
+        color_layers = list(color_by) if isinstance(color_by, (list, tuple)) else None
+        color_by = color_layers[0] if color_layers else color_by
+        scaffold_cols = table.getScaffoldNames() if table.hasScaffolds else []
+        if not color_by and (table.hasScaffolds or self.scaffolds):
+            index = self.getScaffoldIndex(table)
+            if scaffold is not None and scaffold not in index.kinds:
+                raise ValueError(f"Unknown scaffold: {scaffold}. Available scaffolds: {index.kinds}")
+            groups = index.getGroups(scaffold, mols_per_scaffold_group)
+            color_by = groups.name
+            table.addProperty(color_by, groups.reindex(table.getDF().index).values)
+            if not scaffold_cols:
+                # show the calculated scaffolds on the cards like the ones stored in the table
+                for kind in index.kinds:
+                    scaffold_cols.append(f"Scaffold_{kind}")
+                    table.addProperty(scaffold_cols[-1], index.getScaffolds(kind).reindex(table.getDF().index).values)
+            scaffold_groups = True
+        smiles_col = [table.smilesCol] + scaffold_cols
+        df = self.getPlotFrame(table, [x, y, color_by, *(color_layers or []), title_data, *smiles_col, *(card_data if interactive else [])], kwargs)
+        if 'render_mode' not in kwargs:
+            kwargs['render_mode'] = 'webgl' if export is not None or min(len(df), self.maxPoints or len(df)) > self.webglThreshold else 'svg'
+        lod = None
+        if self.maxPoints and len(df) > self.maxPoints:
+            lod = LevelOfDetail(df[x].values, df[y].values, max_points=self.maxPoints, index=table.getSpatialIndex(x, y))
+        df = df.assign(**{ROW_COL: np.arange(len(df))})
+        custom_data = [ROW_COL]
+        if export is not None:
+            lod = None
+            df = df.assign(**{TILE_COL: assign_tiles(df[x].values, df[y].values)[0]})
+            custom_data.append(TILE_COL)
+        # the app and the exported page look up the point by the leading fields, the fields of the caller follow them
+        kwargs['custom_data'] = custom_data + [col for col in kwargs.get('custom_data') or [] if col not in custom_data]
+        if lod and 'category_orders' not in kwargs:
+            # fixed order of the categories keeps the colors stable when only a subset of points is drawn
+            kwargs['category_orders'] = {
+                col: sorted(df[col].dropna().unique().tolist(), key=str)
+                for col in (color_layers or [color_by]) if col and not pd.api.types.is_numeric_dtype(df[col])
+            }
 
-        if not interactive:
+        import plotly.express as px
+
+        def make_figure(frame, color=None):
+            color = color or color_by
+            if scaffold_groups:
+                color_discrete_map = {OTHER_GROUP: 'lightgrey'}
+                fig = px.scatter(frame, x=x, y=y,
+                    color = color, symbol=color,
+                    symbol_sequence = self.symbols,
+                    color_discrete_map = color_discrete_map,
+                    **kwargs
+                )
+            elif color:
+                fig = px.scatter(frame, x=x, y=y,
+                    color=color,
+                    **kwargs
+                )
+            else:
+                fig = px.scatter(frame, x=x, y=y,
+                    **kwargs
+                )
+            fig.update_layout(plot_bgcolor='White')
             return fig
 
+        if not interactive and export is None:
+            return make_figure(df.iloc[lod.getIndices()] if lod else df)
+
         # interactive plot:
         excluded = df.columns[df.columns.str.contains('RDMol')].tolist() + list(table.getDescriptorNames()) + list(manifold_cols) + df.columns[~df.columns.isin(card_data)].tolist()
         included = [title_data] + [col for col in df.columns if col not in excluded]
-        smiles_col = [table.smilesCol] + table.getScaffoldNames() if table.hasScaffolds else [table.smilesCol]
-        app_scatter = molplotly.add_molecules(fig=fig,
-          df=df,
-          smiles_col=smiles_col,
-          title_col= title_data,
-          color_col = color_by,
-          caption_cols = included,
-          # width = kwargs['width']
+        if export is not None:
+            return export_bundle(
+                export,
+                make_figure(df),
+                df,
+                x,
+                y,
+                smiles_cols=smiles_col,
+                title_col=title_data,
+                caption_cols=included,
+                depictions=self.depictions,
+                n_jobs=-1 if self.prerender is True else (self.prerender or 1),
+                title=table.name,
+            )
+        if self.prerender:
+            self.depictions.prerender(
+                (smi for col in smiles_col for smi in df[col].values),
+                n_jobs=self.prerender if self.prerender is not True else -1
+            )
+        app_scatter = create_app(
+            df=df,
+            make_figure=make_figure,
+            smiles_cols=smiles_col,
+            title_col=title_data,
+            caption_cols=included,
+            color_col=color_layers or color_by,
+            lod=lod,
+            show_density=self.showDensity,
+            depictions=self.depictions,
+            url_prefix=AppServer.getPrefix(route or table.name) if server is not None else None,
         )
 
+        if server is not None:
+            route = AppServer.normalizeRoute(route or table.name)
+            self.open_apps[route] = app_scatter
+            return server.addApp(route, app_scatter)
         self.open_apps[port] = app_scatter
         app_scatter.run_server(
             mode='inline',
@@ -121,148 +278,10 @@ class Plot:
             height=viewport_height,
         )
 
-class ModelPerformancePlot(ModelPlot):
-
-    def __init__(self, manifold : Manifold, models: List[QSPRModel], datasets : List[QSPRDataset], ports: List[int],card_props = None, plot_type = Literal["errors", "splits", "predictions", "labels"], async_execution=True):
-        super().__init__(models)
-        # some checks
-        if len(ports) != len(set(ports)):
-            raise ValueError("Ports must be unique.")
-        if len(datasets) != len(models):
-            raise ValueError("Number of models and datasets does not match.")
-        if len(ports) != len(models):
-            raise ValueError("Number of models and ports does not match.")
-        # assign attributes
-        self.manifold = manifold
-        self.plotType = plot_type
-        self.ports = ports
-        self.runningApps = dict()
-        self.asyncExecution = async_execution
-        self.cardProps = card_props if card_props else []
-        # initialize the mapping of models to their respective data sets
-        self.datasets = dict()
-        for model, dataset in zip(models, datasets):
-            self.datasets[model] = dataset
-
-    def getSupportedTasks(self):
-        """Return a list of tasks supported by this plotter."""
-        return [
-            ModelTasks.SINGLECLASS, 
-            ModelTasks.MULTICLASS, 
-            ModelTasks.REGRESSION,
-        ]
-
-    def getPerfCols(self, model, target_prop):
-        """
-        Get the relevant performance columns for a given model and target property.
-
-        Args:
-            model: `QSPRModel`
-            target_prop: `TargetProperty`
-
-        Returns:
-            col_label: column name for the original label/target
-            col_pred: column name for the prediction
-            cols_probas: column names for the class probabilities if the target property is a classification task, empty list otherwise
-        """
-
-        col_label = f"{target_prop.name}_Label"
-        if model.task.isClassification():
-            col_pred = f"{target_prop.name}_Prediction"
-            cols_probas = []
-            for i in range(target_prop.nClasses):
-                cols_probas.append(f"{target_prop.name}_ProbabilityClass_{i}")
-        elif model.task.isRegression():
-            col_pred = f"{target_prop.name}_Prediction"
-            cols_probas = []
-        else:
-            raise NotImplementedError(f"Unsupported task: {model.task}")
-
-        return col_label, col_pred, cols_probas
-
-
-    def getPerfData(self, path, model, target_prop):
-        df = pd.read_table(path, index_col=0)
-        col_label, col_pred, cols_probas = self.getPerfCols(model, target_prop)
-        col_err = f"{target_prop}_Error"
-        df[col_err] = df[col_label] - df[col_pred]
-        if model.task.isClassification():
-            # convert True/False to string labels
-            df[col_label] = [f"Class_{int(x)}" for x in df[col_label]]
-            df[col_pred] = [f"Class_{int(x)}" for x in df[col_pred]]
-        return df, col_label, col_pred, col_err, cols_probas
-
-    def getCVData(self, model, target_prop):
-        cv_path = self.cvPaths[model]
-        df, col_label, col_pred, col_err, cols_probas = self.getPerfData(cv_path, model, target_prop)
-        df["TestSet"] = [f"Fold_{int(x) + 1}" for x in df["Fold"]]
-        del df["Fold"]
-        return df, col_label, col_pred, col_err, cols_probas
-
-    def getIndData(self, model, target_prop):
-        ind_path = self.indPaths[model]
-        df, col_label, col_pred, col_err, cols_probas = self.getPerfData(ind_path, model, target_prop)
-        df["TestSet"] = "Independent"
-        return df, col_label, col_pred, col_err, cols_probas
-
-    def make(self, show=True, save=False):
-        """Make the plot."""
-
-        for model_idx, model in enumerate(self.datasets.keys()):
-            port = self.ports[model_idx]
-            ds = self.datasets[model]
-            df_cv, col_label, col_pred, col_err, cols_probas = self.getCVData(model, model.targetProperties[0])
-            df_ind, col_label, col_pred, col_err, cols_probas = self.getIndData(model, model.targetProperties[0])
-            df_all = pd.concat([df_cv, df_ind])
-
-            # create a molecule table with the required data
-            manifold_cols = ds.getSubset(f"{self.manifold}_")
-            if manifold_cols is None:
-                manifold_cols = []
-            else:
-                manifold_cols = manifold_cols.columns.tolist()
-            ds_subset = ds.getDF()[[ds.smilesCol] + self.cardProps + ds.indexCols + manifold_cols]
-            df_all = ds_subset.merge(df_all, left_index=True, right_index=True)
-            mt = MoleculeTable(f"{model.name}_perfplot_{self.plotType}_p{port}", df=df_all, smiles_col=ds.smilesCol, index_cols=ds.indexCols)
-            features = ds.getFeatures(concat=True)
-            mt.addDescriptors([DataFrameDescriptorSet(features)])
-
-            # create a server for the current plot
-            plt_map = {
-                "errors" : col_err,
-                "splits" : "TestSet",
-                "predictions" : col_pred,
-                "labels" : col_label,
-            }
-            def plot_server(port, runningApps):
-                def run():
-                    plot = Plot(manifold=self.manifold)
-                    runningApps[port]["plot"] = plot
-                    plot.plot(
-                        mt,
-                        title_data=mt.indexCols[0],
-                        card_data=mt.indexCols + ["TestSet", col_label, col_pred, col_err] + cols_probas + self.cardProps,
-                        color_by=plt_map[self.plotType],
-                        port=port,
-                        interactive=True,
-                        recalculate=False,
-                    )
-
-                return run
-
-            server = plot_server(port, self.runningApps)
-            self.runningApps[port] = dict()
-            self.runningApps[port]["model"] = model
-            self.runningApps[port]['server'] = server
-            self.runningApps[port]['plot_type'] = self.plotType
-            self.runningApps[port]['table'] = mt
-            if self.asyncExecution:
-                thr = threading.Thread(target=plot_server(port, self.runningApps))
-                thr.start()
-                # sleep to give the server time to start
-                time.sleep(1)
-                self.runningApps[port]['thread'] = thr
-            else:
-                server()
 
-        return self.runningApps
\ No newline at end of file
+def __getattr__(name):
+    # the performance plot needs the models and plotting modules of qsprpred, which are only imported when it is used
+    if name == "ModelPerformancePlot":
+        from scaffviz.depiction.performance import ModelPerformancePlot
+        return ModelPerformancePlot
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,220 @@
+"""
+server
+
+A managed web server that hosts many Dash apps under their own URL routes on a single port.
+
+Created by: Martin Sicho
+On: 18.10.26, 19:10
+"""
+import html
+import threading
+
+_SERVERS = dict()
+_SERVERS_LOCK = threading.Lock()
+
+
+def get_server(port : int = 9292, host : str = "127.0.0.1"):
+    """
+    Get the running `AppServer` on the given port or start a new one.
+    Plots made in the same session share the server instead of starting a new one each time.
+
+    Args:
+        port: port of the server
+        host: host name or address to listen on
+
+    Returns:
+        the running `AppServer`
+    """
+
+    with _SERVERS_LOCK:
+        server = _SERVERS.get((host, port))
+        if server is None or not server.isRunning():
+            server = AppServer(port=port, host=host)
+            server.start()
+            # the actual port if a free port was picked
+            _SERVERS[(host, server.port)] = server
+        return server
+
+
+class AppServer:
+    """
+    Serves Dash apps under URL routes on a single port.
+    The apps are mounted on a `werkzeug` dispatcher that can be extended while the server is running,
+    so new plots are added without starting new servers or threads. An index of all mounted apps is shown at the root URL.
+    """
+
+    def __init__(self, port : int = 9292, host : str = "127.0.0.1"):
+        """
+        Initialize the server. It does not listen until `start` is called.
+
+        Args:
+            port: port to listen on, `0` to pick a free port
+            host: host name or address to listen on
+        """
+
+        from werkzeug.middleware.dispatcher import DispatcherMiddleware
+
+        self.host = host
+        self.port = port
+        self.apps = dict()
+        self._dispatcher = DispatcherMiddleware(self._index, {})
+        self._server = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalizeRoute(route : str):
+        """
+        Normalize a route to the form `/some/route`.
+
+        Args:
+            route: the route
+
+        Returns:
+            the normalized route
+        """
+
+        route = "/" + "/".join(part for part in route.strip().split("/") if part)
+        if route == "/":
+            raise ValueError("Apps cannot be mounted at the root of the server.")
+        return route
+
+    @staticmethod
+    def getPrefix(route : str):
+        """
+        Get the URL prefix a Dash app has to be created with to be mounted at a route (its `requests_pathname_prefix`).
+
+        Args:
+            route: the route
+
+        Returns:
+            the prefix
+        """
+
+        return AppServer.normalizeRoute(route) + "/"
+
+    def _index(self, environ, start_response):
+        if environ.get("PATH_INFO", "/") not in ("", "/"):
+            body = b"Not Found"
+            start_response("404 NOT FOUND", [("Content-Type", "text/plain"), ("Content-Length", str(len(body)))])
+            return [body]
+        links = "".join(f'<li><a href="{html.escape(route)}/">{html.escape(route)}</a></li>' for route in sorted(self.apps))
+        body = f"<html><body><h1>scaffviz</h1><ul>{links}</ul></body></html>".encode()
+        start_response("200 OK", [("Content-Type", "text/html; charset=utf-8"), ("Content-Length", str(len(body)))])
+        return [body]
+
+    def addApp(self, route : str, app):
+        """
+        Mount a Dash app at a route. An app already mounted at the same route is replaced.
+
+        Args:
+            route: the route, the app has to be created with the prefix from `getPrefix`
+            app: the Dash app
+
+        Returns:
+            the URL of the app
+        """
+
+        route = self.normalizeRoute(route)
+        with self._lock:
+            self.apps[route] = app
+            self._dispatcher.mounts[route] = app.server
+        return self.getUrl(route)
+
+    def removeApp(self, route : str):
+        """
+        Unmount the app at a route.
+
+        Args:
+            route: the route
+
+        Returns:
+            the removed app or `None` if there was no app at the route
+        """
+
+        route = self.normalizeRoute(route)
+        with self._lock:
+            self._dispatcher.mounts.pop(route, None)
+            return self.apps.pop(route, None)
+
+    def hasApp(self, route : str):
+        return self.normalizeRoute(route) in self.apps
+
+    def getApp(self, route : str):
+        return self.apps.get(self.normalizeRoute(route))
+
+    def getUrl(self, route : str | None = None):
+        """
+        Get the URL of the server or of an app mounted on it.
+
+        Args:
+            route: route of the app, `None` for the index of the server
+
+        Returns:
+            the URL
+        """
+
+        host = "localhost" if self.host in ("127.0.0.1", "0.0.0.0") else self.host
+        path = self.normalizeRoute(route) + "/" if route else "/"
+        return f"http://{host}:{self.port}{path}"
+
+    def isRunning(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """
+        Start serving in a background thread. The method returns as soon as the server accepts connections.
+
+        Returns:
+            `self`
+        """
+
+        from werkzeug.serving import make_server
+
+        with self._lock:
+            if self.isRunning():
+                return self
+            # the socket is bound and listening once the server is created, requests that arrive before the loop starts wait in the backlog
+            self._server = make_server(self.host, self.port, self._dispatcher, threaded=True)
+            self.port = self._server.server_port
+            self._thread = threading.Thread(target=self._server.serve_forever, name=f"scaffviz-server-{self.port}", daemon=True)
+            self._thread.start()
+        return self
+
+    def wait(self):
+        """
+        Block until the server is shut down. Interrupting the wait with `KeyboardInterrupt` shuts the server down.
+        """
+
+        try:
+            while self.isRunning():
+                self._thread.join(0.5)
+        except KeyboardInterrupt:
+            self.shutdown()
+
+    def shutdown(self, timeout : float | None = 5):
+        """
+        Stop the server and wait for its thread to finish. The mounted apps are kept, so the server can be started again.
+
+        Args:
+            timeout: maximum time in seconds to wait for the server thread
+        """
+
+        with self._lock:
+            if self._server is None:
+                return
+            self._server.shutdown()
+            self._server.server_close()
+            if self._thread is not None:
+                self._thread.join(timeout)
+            self._server = None
+            self._thread = None
+        with _SERVERS_LOCK:
+            if _SERVERS.get((self.host, self.port)) is self:
+                del _SERVERS[(self.host, self.port)]
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
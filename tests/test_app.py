@@ -0,0 +1,30 @@
+"""
+test_app
+
+Created by: Martin Sicho
+On: 19.10.26, 00:30
+"""
+import numpy as np
+
+from scaffviz.data.spatial import SpatialIndex
+from scaffviz.depiction.app import parse_viewport, select_rows
+
+
+def test_parse_viewport():
+    assert parse_viewport(None) is None
+    assert parse_viewport({"dragmode": "lasso"}) is None
+    assert parse_viewport({"xaxis.range[0]": 1, "xaxis.range[1]": 2, "yaxis.range[0]": 3, "yaxis.range[1]": 4}) == ((1, 2), (3, 4))
+    assert parse_viewport({"xaxis.range": [1, 2]}) == ((1, 2), None)
+    assert parse_viewport({"xaxis.autorange": True, "yaxis.autorange": True}) == (None, None)
+    assert parse_viewport({"autosize": True}) == (None, None)
+
+
+def test_select_rows():
+    x, y = np.meshgrid(np.arange(10.0), np.arange(10.0))
+    index = SpatialIndex(x.ravel(), y.ravel())
+    assert select_rows(index, None) is None
+    assert select_rows(index, {"points": []}) is None
+    box = select_rows(index, {"range": {"x": [1.5, 3.5], "y": [0, 1]}})
+    assert box.tolist() == [2, 3, 12, 13]
+    lasso = select_rows(index, {"lassoPoints": {"x": [-0.5, 3, -0.5], "y": [-0.5, -0.5, 3]}})
+    assert lasso.tolist() == [0, 1, 2, 10, 11, 20]
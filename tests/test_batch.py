@@ -0,0 +1,25 @@
+"""
+test_batch
+
+Created by: Martin Sicho
+On: 18.10.26, 23:50
+"""
+from scaffviz.clustering.manifold import TSNE
+from scaffviz.data.manifold_table import ManifoldTable
+from scaffviz.depiction.batch import BatchPlot
+from scaffviz.depiction.plot import Plot
+
+from .test_manifold_table import SMILES, make_table
+
+
+def test_saved_tables_reload(tmp_path):
+    source = make_table(tmp_path / "store")
+    batch = BatchPlot(Plot(TSNE(perplexity=5, random_state=42)), n_jobs=1, save_tables=True)
+    report = batch.make([source], str(tmp_path / "maps"))
+    assert report["status"].tolist() == ["done"], report["error"].tolist()
+
+    loaded = ManifoldTable.fromFile(report["table"][0])
+    assert len(loaded.getDF()) == len(SMILES)
+    assert {"TSNE_1", "TSNE_2"} <= set(loaded.getDF().columns)
+    X = loaded.getManifoldInput()
+    assert loaded.getManifold("TSNE").transform(X[:3]).shape == (3, 2)
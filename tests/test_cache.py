@@ -0,0 +1,38 @@
+"""
+test_cache
+
+Created by: Martin Sicho
+On: 19.10.26, 00:10
+"""
+import os
+
+import numpy as np
+
+from scaffviz.clustering.manifold import PCA
+from scaffviz.data.cache import EmbeddingCache
+
+
+def test_embedding_cache_hit_and_miss(tmp_path):
+    cache = EmbeddingCache(str(tmp_path))
+    X = np.random.default_rng(42).random((20, 5))
+    key = cache.getKey(X, PCA(n_components=2))
+    assert cache.get(key) is None
+
+    coords = PCA(n_components=2).fit_transform(X)
+    cache.put(key, coords)
+    assert cache.getKey(X.copy(), PCA(n_components=2)) == key
+    assert np.array_equal(cache.get(key), coords)
+    # other descriptors or manifold settings miss the cached embedding
+    assert cache.getKey(X + 1, PCA(n_components=2)) != key
+    assert cache.getKey(X, PCA(n_components=2, whiten=True)) != key
+
+
+def test_embedding_cache_eviction(tmp_path):
+    array = np.zeros(1000)
+    cache = EmbeddingCache(str(tmp_path), max_size=int(array.nbytes * 2.5))
+    for i, key in enumerate(("a", "b", "c")):
+        cache.put(key, array)
+        # explicit times of use, so that the order does not depend on the resolution of the file system clock
+        os.utime(cache.getPath(key), (i + 1, i + 1))
+    assert not cache.has("a")
+    assert cache.has("b") and cache.has("c")
@@ -0,0 +1,56 @@
+"""
+test_cli
+
+Created by: Martin Sicho
+On: 19.10.26, 02:15
+"""
+import argparse
+import os
+
+import pandas as pd
+import pytest
+
+from scaffviz.cli import find_table, main, parse_params
+
+SMILES = ["CCO", "CCN", "c1ccccc1", "c1ccccc1O", "CC(=O)O", "CCCC", "CCCCO", "c1ccncc1", "CCOC", "CNC"] * 3
+
+
+def test_parse_params():
+    assert parse_params(None) == {}
+    assert parse_params(["perplexity=5", "whiten=True", "metric=cosine", "init='pca'", "shape=(1, 2)"]) == {
+        "perplexity": 5, "whiten": True, "metric": "cosine", "init": "pca", "shape": (1, 2)
+    }
+    # only the first separator splits the key from the value
+    assert parse_params(["expr=a=b"]) == {"expr": "a=b"}
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_params(["perplexity"])
+
+
+def test_build_and_export(tmp_path, capsys):
+    csv = tmp_path / "mols.csv"
+    pd.DataFrame({"SMILES": SMILES, "Value": range(len(SMILES))}).to_csv(csv, index=False)
+    store_dir = str(tmp_path / "store")
+    build = ["build", str(csv), "--name", "mols", "--store-dir", store_dir, "--manifold", "pca", "--fit-size", "20", "--chunk-size", "10"]
+    assert main(build) == 0
+    assert "Built mols with 30 molecules" in capsys.readouterr().out
+    table = find_table("mols", store_dir)
+    assert os.path.exists(table)
+
+    # a second run with the same input and settings is skipped, other settings rebuild the table
+    assert main(build) == 0
+    assert "mols is up to date" in capsys.readouterr().out
+    assert main(build + ["--param", "whiten=True"]) == 0
+    assert "Built mols" in capsys.readouterr().out
+
+    output = str(tmp_path / "bundle")
+    export = ["export", "mols", output, "--store-dir", store_dir, "--card-data", "Value"]
+    assert main(export) == 0
+    assert "Exported mols" in capsys.readouterr().out
+    assert os.path.exists(os.path.join(output, "index.html"))
+    assert main(export) == 0
+    assert f"{output} is up to date" in capsys.readouterr().out
+    assert main(export + ["--force"]) == 0
+    assert "Exported mols" in capsys.readouterr().out
+
+    with pytest.raises(FileNotFoundError):
+        find_table("other", store_dir)
@@ -0,0 +1,51 @@
+"""
+test_depictions
+
+Created by: Martin Sicho
+On: 19.10.26, 02:05
+"""
+import os
+
+from scaffviz.depiction.depictions import DepictionCache
+
+SMILES = ["CCO", "c1ccccc1", "CC(=O)O", "CCN", "c1ccncc1", "CCCC"]
+
+
+def test_lru():
+    cache = DepictionCache(max_items=2)
+    first = cache.get("CCO")
+    assert first.startswith("data:image/svg+xml;base64,")
+    cache.get("CCN")
+    assert cache.get("CCO") is first
+    assert (cache.hits, cache.misses) == (1, 2)
+    # the least recently used depiction is evicted
+    cache.get("CCCC")
+    assert len(cache) == 2
+    assert "CCO" in cache and "CCCC" in cache and "CCN" not in cache
+    assert cache.get("not a smiles") is None
+
+
+def test_store(tmp_path):
+    store_dir = tmp_path / "depictions"
+    cache = DepictionCache(store_dir=str(store_dir))
+    depiction = cache.get("OCC")
+    assert len(os.listdir(store_dir)) == 1
+
+    # the depiction is loaded from disk by its canonical SMILES, other options are stored apart
+    other = DepictionCache(store_dir=str(store_dir))
+    assert other.prerender(["CCO"]) == 0
+    assert other.get("CCO") == depiction
+    assert DepictionCache(store_dir=str(store_dir), size=100).prerender(["CCO"]) == 1
+    assert DepictionCache(store_dir=str(store_dir), fmt="png").get("CCO").startswith("data:image/png;base64,")
+    assert len(os.listdir(store_dir)) == 3
+
+
+def test_prerender(tmp_path):
+    cache = DepictionCache(store_dir=str(tmp_path))
+    assert cache.prerender(SMILES + SMILES[:2] + [None, "not a smiles"], n_jobs=2, chunk_size=2) == len(SMILES)
+    assert all(smi in cache for smi in SMILES)
+    assert cache.get("not a smiles") is None
+    assert cache.misses == 0
+    # depictions already in memory are not rendered again
+    assert cache.prerender(SMILES) == 0
+    assert len(os.listdir(tmp_path)) == len(SMILES)
@@ -0,0 +1,61 @@
+"""
+test_export
+
+Created by: Martin Sicho
+On: 19.10.26, 01:10
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from scaffviz.depiction.app import ROW_COL
+from scaffviz.depiction.depictions import DepictionCache
+from scaffviz.depiction.export import TILE_COL, assign_tiles, export_bundle
+
+SMILES = ["CCO", "c1ccccc1", "CC(=O)O", "CCN", "c1ccncc1", "CCCC", "CC(C)O", "C1CCCCC1"]
+
+
+def test_assign_tiles():
+    rng = np.random.default_rng(42)
+    x, y = rng.normal(size=500), rng.normal(size=500)
+    labels, tiles = assign_tiles(x, y, max_tile_points=50)
+    assert np.bincount(labels).max() <= 50
+    assert sorted(np.unique(labels)) == [tile["id"] for tile in tiles]
+    for tile in tiles:
+        rows = labels == tile["id"]
+        assert tile["x0"] <= x[rows].min() and x[rows].max() <= tile["x1"]
+        assert tile["y0"] <= y[rows].min() and y[rows].max() <= tile["y1"]
+    # points at the same position cannot be split
+    labels, tiles = assign_tiles(np.zeros(10), np.zeros(10), max_tile_points=2)
+    assert len(tiles) == 1 and np.all(labels == 0)
+
+
+def test_export_bundle(tmp_path):
+    import plotly.express as px
+
+    df = pd.DataFrame({"SMILES": SMILES, "x": np.arange(8.0), "y": np.arange(8.0) % 3, "Name": [f"mol {i}" for i in range(8)]})
+    df[ROW_COL] = np.arange(len(df))
+    df[TILE_COL] = assign_tiles(df["x"], df["y"], max_tile_points=3)[0]
+    fig = px.scatter(df, x="x", y="y", custom_data=[ROW_COL, TILE_COL])
+    # the cache holds fewer depictions than the bundle needs
+    depictions = DepictionCache(max_items=2)
+    page = export_bundle(str(tmp_path), fig, df, "x", "y", ["SMILES"], title_col="Name", depictions=depictions, title="<b>map</b>")
+
+    with open(page) as page_file:
+        assert "<title>&lt;b&gt;map&lt;/b&gt;</title>" in page_file.read()
+    with open(tmp_path / "meta.json") as meta_file:
+        meta = json.load(meta_file)
+    assert len(meta["tiles"]) == df[TILE_COL].nunique()
+    rows, images = [], {}
+    for tile in meta["tiles"]:
+        with open(tmp_path / "tiles" / f"{tile['id']}.json") as tile_file:
+            data = json.load(tile_file)
+        rows.extend(data["rows"])
+        images.update(data["images"])
+        assert data["columns"]["Name"] == df.set_index(ROW_COL).loc[data["rows"], "Name"].tolist()
+    assert sorted(rows) == list(range(len(df)))
+    assert set(images) == set(SMILES)
+    assert all(image.startswith("data:image/svg+xml") for image in images.values())
+    assert os.path.exists(tmp_path / "plotly.min.js")
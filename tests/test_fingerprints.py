@@ -0,0 +1,33 @@
+"""
+test_fingerprints
+
+Created by: Martin Sicho
+On: 19.10.26, 00:05
+"""
+import numpy as np
+from scipy import sparse
+
+from scaffviz.clustering.fingerprints import PackedFingerprints, is_binary, to_fingerprints
+
+
+def random_fingerprints(n_samples=60, n_bits=100, density=0.2, seed=42):
+    return (np.random.default_rng(seed).random((n_samples, n_bits)) < density).astype(np.uint8)
+
+
+def test_packed_round_trip():
+    X = random_fingerprints()
+    packed = PackedFingerprints.fromDense(X)
+    assert packed.shape == X.shape
+    assert packed.bits.nbytes == X.shape[0] * ((X.shape[1] + 7) // 8)
+    assert np.array_equal(packed.toDense(), X)
+    assert np.array_equal(packed.toSparse().toarray(), X)
+    assert np.array_equal(PackedFingerprints.fromSparse(sparse.csr_matrix(X)).bits, packed.bits)
+    assert np.array_equal(packed[5:10].toDense(), X[5:10])
+    assert is_binary(X) and is_binary(packed)
+    assert not is_binary(X * 2.5)
+
+
+def test_to_fingerprints():
+    X = random_fingerprints()
+    assert np.array_equal(to_fingerprints(X, "packed").toDense(), X)
+    assert np.array_equal(to_fingerprints(X, "sparse").toarray(), X)
@@ -0,0 +1,42 @@
+"""
+test_imports
+
+Created by: Martin Sicho
+On: 18.10.26, 23:55
+"""
+import json
+import subprocess
+import sys
+
+import pytest
+
+HEAVY_MODULES = ("umap", "numba", "sklearn", "dash", "plotly.express", "qsprpred")
+BUDGET = 5.0
+"""Maximum import time in seconds, generous so that slow machines pass, importing any of the heavy modules takes much longer."""
+
+
+@pytest.mark.parametrize("module", ["scaffviz.cli", "scaffviz.depiction.plot"])
+def test_import_time(module):
+    code = "\n".join([
+        "import json, sys, time",
+        "start = time.perf_counter()",
+        f"import {module}",
+        "seconds = time.perf_counter() - start",
+        f"print(json.dumps({{'seconds': seconds, 'heavy': [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))",
+    ])
+    process = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    assert result["heavy"] == []
+    assert result["seconds"] < BUDGET
+
+
+def test_umap_settings_without_import():
+    code = "\n".join([
+        "import sys",
+        "from scaffviz.clustering.manifold import UMAP",
+        "from scaffviz.data.cache import hash_settings",
+        "hash_settings(UMAP(n_neighbors=10))",
+        "print('umap' in sys.modules or 'numba' in sys.modules)",
+    ])
+    process = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert process.stdout.strip().splitlines()[-1] == "False"
@@ -0,0 +1,172 @@
+"""
+test_manifold
+
+Created by: Martin Sicho
+On: 19.10.26, 00:15
+"""
+import numpy as np
+import pytest
+
+from scaffviz.clustering.fingerprints import PackedFingerprints
+from scaffviz.clustering.manifold import Manifold, PCA, TSNE, UMAP, LandmarkManifold
+
+
+def clusters(n_per_cluster=40, n_features=10, seed=42):
+    """Two well separated clusters and their labels."""
+    rng = np.random.default_rng(seed)
+    X = np.vstack([rng.normal(0, 1, (n_per_cluster, n_features)), rng.normal(20, 1, (n_per_cluster, n_features))])
+    return X, np.repeat([0, 1], n_per_cluster)
+
+
+def assert_projects_to_cluster(coords, new_coords, labels, new_labels):
+    centroids = np.array([coords[labels == label].mean(axis=0) for label in (0, 1)])
+    nearest = np.linalg.norm(new_coords[:, None, :] - centroids[None, :, :], axis=2).argmin(axis=1)
+    assert np.array_equal(nearest, new_labels)
+
+
+MANIFOLDS = {
+    "pca": lambda: PCA(n_components=2),
+    "tsne": lambda: TSNE(perplexity=10, random_state=42),
+    "umap": lambda: UMAP(n_neighbors=10, random_state=42),
+    "landmark": lambda: LandmarkManifold(TSNE(perplexity=5, random_state=42), n_landmarks=30, random_state=42),
+}
+
+
+@pytest.mark.parametrize("name", MANIFOLDS)
+def test_transform(name):
+    X, labels = clusters()
+    new_X, new_labels = clusters(n_per_cluster=5, seed=7)
+    manifold = MANIFOLDS[name]()
+    with pytest.raises(ValueError):
+        manifold.transform(new_X)
+    coords = manifold.fit_transform(X)
+    assert coords.shape == (len(X), 2)
+    new_coords = manifold.transform(new_X)
+    assert new_coords.shape == (len(new_X), 2)
+    assert np.isfinite(new_coords).all()
+    assert_projects_to_cluster(coords, new_coords, labels, new_labels)
+    # projecting does not refit the manifold
+    assert np.allclose(manifold.transform(new_X), new_coords)
+
+
+@pytest.mark.parametrize("name", MANIFOLDS)
+def test_save_and_load(name, tmp_path):
+    X, _ = clusters()
+    manifold = MANIFOLDS[name]()
+    manifold.fit(X)
+    path = manifold.toFile(str(tmp_path / f"{name}.pkl"))
+    loaded = Manifold.fromFile(path)
+    assert str(loaded) == str(manifold)
+    assert np.allclose(loaded.transform(X[:5]), manifold.transform(X[:5]))
+
+
+class CountingPCA(PCA):
+    """PCA that counts how many times it is pickled."""
+
+    pickled = 0
+
+    def __getstate__(self):
+        CountingPCA.pickled += 1
+        return super().__getstate__()
+
+
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_transform_in_chunks(executor):
+    X, _ = clusters()
+    expected = PCA(n_components=2).fit(X).transform(X)
+    CountingPCA.pickled = 0
+    chunked = CountingPCA(n_components=2, chunk_size=7, n_jobs=2, executor=executor).fit(X)
+    assert np.allclose(chunked.transform(X), expected)
+    # the manifold is sent to each worker once and not with each of the chunks
+    assert CountingPCA.pickled <= 2
+
+
+def test_timing_callbacks():
+    X, _ = clusters()
+    phases = []
+    manifold = TSNE(perplexity=10, random_state=42, callbacks=[lambda manifold, phase, seconds: phases.append(phase)])
+    manifold.fit(X)
+    assert phases == ["scaling", "optimization", "index"]
+    manifold.transform(X[:5])
+    assert phases[-1] == "projection"
+    assert set(manifold.timings) == {"scaling", "optimization", "index", "projection"}
+
+
+def test_landmark_settings():
+    from scaffviz.data.cache import hash_settings
+
+    manifold = LandmarkManifold(TSNE(), selection="stratified", groups=["a", "b", "a"])
+    assert str(manifold) == "Landmark_TSNE"
+    assert hash_settings(manifold) != hash_settings(TSNE())
+    assert hash_settings(manifold) == hash_settings(LandmarkManifold(TSNE(), selection="stratified", groups=["a", "b", "a"]))
+    assert hash_settings(manifold) != hash_settings(LandmarkManifold(TSNE(), selection="stratified", groups=["a", "b", "b"]))
+
+
+def test_tsne_auto_scale():
+    from scipy import sparse
+
+    rng = np.random.default_rng(42)
+    counts = sparse.csr_matrix(rng.poisson(0.5, (40, 20)).astype(float))
+    assert TSNE(perplexity=5).fit(counts)._scaler is not None
+    bits = sparse.csr_matrix((counts > 0).astype(float))
+    assert TSNE(perplexity=5).fit(bits)._scaler is None
+    assert TSNE(perplexity=5).fit(PackedFingerprints.fromSparse(bits))._scaler is None
+    assert TSNE(perplexity=5).fit(counts.toarray())._scaler is not None
+
+
+def test_tsne_default_engine():
+    assert TSNE().getEngine() == "sklearn"
+    assert TSNE(engine="opentsne").getEngine() == "opentsne"
+    # other metrics are only passed to openTSNE through a neighbor search backend
+    assert TSNE(engine="auto", metric="cosine").getEngine() == "sklearn"
+
+
+def test_opentsne():
+    pytest.importorskip("openTSNE")
+    from scaffviz.clustering.neighbors import TanimotoNeighbors
+
+    assert TSNE(engine="auto").getEngine() == "opentsne"
+    assert TSNE(engine="auto", metric="jaccard", neighbors=TanimotoNeighbors()).getEngine() == "opentsne"
+    X, labels = clusters()
+    new_X, new_labels = clusters(n_per_cluster=5, seed=7)
+    manifold = TSNE(perplexity=10, random_state=42, engine="auto")
+    coords = manifold.fit_transform(X)
+    assert str(manifold) == "TSNE"
+    assert coords.shape == (len(X), 2)
+    assert_projects_to_cluster(coords, manifold.transform(new_X), labels, new_labels)
+
+
+def test_landmark_timing():
+    X, _ = clusters()
+    phases = []
+    manifold = LandmarkManifold(PCA(n_components=2), n_landmarks=30, batch_size=10, random_state=42, callbacks=[lambda manifold, phase, seconds: phases.append(phase)])
+    manifold.fit(X)
+    phases.clear()
+    manifold.transform(X)
+    # all batches are reported as one projection
+    assert phases == ["projection"]
+    assert manifold.timings["projection"] > 0
+
+
+def test_pca_solvers():
+    # well separated variances, so that the components are unique
+    X = np.random.default_rng(42).normal(size=(100, 5)) * [10, 5, 2, 1, 0.5]
+    full = PCA(n_components=2, solver="full").fit_transform(X)
+    for solver in ("randomized", "incremental"):
+        coords = PCA(n_components=2, solver=solver, batch_size=25, random_state=42).fit_transform(X)
+        # the components agree up to their sign
+        assert np.allclose(np.abs(coords), np.abs(full), atol=1e-2)
+    assert PCA(n_components=2).getSolver(X) == "full"
+    assert PCA(n_components=2, incremental_threshold=100).getSolver(X) == "incremental"
+    assert PCA(n_components=2).getSolver(np.zeros((600, 600))) == "randomized"
+    assert PCA(n_components=2).getSolver(PackedFingerprints.fromDense(X > 0)) == "truncated"
+
+
+def test_umap_params():
+    import umap
+
+    manifold = UMAP(10, min_dist=0.2, random_state=42)
+    params = manifold.getParams()
+    assert {key: params[key] for key in umap.UMAP().get_params()} == umap.UMAP(10, min_dist=0.2, random_state=42).get_params()
+    # the estimator is only created when it is used
+    assert manifold._umapModel is None
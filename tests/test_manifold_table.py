@@ -0,0 +1,101 @@
+"""
+test_manifold_table
+
+Created by: Martin Sicho
+On: 18.10.26, 23:40
+"""
+import numpy as np
+import pandas as pd
+from qsprpred.data import MoleculeTable
+from qsprpred.data.descriptors.fingerprints import MorganFP
+
+from scaffviz.clustering.manifold import PCA, TSNE
+from scaffviz.data.manifold_table import ManifoldTable
+
+SMILES = ["CCO", "CCN", "c1ccccc1", "c1ccccc1O", "CC(=O)O", "CCCC", "CCCCO", "c1ccncc1", "CCOC", "CNC"] * 4
+
+
+def make_table(store_dir, name="source"):
+    table = MoleculeTable(name, pd.DataFrame({"SMILES": SMILES}), store_dir=str(store_dir))
+    table.addDescriptors([MorganFP(radius=2, nBits=256)])
+    table.save()
+    return table
+
+
+def test_save_reload_transform(tmp_path):
+    source = make_table(tmp_path)
+    table = ManifoldTable.fromMolTable(source, name="map")
+    table.addManifoldData(TSNE(perplexity=5, random_state=42))
+    path = table.save()
+
+    loaded = ManifoldTable.fromFile(path)
+    X = loaded.getManifoldInput()
+    assert X.shape == (len(SMILES), 256)
+    coords = loaded.getManifold("TSNE").transform(X[:3])
+    assert coords.shape == (3, 2)
+    assert np.isfinite(coords).all()
+    # the source keeps its own descriptor files
+    assert len(MoleculeTable.fromFile(source.metaFile).descriptors) == 1
+
+
+def test_columnar_round_trip(tmp_path):
+    source = make_table(tmp_path)
+    table = ManifoldTable.fromMolTable(source, name="map")
+    table.addProperty("value", np.arange(len(SMILES), dtype=float))
+    # object columns are only saved if all their values can be stored
+    table.addProperty("label", [None] + ["a"] * (len(SMILES) - 1))
+    table.addProperty("objects", ["a"] + [{"a": 1}] * (len(SMILES) - 1))
+    cols = table.addManifoldData(PCA(n_components=2))
+    path = table.toColumnar()
+
+    loaded = ManifoldTable.fromColumnar(path)
+    assert loaded.getDF()["SMILES"].tolist() == SMILES
+    assert np.array_equal(loaded.getDF()["value"].values, table.getDF()["value"].values)
+    assert loaded.getDF()["label"].tolist()[1:] == ["a"] * (len(SMILES) - 1)
+    assert "objects" not in loaded.getDF().columns
+    assert np.allclose(loaded.getDF()[list(cols)].values, table.getDF()[list(cols)].values)
+    # the descriptors are read from the bit-packed store
+    X = table.getManifoldInput()
+    assert np.array_equal(loaded.getManifoldInput("packed").toDense(), X.values)
+    assert np.allclose(loaded.getManifold("PCA").transform(X.values[:3]), table.getDF()[list(cols)].values[:3])
+
+
+def test_cached_embedding(tmp_path, monkeypatch):
+    from scaffviz.data.cache import EmbeddingCache
+
+    cache = EmbeddingCache(str(tmp_path / "cache"))
+    table = ManifoldTable.fromMolTable(make_table(tmp_path), name="map")
+    calls = []
+    get_input = table.getManifoldInput
+    monkeypatch.setattr(table, "getManifoldInput", lambda *args: calls.append(args) or get_input(*args))
+    cols = table.addManifoldData(PCA(n_components=2), cache=cache)
+    # the descriptors are only prepared once for the cache key and the embedding
+    assert len(calls) == 1
+    coords = table.getDF()[cols].values
+
+    manifold = PCA(n_components=2)
+    other = ManifoldTable.fromMolTable(make_table(tmp_path / "other"), name="map")
+    other.addManifoldData(manifold, cache=cache, recalculate=False)
+    assert np.array_equal(other.getDF()[cols].values, coords)
+    assert not hasattr(manifold._model, "components_")
+
+
+def test_from_chunks(tmp_path):
+    from scaffviz.data.cache import EmbeddingCache
+
+    df = pd.DataFrame({"SMILES": SMILES})
+    chunks = (df.iloc[start:start + 15] for start in range(0, len(df), 15))
+    table = ManifoldTable.fromChunks("map", chunks, PCA(n_components=2), store_dir=str(tmp_path), fit_size=20, chunk_size=7, random_state=42)
+    assert table.getDF()["SMILES"].tolist() == SMILES
+    assert table.getDescriptorStore() is not None
+    # coordinates of a fit on a subsample are named after the landmark manifold
+    cols = ["Landmark_PCA_1", "Landmark_PCA_2"]
+    assert cols == [col for col in table.getDF().columns if "PCA" in col]
+    assert np.isfinite(table.getDF()[cols].values).all()
+    assert len(table.getManifold("Landmark_PCA").landmarks) == 20
+
+    # the fit on all molecules is cached apart from the fit on the subsample
+    cache = EmbeddingCache(str(tmp_path / "cache"))
+    assert table.addManifoldData(PCA(n_components=2), cache=cache) == ["PCA_1", "PCA_2"]
+    assert table.addManifoldData(PCA(n_components=2), cache=cache, fit_size=20, random_state=42, recalculate=False) == cols
+    assert len(cache.getEntries()) == 2
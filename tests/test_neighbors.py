@@ -0,0 +1,50 @@
+"""
+test_neighbors
+
+Created by: Martin Sicho
+On: 19.10.26, 00:05
+"""
+import numpy as np
+from scipy import sparse
+from sklearn.metrics import pairwise_distances
+
+from scaffviz.clustering.fingerprints import PackedFingerprints
+from scaffviz.clustering.manifold import TSNE
+from scaffviz.clustering.neighbors import TanimotoNeighbors
+
+from .test_fingerprints import random_fingerprints
+from .test_manifold import assert_projects_to_cluster
+
+
+def test_tanimoto_neighbors_match_jaccard():
+    X = random_fingerprints()
+    # an empty fingerprint and a duplicate are edge cases of the popcounts
+    X[0] = 0
+    X[1] = X[2]
+    expected = pairwise_distances(X[10:].astype(bool), X.astype(bool), metric="jaccard")
+    # small blocks make the search merge the neighbors of several blocks
+    search = TanimotoNeighbors(query_block=7, reference_block=16).fit(PackedFingerprints.fromDense(X))
+    distances, indices = search.query(PackedFingerprints.fromDense(X[10:]), 5)
+    assert distances.shape == indices.shape == (50, 5)
+    assert np.allclose(distances, np.sort(expected, axis=1)[:, :5], atol=1e-6)
+    assert np.allclose(np.take_along_axis(expected, indices, axis=1), distances, atol=1e-6)
+
+
+def test_tanimoto_graph():
+    X = random_fingerprints()
+    distances, indices = TanimotoNeighbors().getGraph(sparse.csr_matrix(X), 4)
+    assert np.array_equal(indices[:, 0], np.arange(len(X)))
+    assert np.all(distances[:, 0] == 0)
+    assert np.all(np.diff(distances, axis=1) >= 0)
+
+
+def test_tanimoto_tsne_transform():
+    rng = np.random.default_rng(42)
+    centers = rng.random((2, 128)) < 0.3
+    labels = np.repeat([0, 1], 30)
+    noise = rng.random((len(labels), 128)) < 0.03
+    X = PackedFingerprints.fromDense((centers[labels] ^ noise).astype(np.uint8))
+    manifold = TSNE(perplexity=5, random_state=42, neighbors=TanimotoNeighbors())
+    coords = manifold.fit_transform(X)
+    new_coords = manifold.transform(X[:3])
+    assert_projects_to_cluster(coords, new_coords, labels, labels[:3])
@@ -0,0 +1,82 @@
+"""
+test_performance
+
+Created by: Martin Sicho
+On: 19.10.26, 01:05
+"""
+import socket
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from scaffviz.clustering.manifold import PCA
+from scaffviz.depiction.performance import ModelPerformancePlot
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(scope="module")
+def models(tmp_path_factory):
+    from qsprpred import TargetTasks
+    from qsprpred.data import MoleculeTable, QSPRDataset, RandomSplit
+    from qsprpred.data.descriptors.fingerprints import MorganFP
+    from qsprpred.models.assessment.methods import CrossValAssessor, TestSetAssessor
+    from qsprpred.models.scikit_learn import SklearnModel
+    from sklearn.ensemble import RandomForestRegressor
+
+    work_dir = str(tmp_path_factory.mktemp("models"))
+    smiles = [f"{'C' * i}{group}" for i in range(1, 9) for group in ("", "O", "N", "Cl", "c1ccccc1")]
+    df = pd.DataFrame({"SMILES": smiles, "Value": np.random.default_rng(42).normal(6, 1, len(smiles))})
+    dataset = QSPRDataset.fromMolTable(
+        MoleculeTable("performance", df, store_dir=work_dir),
+        target_props=[{"name": "Value", "task": TargetTasks.REGRESSION}]
+    )
+    dataset.prepareDataset(split=RandomSplit(test_fraction=0.2), feature_calculators=[MorganFP(radius=2, nBits=128)])
+    models = []
+    for name in ("first", "second"):
+        model = SklearnModel(base_dir=work_dir, alg=RandomForestRegressor, name=name, parameters={"n_estimators": 5, "random_state": 42})
+        CrossValAssessor(scoring="r2")(model, dataset)
+        TestSetAssessor(scoring="r2")(model, dataset)
+        model.fitDataset(dataset)
+        models.append(model)
+    return models, [dataset, dataset]
+
+
+def test_ports_per_model(models):
+    models, datasets = models
+    ports = [free_port(), free_port()]
+    with pytest.raises(ValueError):
+        ModelPerformancePlot(PCA(), models, datasets, ports[:1] * 2)
+    with pytest.raises(ValueError):
+        ModelPerformancePlot(PCA(), models, datasets, ports[:1])
+    plot = ModelPerformancePlot(PCA(), models, datasets, ports)
+    info = plot.make(show=False)
+    try:
+        assert list(info) == ports
+        for port, model in zip(ports, models):
+            assert info[port]["model"] is model
+            assert info[port]["server"].port == port
+            assert f":{port}/" in info[port]["url"]
+            assert info[port]["server"].getApp(info[port]["route"]) is info[port]["app"]
+    finally:
+        plot.close()
+        for port in ports:
+            info[port]["server"].shutdown()
+
+
+def test_single_port(models):
+    models, datasets = models
+    port = free_port()
+    plot = ModelPerformancePlot(PCA(), models, datasets, port)
+    info = plot.make(show=False)
+    try:
+        assert list(info) == [plot.getRoute(model) for model in models]
+        assert {entry["server"].port for entry in info.values()} == {port}
+    finally:
+        plot.close()
+        plot.getServer().shutdown()
@@ -0,0 +1,41 @@
+"""
+test_plot
+
+Created by: Martin Sicho
+On: 19.10.26, 00:50
+"""
+from scaffviz.clustering.manifold import PCA
+from scaffviz.data.manifold_table import ManifoldTable
+from scaffviz.depiction.plot import Plot
+
+from .test_manifold_table import make_table
+
+
+def test_plot_does_not_modify_table(tmp_path):
+    table = ManifoldTable.fromMolTable(make_table(tmp_path), name="map")
+    table.addManifoldData(PCA(n_components=2))
+    before = table.getDF().copy()
+    n_descriptors = len(table.descriptors)
+    manifolds = dict(table.manifolds)
+
+    fig = Plot(PCA(n_components=2, whiten=True)).plot(table, interactive=False, recalculate=True)
+    assert len(fig.data[0].x) == len(before)
+    assert table.getDF().equals(before)
+    assert len(table.descriptors) == n_descriptors
+    assert table.manifolds == manifolds
+
+
+def test_plot_saves_manifold(tmp_path):
+    table = ManifoldTable.fromMolTable(make_table(tmp_path), name="map")
+    Plot(PCA(n_components=2), save_manifold=True).plot(table, interactive=False)
+    assert {"PCA_1", "PCA_2"} <= set(table.getDF().columns)
+    assert table.getManifold("PCA") is not None
+
+
+def test_plot_keeps_custom_data(tmp_path):
+    table = ManifoldTable.fromMolTable(make_table(tmp_path), name="map")
+    Plot(PCA(n_components=2)).plot(table, interactive=False)
+    fig = Plot(PCA(n_components=2)).plot(table, interactive=False, custom_data=["SMILES"])
+    # the row index stays in the first field
+    assert fig.data[0].customdata[:, 0].tolist() == list(range(len(table)))
+    assert fig.data[0].customdata[:, 1].tolist() == table.getDF()["SMILES"].tolist()
@@ -0,0 +1,87 @@
+"""
+test_predictions
+
+Created by: Martin Sicho
+On: 19.10.26, 01:55
+"""
+import os
+
+import pandas as pd
+import pytest
+
+from scaffviz.data import predictions
+from scaffviz.data.predictions import clear_predictions_cache, concat_categorical, load_predictions, to_labels
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    clear_predictions_cache()
+    yield
+    clear_predictions_cache()
+
+
+def write_predictions(path, values, mtime_ns):
+    df = pd.DataFrame({"QSPRID": ["a", "b", "c"], "Label": values, "Prediction": [0.5, 1.5, 2.5], "Fold": [0, 1, 0]})
+    df.to_csv(path, sep="\t", index=False)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+    return path
+
+
+def test_reload_on_change(tmp_path):
+    path = write_predictions(tmp_path / "predictions.tsv", [1, 2, 3], 10 ** 18)
+    df = load_predictions(path)
+    assert df.index.tolist() == ["a", "b", "c"]
+    assert load_predictions(path) is df
+    # same size, only the modification time tells the files apart
+    write_predictions(path, [4, 5, 6], 10 ** 18 + 10 ** 9)
+    changed = load_predictions(path)
+    assert changed is not df
+    assert changed["Label"].tolist() == [4, 5, 6]
+
+
+def test_requested_columns(tmp_path, monkeypatch):
+    path = write_predictions(tmp_path / "predictions.tsv", [1, 2, 3], 10 ** 18)
+    calls = []
+    read_table = pd.read_table
+    monkeypatch.setattr(pd, "read_table", lambda *args, **kwargs: calls.append(kwargs) or read_table(*args, **kwargs))
+    df = load_predictions(path, columns=["Prediction"])
+    assert df.columns.tolist() == ["Prediction"]
+    assert calls[-1]["usecols"] == ["QSPRID", "Prediction"]
+    # other columns are parsed separately
+    assert load_predictions(path, columns=["Label"]).columns.tolist() == ["Label"]
+
+
+def test_columnar_cache(tmp_path, monkeypatch):
+    pytest.importorskip("pyarrow")
+    path = write_predictions(tmp_path / "predictions.tsv", [1, 2, 3], 10 ** 18)
+    columnar_dir = tmp_path / "columnar"
+    df = load_predictions(path, columns=["Label", "Fold"], columnar_dir=str(columnar_dir))
+    assert df.columns.tolist() == ["Label", "Fold"]
+    assert len(os.listdir(columnar_dir)) == 1
+
+    # later calls read the columns from the columnar copy instead of parsing the file
+    clear_predictions_cache()
+    monkeypatch.setattr(predictions, "_read_table", lambda *args: pytest.fail("the file was parsed again"))
+    df = load_predictions(path, columns=["Prediction"], columnar_dir=str(columnar_dir))
+    assert df.columns.tolist() == ["Prediction"]
+    assert df.index.tolist() == ["a", "b", "c"]
+    assert df["Prediction"].tolist() == [0.5, 1.5, 2.5]
+
+
+def test_to_labels():
+    values = pd.Series([2.0, 0.0, 2.0, 1.0], index=list("abcd"), name="Fold")
+    labels = to_labels(values, "Fold_", offset=1)
+    assert labels.tolist() == ["Fold_3", "Fold_1", "Fold_3", "Fold_2"]
+    assert labels.cat.categories.tolist() == ["Fold_1", "Fold_2", "Fold_3"]
+    assert labels.index.tolist() == list("abcd")
+    assert labels.name == "Fold"
+
+
+def test_concat_categorical():
+    first = pd.DataFrame({"Label": pd.Categorical(["Class_0", "Class_1"]), "Value": [1, 2]})
+    second = pd.DataFrame({"Label": pd.Categorical(["Class_2"]), "Value": [3]})
+    df = concat_categorical([first, second])
+    assert isinstance(df["Label"].dtype, pd.CategoricalDtype)
+    assert df["Label"].tolist() == ["Class_0", "Class_1", "Class_2"]
+    assert df["Label"].cat.categories.tolist() == ["Class_0", "Class_1", "Class_2"]
+    assert df["Value"].tolist() == [1, 2, 3]
@@ -0,0 +1,65 @@
+"""
+test_registry
+
+Created by: Martin Sicho
+On: 19.10.26, 01:25
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from scaffviz.clustering.manifold import PCA
+from scaffviz.data.manifold_table import ManifoldTable
+from scaffviz.data.registry import EmbeddingRegistry
+
+from .test_manifold_table import make_table
+
+
+@pytest.fixture
+def fits(monkeypatch):
+    """Count the PCA fits, each of them slow enough for concurrent requests to overlap."""
+    calls = []
+    fit = PCA.fit
+
+    def counting_fit(self, X):
+        calls.append(threading.get_ident())
+        time.sleep(0.2)
+        return fit(self, X)
+
+    monkeypatch.setattr(PCA, "fit", counting_fit)
+    return calls
+
+
+def test_concurrent_requests(tmp_path, fits):
+    table = make_table(tmp_path)
+    registry = EmbeddingRegistry()
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        embeddings = list(executor.map(lambda _: registry.getEmbedding(table, PCA(n_components=2)), range(8)))
+    assert len(fits) == 1
+    assert all(embedding is embeddings[0] for embedding in embeddings)
+    assert embeddings[0].columns.tolist() == ["PCA_1", "PCA_2"]
+    assert len(registry) == 1
+    assert registry.getManifold(table, PCA(n_components=2)) is not None
+
+
+def test_use_existing(tmp_path, fits):
+    table = ManifoldTable.fromMolTable(make_table(tmp_path), name="map")
+    table.addManifoldData(PCA(n_components=3))
+    fits.clear()
+
+    # stored coordinates are only reused on request
+    assert EmbeddingRegistry().getEmbedding(table, PCA(n_components=3)).shape[1] == 3
+    assert len(fits) == 1
+
+    registry = EmbeddingRegistry(use_existing=True)
+    existing = registry.getEmbedding(table, PCA(n_components=3))
+    assert len(fits) == 1
+    assert existing.columns.tolist() == ["PCA_1", "PCA_2", "PCA_3"]
+    assert (existing.values == table.getDF()[existing.columns].values).all()
+
+    # coordinates of the same manifold with other settings are not reused
+    other = registry.getEmbedding(table, PCA(n_components=2, whiten=True))
+    assert len(fits) == 2
+    assert other.columns.tolist() == ["PCA_1", "PCA_2"]
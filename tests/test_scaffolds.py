@@ -0,0 +1,70 @@
+"""
+test_scaffolds
+
+Created by: Martin Sicho
+On: 19.10.26, 01:40
+"""
+from collections import OrderedDict
+
+import pandas as pd
+from qsprpred.data import MoleculeTable
+
+from scaffviz.data import scaffolds
+from scaffviz.data.scaffolds import OTHER_GROUP, ScaffoldIndex, get_scaffold_index
+
+BENZENES = ["c1ccccc1O", "c1ccccc1N", "c1ccccc1C", "c1ccccc1CC"]
+PYRIDINES = ["c1ccncc1O", "c1ccncc1N"]
+ACYCLIC = ["CCO"]
+
+
+def test_update(monkeypatch):
+    index = ScaffoldIndex()
+    smiles = pd.Series(BENZENES + PYRIDINES)
+    assert index.update(smiles) == 6
+    assert index.update(smiles) == 0
+    assert index.getScaffolds().tolist() == ["c1ccccc1"] * 4 + ["c1ccncc1"] * 2
+
+    computed = []
+    compute = scaffolds.compute_scaffolds
+    monkeypatch.setattr(scaffolds, "compute_scaffolds", lambda smi, *args, **kwargs: computed.extend(smi) or compute(smi, *args, **kwargs))
+    # only appended and changed molecules are calculated, removed molecules are dropped
+    changed = pd.concat([smiles.drop(index=[0]), pd.Series(ACYCLIC, index=[6])])
+    changed[5] = "C1CCCCC1O"
+    assert index.update(changed) == 2
+    assert sorted(computed) == sorted(["C1CCCCC1O", "CCO"])
+    assert len(index) == 6
+    assert index.getScaffolds().tolist() == ["c1ccccc1"] * 3 + ["c1ccncc1", "C1CCCCC1", ""]
+    assert index.getScaffolds().index.tolist() == [1, 2, 3, 4, 5, 6]
+
+    # precalculated scaffolds replace the scaffold types of the index
+    precalculated = pd.DataFrame({"Custom": ["a"] * 6}, index=changed.index)
+    assert index.update(changed, precalculated) == 6
+    assert index.kinds == ["Custom"]
+
+
+def test_groups():
+    smiles = pd.Series(BENZENES + PYRIDINES + ACYCLIC)
+    index = ScaffoldIndex()
+    index.update(smiles)
+    groups = index.getGroups(mols_per_group=2)
+    assert groups.name == "ScaffoldGroup_BemisMurcko_2"
+    assert groups.tolist() == ["c1ccccc1"] * 4 + ["c1ccncc1"] * 2 + [OTHER_GROUP]
+    assert index.getGroups(mols_per_group=3).tolist() == ["c1ccccc1"] * 4 + [OTHER_GROUP] * 3
+    assert set(index.getGroups(mols_per_group=5)) == {OTHER_GROUP}
+    # the groups are memoized until the index changes
+    assert index.getGroups(mols_per_group=2) is groups
+    index.update(pd.Series(BENZENES + PYRIDINES + ACYCLIC + ["c1ccncc1C"]))
+    assert index.getGroups(mols_per_group=3).tolist() == ["c1ccccc1"] * 4 + ["c1ccncc1"] * 2 + [OTHER_GROUP, "c1ccncc1"]
+
+
+def test_shared_indices(tmp_path, monkeypatch):
+    monkeypatch.setattr(scaffolds, "MAX_INDICES", 2)
+    monkeypatch.setattr(scaffolds, "_INDICES", OrderedDict())
+    tables = [MoleculeTable(f"table_{i}", pd.DataFrame({"SMILES": BENZENES}), store_dir=str(tmp_path)) for i in range(3)]
+    first = get_scaffold_index(tables[0])
+    assert get_scaffold_index(tables[0]) is first
+    get_scaffold_index(tables[1])
+    get_scaffold_index(tables[2])
+    # the least recently used index is dropped
+    assert len(scaffolds._INDICES) == 2
+    assert get_scaffold_index(tables[0]) is not first
@@ -0,0 +1,67 @@
+"""
+test_spatial
+
+Created by: Martin Sicho
+On: 19.10.26, 00:25
+"""
+import numpy as np
+import pytest
+
+from scaffviz.data.spatial import SpatialIndex
+
+
+@pytest.fixture
+def points():
+    rng = np.random.default_rng(42)
+    x, y = rng.normal(size=(2, 1000))
+    x[3] = np.nan
+    return x, y
+
+
+def test_rect(points):
+    x, y = points
+    index = SpatialIndex(x, y, points_per_cell=8)
+    expected = np.flatnonzero((x >= -0.5) & (x <= 1) & (y >= -1) & (y <= 0.2))
+    assert np.array_equal(index.rect((1, -0.5), (-1, 0.2)), expected)
+    assert np.array_equal(index.rect(None, (-1, 0.2)), np.flatnonzero((y >= -1) & (y <= 0.2) & np.isfinite(x)))
+    assert np.array_equal(index.rect(), np.flatnonzero(np.isfinite(x)))
+    assert len(index.rect((10, 11), (10, 11))) == 0
+
+
+def test_lasso(points):
+    x, y = points
+    index = SpatialIndex(x, y)
+    # a triangle with the vertices (0, 0), (2, 0) and (0, 2)
+    expected = np.flatnonzero((x > 0) & (y > 0) & (x + y < 2))
+    assert np.array_equal(index.lasso([0, 2, 0], [0, 0, 2]), expected)
+
+
+def test_nearest(points):
+    x, y = points
+    index = SpatialIndex(x, y)
+    distances = np.hypot(x - 0.3, y + 0.1)
+    position, distance = index.nearest(0.3, -0.1)
+    assert position == np.nanargmin(distances)
+    assert distance == pytest.approx(np.nanmin(distances))
+    assert index.nearest(0.3, -0.1, max_distance=np.nanmin(distances) / 2)[0] == -1
+
+
+def test_kneighbors(points):
+    x, y = points
+    index = SpatialIndex(x, y)
+    distances, indices = index.kneighbors([0, 10], k=5)
+    for row, own in enumerate([0, 10]):
+        expected = np.hypot(x - x[own], y - y[own])
+        expected[own] = np.inf
+        assert own not in indices[row]
+        assert np.allclose(distances[row], np.sort(np.nan_to_num(expected, nan=np.inf))[:5])
+    distances, indices = index.kneighbors(np.array([[0.0, 0.0]]), k=3)
+    assert indices.shape == (1, 3)
+    assert np.all(np.diff(distances[0]) >= 0)
+
+
+def test_small_index():
+    index = SpatialIndex([0.0, 1.0], [0.0, 1.0])
+    distances, indices = index.kneighbors([0], k=3)
+    assert indices.tolist() == [[1, -1, -1]]
+    assert np.isinf(distances[0, 1:]).all()